@@ -0,0 +1,764 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from math import log
+from numpy import amax, amin, asarray, ceil as array_ceil, concatenate
+from numpy import log as array_log, mean, nan, percentile, sum, unique
+
+class Aggregator:
+    """Base class of the online aggregators. An aggregator consumes values in
+    batches with update, can be combined with another aggregator of the same
+    kind with merge, and returns its result with result. Aggregators are
+    callable, so they can be used as downsample functions: calling one with an
+    array returns the result of a fresh aggregator updated with the array.
+
+    Subclasses provide the aggregation by implementing these methods:
+        * update(values): Add a numpy.array of values to the aggregation.
+        * merge(other): Add the data aggregated by another aggregator of the
+          same kind.
+        * result(): Return the result of the aggregation, a float or an int.
+    The base class only provides calling, empty copies and the detection of
+    aggregators by as_aggregator."""
+
+    def __init__(self, **params):
+        """Initialize the aggregator. Parameters are stored to create empty
+        copies with the same configuration.
+
+        Parameters
+        ----------
+            params : dict
+                The configuration of the aggregator
+
+        Returns
+        -------
+            None
+        """
+        self._params = params
+
+    def __call__(self, values):
+        """Aggregate an array of values with a fresh aggregator.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to aggregate
+
+        Returns
+        -------
+            float, int
+                The result of the aggregation
+        """
+        res = self.empty()
+        res.update(values)
+        return res.result()
+
+    def empty(self):
+        """Return a new aggregator with the same configuration and no data.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            Aggregator
+                The empty aggregator
+        """
+        return self.__class__(**self._params)
+
+class Count(Aggregator):
+    """Counts the values."""
+
+    def __init__(self):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        Aggregator.__init__(self)
+        self.count = 0
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        self.count += len(values)
+
+    def merge(self, other):
+        """Merge the data of another Count into this one.
+
+        Parameters
+        ----------
+            other : Count
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        self.count += other.count
+
+    def result(self):
+        """Return the number of values.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            int
+                The number of values
+        """
+        return self.count
+
+class Sum(Aggregator):
+    """Sums the values. The sum of no values is 0."""
+
+    def __init__(self):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        Aggregator.__init__(self)
+        self.sum = 0
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        if len(values) != 0:
+            self.sum += sum(values)
+
+    def merge(self, other):
+        """Merge the data of another Sum into this one.
+
+        Parameters
+        ----------
+            other : Sum
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        self.sum += other.sum
+
+    def result(self):
+        """Return the sum of the values.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            float, int
+                The sum of the values
+        """
+        return self.sum
+
+class Mean(Aggregator):
+    """Computes the mean of the values. The mean of no values is NaN."""
+
+    def __init__(self):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        Aggregator.__init__(self)
+        self.count = 0
+        self.sum = 0.
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        if len(values) != 0:
+            self.count += len(values)
+            self.sum += sum(asarray(values, dtype=float))
+
+    def merge(self, other):
+        """Merge the data of another Mean into this one.
+
+        Parameters
+        ----------
+            other : Mean
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        self.count += other.count
+        self.sum += other.sum
+
+    def result(self):
+        """Return the mean of the values.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            float
+                The mean of the values
+        """
+        return self.sum/self.count if self.count != 0 else nan
+
+class Min(Aggregator):
+    """Finds the minimum of the values. The minimum of no values is NaN."""
+
+    def __init__(self):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        Aggregator.__init__(self)
+        self.min = None
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        if len(values) != 0:
+            value = amin(values)
+            if self.min is None or value < self.min:
+                self.min = value
+
+    def merge(self, other):
+        """Merge the data of another Min into this one.
+
+        Parameters
+        ----------
+            other : Min
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        if not other.min is None:
+            self.update([other.min])
+
+    def result(self):
+        """Return the minimum of the values.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            float, int
+                The minimum of the values
+        """
+        return self.min if not self.min is None else nan
+
+class Max(Aggregator):
+    """Finds the maximum of the values. The maximum of no values is NaN."""
+
+    def __init__(self):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        Aggregator.__init__(self)
+        self.max = None
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        if len(values) != 0:
+            value = amax(values)
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        """Merge the data of another Max into this one.
+
+        Parameters
+        ----------
+            other : Max
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        if not other.max is None:
+            self.update([other.max])
+
+    def result(self):
+        """Return the maximum of the values.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            float, int
+                The maximum of the values
+        """
+        return self.max if not self.max is None else nan
+
+class Variance(Aggregator):
+    """Computes the variance of the values with Welford's method, combining
+    batches and merged aggregators with the pairwise update of Chan et al. This
+    avoids the cancellation of the naive sum of squares formula. The variance
+    of fewer than ddof + 1 values is NaN."""
+
+    def __init__(self, ddof=0):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            ddof : int
+                Delta degrees of freedom, the divisor is count - ddof, as for
+                numpy.var.
+                (Default: 0)
+
+        Returns
+        -------
+            None
+        """
+        Aggregator.__init__(self, ddof=ddof)
+        self._ddof = ddof
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def _combine(self, count, mean, m2):
+        """Combine the state with the count, mean and sum of squared
+        deviations of another set of values.
+
+        Parameters
+        ----------
+            count : int
+                The number of the other values
+            mean : float
+                The mean of the other values
+            m2 : float
+                The sum of squared deviations from the mean of the other values
+
+        Returns
+        -------
+            None
+        """
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta*delta*self.count*count/total
+        self.mean += delta*count/total
+        self.count = total
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        values = asarray(values, dtype=float)
+        if len(values) != 0:
+            batch_mean = mean(values)
+            self._combine(len(values), batch_mean,
+                          sum((values - batch_mean)**2))
+
+    def merge(self, other):
+        """Merge the data of another Variance into this one.
+
+        Parameters
+        ----------
+            other : Variance
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        self._combine(other.count, other.mean, other.m2)
+
+    def result(self):
+        """Return the variance of the values.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            float
+                The variance of the values
+        """
+        if self.count <= self._ddof:
+            return nan
+        return self.m2/(self.count - self._ddof)
+
+class Quantile(Aggregator):
+    """Estimates a quantile of the values in bounded memory. Values are counted
+    in logarithmically sized buckets (as in the DDSketch algorithm): bucket k
+    holds the magnitudes in (gamma**(k - 1), gamma**k] with
+    gamma = (1 + relative_accuracy)/(1 - relative_accuracy), separately for
+    positive and negative values, and zeros are counted on their own.
+
+    Error bound: the estimate x' of the q-quantile x (the value of rank
+    floor(q*(count - 1)) in the sorted values) satisfies
+    |x' - x| <= relative_accuracy*|x|. Bucket counts are added when merging, so
+    merged sketches keep the same bound. If more than max_buckets buckets are
+    in use, the buckets of the smallest magnitudes are collapsed, and the bound
+    only holds for quantiles outside of the collapsed range. With
+    relative_accuracy=0.01, 2048 buckets cover magnitudes over 17 orders of
+    magnitude. Note that for an even number of values, numpy.median averages
+    the two middle values, while the estimate refers to the lower one.
+
+    Exact fallback: with exact=True, all values are kept and the quantile is
+    computed with numpy.percentile, at the cost of memory proportional to the
+    number of values."""
+
+    def __init__(self, q=0.5, relative_accuracy=0.01, max_buckets=2048,
+                 exact=False):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            q : float
+                The quantile to estimate, between 0 and 1.
+                (Default: 0.5)
+            relative_accuracy : float
+                The relative accuracy of the estimate, between 0 and 1.
+                (Default: 0.01)
+            max_buckets : int
+                The maximum number of buckets per sign.
+                (Default: 2048)
+            exact : bool
+                If True, keep all values and compute the exact quantile.
+                (Default: False)
+
+        Returns
+        -------
+            None
+        """
+        if not 0 <= q <= 1:
+            raise ValueError('The quantile must be between 0 and 1')
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('The relative accuracy must be between 0 and 1')
+        Aggregator.__init__(self, q=q, relative_accuracy=relative_accuracy,
+                            max_buckets=max_buckets, exact=exact)
+        self._q = q
+        self._gamma = (1 + relative_accuracy)/(1 - relative_accuracy)
+        self._log_gamma = log(self._gamma)
+        self._max_buckets = max_buckets
+        self._exact = exact
+        self._values = []
+        self._positive = {}
+        self._negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _add_counts(self, store, magnitudes):
+        """Count magnitudes in the buckets of a store.
+
+        Parameters
+        ----------
+            store : dict
+                The bucket counts, keyed by bucket index
+            magnitudes : numpy.array
+                The positive magnitudes to count
+
+        Returns
+        -------
+            None
+        """
+        if len(magnitudes) == 0:
+            return
+        keys, counts = unique(array_ceil(array_log(magnitudes)
+                                         /self._log_gamma).astype(int),
+                              return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+        self._collapse(store)
+
+    def _collapse(self, store):
+        """Merge the buckets of the smallest magnitudes until at most
+        max_buckets are in use.
+
+        Parameters
+        ----------
+            store : dict
+                The bucket counts, keyed by bucket index
+
+        Returns
+        -------
+            None
+        """
+        if len(store) <= self._max_buckets:
+            return
+        keys = sorted(store)
+        excess = keys[:len(keys) - self._max_buckets]
+        target = keys[len(excess)]
+        for key in excess:
+            store[target] += store.pop(key)
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        values = asarray(values, dtype=float)
+        self.count += len(values)
+        if self._exact:
+            if len(values) != 0:
+                self._values.append(values)
+            return
+        self.zero_count += int((values == 0).sum())
+        self._add_counts(self._positive, values[values > 0])
+        self._add_counts(self._negative, -values[values < 0])
+
+    def merge(self, other):
+        """Merge the data of another Quantile into this one.
+
+        Parameters
+        ----------
+            other : Quantile
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        if self._exact != other._exact or self._gamma != other._gamma:
+            raise ValueError('Can only merge quantiles of the same accuracy')
+        self.count += other.count
+        self._values.extend(other._values)
+        self.zero_count += other.zero_count
+        for store, other_store in ((self._positive, other._positive),
+                                   (self._negative, other._negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+            self._collapse(store)
+
+    def _value(self, key):
+        """Return the estimate for the magnitudes in a bucket.
+
+        Parameters
+        ----------
+            key : int
+                The bucket index
+
+        Returns
+        -------
+            float
+                The magnitude with the smallest relative error to all
+                magnitudes in the bucket
+        """
+        return 2*self._gamma**key/(self._gamma + 1)
+
+    def result(self):
+        """Return the estimated quantile.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            float
+                The estimated quantile
+        """
+        if self.count == 0:
+            return nan
+        if self._exact:
+            return percentile(concatenate(self._values), 100*self._q)
+        rank = int(self._q*(self.count - 1))
+        seen = 0
+        for key in sorted(self._negative, reverse=True):
+            seen += self._negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.
+        for key in sorted(self._positive):
+            seen += self._positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self._positive))
+
+class Collect(Aggregator):
+    """Keeps all values and applies an arbitrary downsample function to them.
+    This is the exact fallback for functions without an online aggregator."""
+
+    def __init__(self, func):
+        """Initialize the aggregator.
+
+        Parameters
+        ----------
+            func : callable
+                The function to apply. Must accept a numpy.array and return a
+                single value.
+
+        Returns
+        -------
+            None
+        """
+        Aggregator.__init__(self, func=func)
+        self._func = func
+        self._values = []
+
+    def update(self, values):
+        """Add a batch of values.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values to add
+
+        Returns
+        -------
+            None
+        """
+        self._values.append(asarray(values))
+
+    def merge(self, other):
+        """Merge the data of another Collect into this one.
+
+        Parameters
+        ----------
+            other : Collect
+                The aggregator to merge
+
+        Returns
+        -------
+            None
+        """
+        self._values.extend(other._values)
+
+    def result(self):
+        """Return the result of the function.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            object
+                The result of the function
+        """
+        if len(self._values) == 0:
+            return self._func(asarray([]))
+        return self._func(concatenate(self._values))
+
+#Aggregators for the reductions of the binning engine and numpy functions:
+_AGGREGATORS = {'count': Count, 'sum': Sum, 'mean': Mean, 'min': Min,
+                'max': Max, sum: Sum, mean: Mean, amin: Min, amax: Max}
+
+def as_aggregator(func):
+    """Return an online aggregator for a downsample function. Aggregators are
+    returned unchanged, reduction names and the matching numpy functions are
+    mapped to their aggregators, and any other callable is wrapped in Collect.
+
+    Parameters
+    ----------
+        func : Aggregator, callable, string
+            The downsample function
+
+    Returns
+    -------
+        Aggregator
+            An empty aggregator computing the downsample function
+    """
+    if isinstance(func, Aggregator):
+        return func.empty()
+    if isinstance(func, basestring):
+        if not func in _AGGREGATORS:
+            raise ValueError('Unknown reduction ' + func)
+        return _AGGREGATORS[func]()
+    if func in _AGGREGATORS:
+        return _AGGREGATORS[func]()
+    return Collect(func)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the scaling of fleet.aggregate_databases with the number of 
+worker processes.
+
+Usage: python benchmarks/bench_fleet.py [databases] [rows per database]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from multiprocessing import cpu_count
+from numpy import arange
+from synthetic_db import START_TIMESTAMP, create_database
+from fleet import aggregate_databases
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        databases = []
+        for i in range(count):
+            filename = os.path.join(tmpdir, 'gadgetbridge{0:d}.db'.format(i))
+            create_database(filename, rows, seed=i)
+            databases.append((filename, 'MI Band'))
+        origin = datetime.fromtimestamp(START_TIMESTAMP)
+        print('databases: {0:d}, rows each: {1:d}'.format(count, rows))
+        processes = 1
+        while processes <= cpu_count():
+            start = time.time()
+            res = aggregate_databases(databases, 'heartrate', origin, 
+                                      timedelta(days=1), 
+                                      hist_edges=arange(0, 260, 5),
+                                      processes=processes)
+            print('processes: {0:2d} {1:8.2f} s, failures: {2:d}'.format(
+                    processes, time.time() - start, len(res.failures())))
+            processes *= 2
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark many small range queries, with the limits bound as parameters
+like GadgetbridgeDatabase does, against the same queries with the limits
+formatted into the query text, which SQLite has to parse and plan anew for
+every range, and against a working copy with a covering timestamp index.
+
+Usage: python benchmarks/bench_range_queries.py [queries] [rows]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+from random import Random
+from synthetic_db import START_TIMESTAMP, create_database
+from gb_database import GadgetbridgeDatabase
+from connection_pool import URI_SUPPORTED
+
+def bench(db, ranges, inline):
+    """Run one query per range, return queries/second."""
+    start = time.time()
+    for timestamp_min, timestamp_max in ranges:
+        querystring, params = db._build_querystring(
+            ['heartrate', 'steps'], timestamp_min=timestamp_min, 
+            timestamp_max=timestamp_max, accepted_only=True, ordered=True)
+        if inline:
+            querystring = querystring.replace('?', '{}').format(*params)
+            params = ()
+        db._query(querystring, params)
+        db.results.all()
+    return len(ranges)/(time.time() - start)
+
+if __name__ == '__main__':
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    rand = Random(0)
+    #Ranges of 5 to 60 minutes, like the detail views of a dashboard:
+    ranges = []
+    for i in range(queries):
+        timestamp_min = START_TIMESTAMP + 60*rand.randrange(rows)
+        ranges.append((timestamp_min, 
+                       timestamp_min + 60*rand.randrange(5, 60)))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'gadgetbridge.db')
+        create_database(filename, rows)
+        db = GadgetbridgeDatabase(filename, 'MI Band', read_only=True)
+        print('queries: {0:d}, rows: {1:d}'.format(queries, rows))
+        print('inline limits: {0:10.0f} queries/s'.format(
+            bench(db, ranges, inline=True)))
+        print('bound limits:  {0:10.0f} queries/s'.format(
+            bench(db, ranges, inline=False)))
+        db.close()
+        db = GadgetbridgeDatabase(filename, 'MI Band', working_copy='memory' 
+                                  if URI_SUPPORTED else 'file')
+        print('working copy:  {0:10.0f} queries/s'.format(
+            bench(db, ranges, inline=False)))
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir)
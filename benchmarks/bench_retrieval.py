@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark GadgetbridgeDatabase.retrieve_dataset in row-wise and bulk mode.
+
+Usage: python benchmarks/bench_retrieval.py [rows]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+from synthetic_db import create_database
+from gb_database import GadgetbridgeDatabase
+
+def bench(db, rows, **kwargs):
+    """Time one retrieval of the heartrate dataset, return rows/second."""
+    start = time.time()
+    db.retrieve_dataset('heartrate', **kwargs)['values']
+    return rows/(time.time() - start)
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'gadgetbridge.db')
+        create_database(filename, rows)
+        db = GadgetbridgeDatabase(filename, 'MI Band')
+        print('rows: {0:d}'.format(rows))
+        print('row-wise: {0:12.0f} rows/s'.format(bench(db, rows, bulk=False)))
+        print('bulk:     {0:12.0f} rows/s'.format(bench(db, rows, bulk=True)))
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Helpers to create synthetic Gadgetbridge databases for the benchmarks."""
+import os
+import sys
+import sqlite3
+from random import Random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from device_db_mapping import device_db_mapping
+
+#2018-01-01 00:00:00 UTC
+START_TIMESTAMP = 1514764800
+
+def create_database(filename, rows, device='MI Band', seed=0):
+    """Create a database file containing per-minute samples for a device.
+    
+    Parameters
+    ----------
+        filename : string
+            The name of the SQLite database file to create
+        rows : int
+            The number of per-minute samples to write
+        device : string
+            The device whose table layout should be used.
+            (Default: 'MI Band')
+        seed : int
+            The seed for the random sample values.
+            (Default: 0)
+    
+    Returns
+    -------
+        None
+    """
+    names = device_db_mapping[device]
+    columns = [name for key, name in sorted(names.items()) 
+               if key not in ('table', 'timestamp', 'device_id')]
+    rand = Random(seed)
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE {table:s} ({timestamp:s} INTEGER NOT NULL, '
+               'DEVICE_ID INTEGER NOT NULL, {columns:s}, PRIMARY KEY '
+               '({timestamp:s}, DEVICE_ID));'.format(
+                   table=names['table'], timestamp=names['timestamp'],
+                   columns=', '.join(col + ' INTEGER NOT NULL' 
+                                     for col in columns)))
+    insert = 'INSERT INTO {table:s} VALUES ({marks:s});'.format(
+        table=names['table'], marks=', '.join(['?']*(len(columns) + 2)))
+    batch = []
+    for i in range(rows):
+        row = [START_TIMESTAMP + 60*i, 1]
+        for col in columns:
+            if col == 'HEART_RATE' and rand.random() < 0.3:
+                row.append(255)
+            else:
+                row.append(rand.randint(0, 200))
+        batch.append(row)
+        if len(batch) == 100000:
+            db.executemany(insert, batch)
+            batch = []
+    db.executemany(insert, batch)
+    db.commit()
+    db.close()
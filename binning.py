@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from numpy import add, minimum, maximum, arange, argsort, asarray, bincount
+from numpy import concatenate, cumsum, diff, full, int64, nan, result_type
+from numpy import searchsorted, split, timedelta64
+
+#Reductions that can be computed with numpy ufuncs over all bins at once:
+_UFUNCS = {'sum': add, 'min': minimum, 'max': maximum}
+#Value of each reduction for bins that do not contain any data:
+_EMPTY_VALUES = {'sum': 0, 'min': nan, 'max': nan, 'mean': nan}
+
+def to_ticks(timestamps):
+    """Convert datetimes or datetime64 values to integer microseconds.
+
+    Parameters
+    ----------
+        timestamps : numpy.array, datetime.datetime
+            The timestamps to convert
+
+    Returns
+    -------
+        numpy.array
+            The timestamps as int64 microseconds since the epoch
+    """
+    return asarray(timestamps, dtype='datetime64[us]').astype(int64)
+
+def resolution_ticks(resolution):
+    """Convert a time resolution to integer microseconds.
+
+    Parameters
+    ----------
+        resolution : datetime.timedelta
+            The time resolution to convert
+
+    Returns
+    -------
+        int
+            The resolution in microseconds
+    """
+    return int(timedelta64(resolution, 'us').astype(int64))
+
+class TimeBinning:
+    """Assigns timestamps to consecutive time bins of fixed width and reduces
+    values per bin. The bin index of each timestamp is computed once by integer
+    division, so all reductions scale linearly with the number of points
+    instead of with the number of points times the number of bins."""
+
+    def __init__(self, timestamps, start, resolution, end=None):
+        """Compute the bin assignment for a set of timestamps. Bin i covers
+        start + i*resolution <= timestamp < start + (i + 1)*resolution.
+        Timestamps outside of the covered bins are ignored.
+
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps to bin, as datetime64 or datetime objects
+            start : datetime.datetime, numpy.datetime64
+                The start of the first bin
+            resolution : datetime.timedelta
+                The width of each bin
+            end : datetime.datetime, numpy.datetime64, None
+                The last timestamp that must be covered by a bin. If None, the
+                latest timestamp passed is used.
+                (Default: None)
+
+        Returns
+        -------
+            None
+        """
+        ticks = to_ticks(timestamps)
+        self._origin = int(to_ticks(start))
+        self._width = resolution_ticks(resolution)
+        if end is None:
+            end = ticks.max() if len(ticks) != 0 else self._origin
+        self.nbins = int((int(to_ticks(end)) - self._origin)//self._width) + 1
+        indices = (ticks - self._origin)//self._width
+        self._inside = (indices >= 0)*(indices < self.nbins)
+        indices = indices[self._inside]
+        #Data is usually stored in order, only sort if necessary:
+        if len(indices) > 1 and (diff(indices) < 0).any():
+            self._order = argsort(indices, kind='mergesort')
+            indices = indices[self._order]
+        else:
+            self._order = None
+        self._indices = indices
+        self.counts = bincount(indices, minlength=self.nbins)
+        self._bounds = concatenate(([0], cumsum(self.counts)))
+        self._nonempty = self.counts > 0
+        self._starts = self._bounds[:-1][self._nonempty]
+
+    def timestamps(self):
+        """Return the start timestamps of all bins.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            numpy.array
+                The bin start timestamps as datetime64 array
+        """
+        return (self._origin + arange(self.nbins, dtype=int64)*self._width)\
+            .astype('datetime64[us]')
+
+    def _sorted(self, values):
+        """Return the values of the binned timestamps, ordered by bin.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values belonging to the timestamps passed on construction
+
+        Returns
+        -------
+            numpy.array
+                The values inside the bins, ordered by bin index
+        """
+        values = asarray(values)[self._inside]
+        if self._order is not None:
+            values = values[self._order]
+        return values
+
+    def reduce(self, values, how):
+        """Reduce the values per bin. Empty bins yield 0 for sums and NaN for
+        mean, min and max.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values belonging to the timestamps passed on construction
+            how : string
+                The reduction to perform. Must be one of the following:
+                    * sum
+                    * mean
+                    * min
+                    * max
+                    * count
+
+        Returns
+        -------
+            numpy.array
+                One reduced value per bin
+        """
+        if how == 'count':
+            return self.counts
+        if not how in _EMPTY_VALUES:
+            raise ValueError('Unknown reduction ' + str(how))
+        values = self._sorted(values)
+        if how == 'mean':
+            values = values.astype(float)
+            ufunc = add
+        else:
+            ufunc = _UFUNCS[how]
+        fill = _EMPTY_VALUES[how]
+        res = full(self.nbins, fill, dtype=result_type(values.dtype,
+                                                       type(fill)))
+        if len(self._starts) != 0:
+            res[self._nonempty] = ufunc.reduceat(values, self._starts)
+        if how == 'mean':
+            res[self._nonempty] /= self.counts[self._nonempty]
+        return res
+
+    def apply(self, values, func):
+        """Apply an arbitrary function to the values of each bin. func is
+        called once per bin, with an empty array for empty bins.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values belonging to the timestamps passed on construction
+            func : callable
+                The function to apply. Must accept a numpy.array and return a
+                single value.
+
+        Returns
+        -------
+            list
+                The results of func for each bin
+        """
+        return [func(chunk) for chunk in split(self._sorted(values),
+                                               self._bounds[1:-1])]
+
+    def histogram(self, values, edges):
+        """Compute a 1D histogram of the values in each bin in one pass. The
+        value bin of every point is found by binary search in the edges, and 
+        the combined time and value bin index is counted with bincount. As for
+        numpy.histogram, all value bins but the last are half open, the last 
+        one includes the upper edge, and values outside the edges are ignored.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values belonging to the timestamps passed on construction
+            edges : numpy.array
+                The monotonically increasing value bin edges
+
+        Returns
+        -------
+            numpy.array
+                The counts, with shape (number of time bins, len(edges) - 1)
+        """
+        values = self._sorted(values)
+        edges = asarray(edges)
+        nvalue_bins = len(edges) - 1
+        value_indices = searchsorted(edges, values, side='right') - 1
+        value_indices[values == edges[-1]] = nvalue_bins - 1
+        inside = (value_indices >= 0)*(value_indices < nvalue_bins)
+        flat_indices = self._indices[inside]*nvalue_bins \
+            + value_indices[inside]
+        return bincount(flat_indices, minlength=self.nbins*nvalue_bins)\
+            .reshape((self.nbins, nvalue_bins))
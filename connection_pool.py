@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import sys
+import tempfile
+from threading import Lock, current_thread, local
+try:
+    from urllib import pathname2url
+except ImportError:
+    from urllib.request import pathname2url
+
+#Whether URI filenames are passed with the uri argument of sqlite3.connect:
+_URI_ARGUMENT = sys.version_info >= (3, 4)
+#Pragmas applied to every connection, unless overridden. The page cache is
+#given in KiB by a negative cache_size:
+DEFAULT_PRAGMAS = {'cache_size': -65536, 'mmap_size': 268435456,
+                   'temp_store': 'MEMORY'}
+
+def _uri_filenames():
+    """Check whether sqlite3.connect accepts URI filenames. Without the uri
+    argument, filenames are passed on unchanged, and SQLite takes them as 
+    URIs if it was built with URI filenames enabled.
+
+    Parameters
+    ----------
+        None
+
+    Returns
+    -------
+        bool
+            Whether URI filenames are supported
+    """
+    if _URI_ARGUMENT:
+        return True
+    #Taken as plain filename, the probe is a relative path in a missing
+    #directory named file:, so it cannot be opened:
+    probe = 'file:' + pathname2url(os.path.join(
+        tempfile.gettempdir(), 'gadgetbridge-uri-probe')) + '?mode=memory'
+    try:
+        sqlite3.connect(probe).close()
+    except sqlite3.Error:
+        return False
+    return True
+
+#Whether sqlite3.connect accepts URI filenames. Before Python 3.4, this
+#depends on how SQLite was built:
+URI_SUPPORTED = _uri_filenames()
+
+def _connect(filename, uri=False):
+    """Open a connection that may be used from other threads than the one
+    that opened it.
+
+    Parameters
+    ----------
+        filename : string
+            The name of the SQLite database file, or its URI if uri is True
+        uri : bool
+            Whether the filename is a URI, which requires URI support.
+            (Default: False)
+
+    Returns
+    -------
+        sqlite3.Connection
+            The connection
+    """
+    if uri and not URI_SUPPORTED:
+        raise sqlite3.NotSupportedError('URI filenames are not supported by '
+                                        'sqlite3')
+    if uri and _URI_ARGUMENT:
+        return sqlite3.connect(filename, uri=True, check_same_thread=False)
+    return sqlite3.connect(filename, check_same_thread=False)
+
+def _pragma_statement(name, value):
+    """Build a PRAGMA statement, as pragmas cannot be set with bound
+    parameters.
+
+    Parameters
+    ----------
+        name : string
+            The name of the pragma
+        value : int, string
+            The value of the pragma, a number or a keyword
+
+    Returns
+    -------
+        string
+            The statement
+    """
+    if not name.replace('_', '').isalnum():
+        raise ValueError('Invalid pragma name ' + repr(name))
+    if isinstance(value, bool):
+        value = int(value)
+    if not isinstance(value, (int, long)) and \
+            not str(value).replace('_', '').isalnum():
+        raise ValueError('Invalid value of pragma ' + name + ': '
+                         + repr(value))
+    return 'PRAGMA {name:s} = {value:s};'.format(name=name, value=str(value))
+
+def _check_immutable(immutable, uri):
+    """Refuse to open a file as immutable without URI support, as it would
+    silently be opened with locking.
+    
+    Parameters
+    ----------
+        immutable : bool
+            Whether the file is to be opened as immutable
+        uri : bool
+            Whether the filename is a URI, which ignores immutable
+    
+    Returns
+    -------
+        None
+    """
+    if immutable and not uri and not URI_SUPPORTED:
+        raise sqlite3.NotSupportedError('Opening a file as immutable requires '
+                                        'URI support of sqlite3')
+
+def open_connection(filename, read_only=False, immutable=False, pragmas=None,
+                    uri=False):
+    """Open a connection to a database file and apply pragmas to it.
+
+    Parameters
+    ----------
+        filename : string
+            The name of the SQLite database file, or its URI if uri is True
+        read_only : bool
+            If True, the file is opened in read-only mode through a URI, so
+            it is never modified or created. Without URI support, the file is
+            opened normally and writes are refused with the query_only pragma.
+            (Default: False)
+        immutable : bool
+            If True, the file is opened read-only and SQLite assumes it does
+            not change while open, so it skips all locking. Only use it on
+            exports nothing writes to. Requires URI support, otherwise
+            sqlite3.NotSupportedError is raised.
+            (Default: False)
+        pragmas : dict, None
+            The pragmas to apply by name, in addition to and overriding
+            DEFAULT_PRAGMAS.
+            (Default: None)
+        uri : bool
+            If True, the filename is opened as URI, which requires URI
+            support. Writes are refused with the query_only pragma if
+            read_only is True, immutable is ignored.
+            (Default: False)
+
+    Returns
+    -------
+        sqlite3.Connection
+            The connection. It may be used from another thread than the one
+            that opened it, e.g. to close it.
+    """
+    _check_immutable(immutable, uri)
+    read_only = read_only or immutable
+    if read_only and not uri and URI_SUPPORTED:
+        filename = 'file:' + pathname2url(os.path.abspath(filename)) + \
+            '?mode=ro'
+        if immutable:
+            filename += '&immutable=1'
+        connection = _connect(filename, uri=True)
+    else:
+        if read_only and not uri and not os.path.isfile(filename):
+            #No URI support, refuse to create the file at least:
+            raise sqlite3.OperationalError('unable to open database file')
+        connection = _connect(filename, uri=uri)
+        if read_only:
+            connection.execute('PRAGMA query_only = ON;')
+    settings = dict(DEFAULT_PRAGMAS)
+    settings.update(pragmas or {})
+    for name in sorted(settings):
+        connection.execute(_pragma_statement(name, settings[name])).fetchall()
+    return connection
+
+class ConnectionPool:
+    """Hands out one connection to a database file per thread, so several
+    threads can query the file in parallel without sharing a connection. The
+    connection of a thread is opened on its first request, and closed once
+    the thread has finished or the pool is closed."""
+
+    def __init__(self, filename, read_only=False, immutable=False,
+                 pragmas=None, uri=False):
+        """Initialize the pool. The arguments are used to open each
+        connection, see open_connection.
+
+        Parameters
+        ----------
+            filename : string
+                The name of the SQLite database file
+            read_only : bool
+                Whether the file is opened read-only.
+                (Default: False)
+            immutable : bool
+                Whether the file is opened as immutable.
+                (Default: False)
+            pragmas : dict, None
+                The pragmas to apply in addition to DEFAULT_PRAGMAS.
+                (Default: None)
+            uri : bool
+                Whether the filename is a URI.
+                (Default: False)
+
+        Returns
+        -------
+            None
+        """
+        _check_immutable(immutable, uri)
+        self._filename = filename
+        self._options = {'read_only': read_only, 'immutable': immutable,
+                         'pragmas': pragmas, 'uri': uri}
+        self._local = local()
+        self._lock = Lock()
+        #(thread, connection) tuples of all open connections:
+        self._connections = []
+        self._closed = False
+
+    def connection(self):
+        """Return the connection of the calling thread, opening it on first
+        use.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            sqlite3.Connection
+                The connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if not connection is None:
+            return connection
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError('The connection pool is closed')
+            #Close the connections of finished threads:
+            for thread, other in self._connections:
+                if not thread.is_alive():
+                    other.close()
+            self._connections = [(thread, other) for thread, other
+                                 in self._connections if thread.is_alive()]
+            connection = open_connection(self._filename, **self._options)
+            self._connections.append((current_thread(), connection))
+        self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        """Return the number of open connections.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            int
+                The number of connections
+        """
+        return len(self._connections)
+
+    def interrupt(self):
+        """Abort the queries currently running on all connections. They raise
+        a sqlite3.OperationalError in the threads running them.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        with self._lock:
+            for thread, connection in self._connections:
+                connection.interrupt()
+
+    def close(self):
+        """Close all connections. The pool cannot be used afterwards.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        with self._lock:
+            for thread, connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._closed = True
@@ -1,15 +1,118 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from numpy import array, arange, amin, amax, histogram
-from numpy import column_stack, median, mean, sum
+from numpy import array, arange, amin, amax, asarray, append, datetime64
+from numpy import can_cast, concatenate, diff, empty, newaxis, result_type
+from numpy import argsort, load, median, mean, save, searchsorted, sum
+from numpy import number, timedelta64
 from plotting import Plotter
+from collections import namedtuple
+from functools import partial
 from datetime import timedelta
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import RLock
+import json
+import os
 from filter_provider import DatasetFilter, AcceptanceTester
+from binning import TimeBinning, resolution_ticks, to_ticks
+from aggregators import Aggregator, Quantile, Variance, as_aggregator
+from rollups import HISTOGRAM_MAX_COLUMNS, ROLLUP_LEVELS, RollupPyramid
+from query_executor import JobExecutor
+
+#Downsample functions that are computed by the vectorized binning engine:
+_REDUCTIONS = {sum: 'sum', mean: 'mean', amin: 'min', amax: 'max'}
+#Reductions that can be answered from rollups, see build_rollups:
+_ROLLUP_REDUCTIONS = ('sum', 'mean', 'min', 'max', 'count')
+#Timestamps are stored with a resolution of one second, like in the database:
+TIMESTAMP_DTYPE = 'datetime64[s]'
+#Number of points the storage buffers are allocated for on the first append:
+_MIN_CAPACITY = 1024
+#Default number of points per slice when iterating over chunks:
+CHUNK_SIZE = 65536
+#Local time goes back at most this far when DST ends:
+_CLOCK_SHIFT = timedelta64(1, 'h')
+#Names of the files of a saved dataset, see DatasetContainer.save:
+_COLUMN_FILES = {'timestamps': 'timestamps.npy', 'values': 'values.npy'}
+_METADATA_FILE = 'metadata.json'
+#Executor of DatasetContainer.downsample_async, see _shared_executor:
+_executor = None
+_executor_lock = RLock()
+
+def _reduce_bins(binning, values, func):
+    """Reduce values per bin of a TimeBinning with a downsample function.
+    
+    Parameters
+    ----------
+        binning : TimeBinning
+            The bin assignment of the values
+        values : numpy.array
+            The values to reduce
+        func : callable, string
+            The downsample function, see DatasetContainer._downsample_data.
+    
+    Returns
+    -------
+        numpy.array
+            One value per bin
+    """
+    if isinstance(func, basestring):
+        return binning.reduce(values, func)
+    elif func in _REDUCTIONS:
+        return binning.reduce(values, _REDUCTIONS[func])
+    else:
+        return array(binning.apply(values, func))
+
+def _func_key(func):
+    """Return a description of a downsample function that is the same in 
+    every run, to identify cached results.
+    
+    Parameters
+    ----------
+        func : callable, string
+            The downsample function, see DatasetContainer._downsample_data.
+    
+    Returns
+    -------
+        string, tuple, None
+            The description, or None for functions that cannot be described,
+            whose results are not cached.
+    """
+    if isinstance(func, basestring):
+        return func
+    elif func in _REDUCTIONS:
+        return _REDUCTIONS[func]
+    elif func is median:
+        return 'median'
+    elif isinstance(func, Aggregator):
+        params = tuple(sorted(func._params.items()))
+        if all(isinstance(value, (int, long, float, basestring, type(None)))
+               for name, value in params):
+            return (func.__class__.__name__, params)
+    return None
+
+def _ceil_seconds(timestamp):
+    """Round a timestamp up to full seconds, the resolution timestamps are
+    stored with.
+    
+    Parameters
+    ----------
+        timestamp : datetime.datetime, numpy.datetime64
+            The timestamp to round
+    
+    Returns
+    -------
+        numpy.datetime64
+            The rounded timestamp
+    """
+    return datetime64(-(-int(to_ticks(timestamp))//1000000), 's')
 
 class DatasetContainer:
-    """Contains one single dataset. Holds a list of Datapoint instances 
-    describing the actual data. Depending on the name the dataset was 
-    initialized with, processing is performed to reject invalid data when 
+    """Contains one single dataset. Holds the timestamps and values of the 
+    actual data in array buffers that grow by doubling their capacity, so 
+    appending is amortized O(1). Timestamps are stored as datetime64 with a
+    resolution of one second, like in the database, so fractions of seconds
+    of appended timestamps are truncated. Depending on the name the dataset 
+    was initialized with, processing is performed to reject invalid data when
     appending new points."""
     
     def __init__(self, dataset_type, time_resolution=timedelta(minutes=1),
@@ -37,8 +140,14 @@ class DatasetContainer:
             None
         """
         self._type = dataset_type
-        self._raw_datapoints = []
-        self._index = 0
+        #Guards the lazily computed state, so containers can be read from 
+        #several threads at once:
+        self._lock = RLock()
+        self._raw_timestamps = empty(0, dtype=TIMESTAMP_DTYPE)
+        self._raw_values = empty(0)
+        self._size = 0
+        self._timestamp_min = None
+        self._timestamp_max = None
         self._time_resolution = time_resolution
         self._accept = AcceptanceTester(self._type)
         if hasattr(filter_provider, 'add_filter') \
@@ -54,13 +163,26 @@ class DatasetContainer:
         else:
             raise ValueError('Got an invalid plotter')
         self._data_up_to_date = True
+        self._filtered_count = 0
+        self._filtered_dtype = None
         self._update_filtered_data()
+        self._cache = None
+        self._source = None
+        self._loader = None
+        self._loading = False
+        self._rollup_params = None
+        self._rollups = None
+        self._rollup_data = None
+        #Incremented whenever filtered points may change other than by 
+        #appending, so the rollups cannot be extended:
+        self._data_epoch = 0
+        self._rollup_state = None
         
     def add_filter(self, filter_type, **kwargs):
         """Add a new filter to the filter provider. filter_type selects the 
         filter that will be applied, any other parameter must be named and will
         be passed to the actual filter function. When adding a filter, the 
-        cached DatasetContainer._filtered_data is updated.
+        cached DatasetContainer._filtered_data is recomputed.
         
         Parameters
         ----------
@@ -75,8 +197,201 @@ class DatasetContainer:
             None
         """
         self._filters.add_filter(filter_type, **kwargs)
+        #Filtered data has to be computed from scratch with the new filter:
+        self._filtered_count = 0
         self._data_up_to_date = False
 
+    def attach_cache(self, cache, source, loader=None):
+        """Attach a result_cache.ResultCache that stores the results of the 
+        downsample functions. The cache is only used while the data of the 
+        container matches its source, appending data detaches the source. If
+        a loader is passed, the data is loaded on first access only, so 
+        results found in the cache do not require any data at all.
+        
+        Parameters
+        ----------
+            cache : result_cache.ResultCache
+                The cache to use
+            source : tuple, callable
+                A description of where the data of the container comes from, 
+                such as the identity of the database file and the query. Must
+                only contain numbers, strings, None and tuples of them. With a
+                loader, it is a callable returning the description of the 
+                data the loader would load now, called on each lookup until 
+                the data is loaded.
+            loader : callable, None
+                Called with the container to fill it with the data of the
+                source when it is first needed. Must return the description 
+                of the data it loaded, or None if it cannot be cached, e.g. 
+                because the file changed while it was read. If None, the 
+                container must already hold the data.
+                (Default: None)
+        
+        Returns
+        -------
+            None
+        """
+        self._cache = cache
+        self._source = source
+        self._loader = loader
+    
+    def _load(self):
+        """Load the data of the source if it has not been loaded yet.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            None
+        """
+        if self._loader is None:
+            return
+        with self._lock:
+            #Other threads wait until the data is loaded, the loading thread 
+            #itself appends the data:
+            if self._loader is None or self._loading:
+                return
+            self._loading = True
+            try:
+                #Appending the data detaches the source:
+                source = self._loader(self)
+                self._source = source
+                self._loader = None
+            finally:
+                self._loading = False
+    
+    def load(self):
+        """Load the data of the source now instead of on first access, see 
+        attach_cache.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            DatasetContainer
+                The container itself
+        """
+        self._load()
+        return self
+    
+    def _cached_result(self, parts, compute):
+        """Return the plotter of a downsampled result, taking the result from
+        the cache if possible and storing it otherwise.
+        
+        Parameters
+        ----------
+            parts : tuple, None
+                A description of the downsampling performed. The source, 
+                dataset type, time resolution and filters are added to it. If
+                None, the result is not cached.
+            compute : callable
+                Called without arguments to compute the result. Must return a
+                dict of the arrays to pass to the plotter.
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set.
+        """
+        source = self._source
+        if not self._loader is None and callable(source):
+            source = source()
+        if self._cache is None or source is None or parts is None \
+            or not hasattr(self._filters, 'config'):
+            return self._plotter(self._type, **compute())
+        parts = (source, self._type, 
+                 resolution_ticks(self._time_resolution), 
+                 self._filters.config()) + parts
+        arrays = self._cache.get(parts)
+        if arrays is None:
+            arrays = compute()
+            #Only store the result if the data loaded by computing it is 
+            #that of the source looked up:
+            if self._source == source:
+                self._cache.put(parts, arrays)
+        return self._plotter(self._type, **arrays)
+
+    def build_rollups(self, levels=ROLLUP_LEVELS, histogram_step=0.5,
+                      histogram_min_width=timedelta(hours=1),
+                      histogram_max_columns=HISTOGRAM_MAX_COLUMNS):
+        """Answer downsampling requests from a rollups.RollupPyramid of the 
+        filtered data where possible. Sums, means, minima, maxima, counts and
+        histograms are then computed from the coarsest rollup level that 
+        divides the time resolution, instead of from every data point. The 
+        rollups are built when first needed, and built again after the data
+        or filters change. Data appended in chronological order is folded 
+        into the latest bins instead.
+        
+        Parameters
+        ----------
+            levels : tuple
+                The widths of the rollup levels, see rollups.RollupPyramid.
+                (Default: ROLLUP_LEVELS)
+            histogram_step : float
+                The width of the value bins of the stored histograms.
+                (Default: 0.5)
+            histogram_min_width : datetime.timedelta
+                The width of the finest level histograms are stored for.
+                (Default: timedelta(hours=1))
+            histogram_max_columns : int
+                The maximum number of value bins of the stored histograms. 
+                Histograms of values spanning more bins are computed from the
+                data.
+                (Default: rollups.HISTOGRAM_MAX_COLUMNS)
+        
+        Returns
+        -------
+            None
+        """
+        self._rollup_params = {'levels': levels, 
+                               'histogram_step': histogram_step,
+                               'histogram_min_width': histogram_min_width,
+                               'histogram_max_columns': histogram_max_columns}
+        self._rollups = None
+    
+    def _current_rollups(self):
+        """Return the rollups of the current filtered data, building them if
+        necessary.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            rollups.RollupPyramid, None
+                The rollups, or None if they are not used or there is no data.
+        """
+        if self._rollup_params is None or len(self) == 0:
+            return None
+        with self._lock:
+            timestamps, values = self['timestamps'], self['values']
+            #The filtered data is replaced whenever the data or filters change:
+            if self._rollup_data is self._filtered_data and \
+                not self._rollups is None:
+                return self._rollups
+            #The (origin, epoch, number of final points) the rollups were
+            #last updated with:
+            state = self._rollup_state
+            if self._rollups is None or \
+                state[:2] != (self.timestamp_start(), self._data_epoch):
+                self._rollups = RollupPyramid(timestamps, values, 
+                                              self.timestamp_start(), 
+                                              **self._rollup_params)
+            else:
+                self._rollups.extend(timestamps, values, state[2])
+            self._rollup_data = self._filtered_data
+            #Points before the filtered count only change with the epoch:
+            final = self._filtered_count if self._filters.count() != 0 \
+                else len(values)
+            self._rollup_state = (self.timestamp_start(), self._data_epoch, 
+                                  final)
+            return self._rollups
+
     def append(self, timestamp, value):
         """Append a Datapoint(timestamp, value) to the dataset. Depending on the
         type, checks for validity are performed, and if invalid, the data point
@@ -85,18 +400,251 @@ class DatasetContainer:
         Parameters
         ----------
             timestamp : datetime
-                The timestamp of the Datapoint
+                The timestamp of the Datapoint. Fractions of seconds are 
+                truncated, see TIMESTAMP_DTYPE.
             value : int, float
-                The value to store
+                The value to store. Missing values (None) and other 
+                non-numeric values raise a ValueError.
         
         Returns
         -------
             None
         """
+        if not isinstance(value, (int, long, float, number)):
+            raise ValueError('Got a non-numeric value: ' + repr(value))
+        self._load()
+        self._source = None
         dp = Datapoint(timestamp, value)
-        if self._accept(dp):
-            self._raw_datapoints.append(dp)
-            self._data_up_to_date = False
+        if not self._accept(dp):
+            return
+        timestamp = datetime64(timestamp, 's')
+        dtype = self._raw_values.dtype
+        if self._size == 0 or not can_cast(value, dtype):
+            dtype = asarray(value).dtype if self._size == 0 \
+                else result_type(dtype, asarray(value).dtype)
+        if self._size != 0 and timestamp < self._timestamp_max:
+            self._insert(timestamp, value, dtype)
+        else:
+            self._reserve(self._size + 1, dtype)
+            self._raw_timestamps[self._size] = timestamp
+            self._raw_values[self._size] = value
+            self._size += 1
+        if self._timestamp_min is None or timestamp < self._timestamp_min:
+            self._timestamp_min = timestamp
+        if self._timestamp_max is None or timestamp > self._timestamp_max:
+            self._timestamp_max = timestamp
+        self._data_up_to_date = False
+
+    def append_many(self, timestamps, values, copy=True):
+        """Append a batch of data points to the dataset in one call. This is 
+        the bulk counterpart to append: the acceptance checks for the type are
+        applied to the whole batch at once, and no Datapoint is created per 
+        point.
+        
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps of the data points, as datetime64 or datetime
+                objects. Fractions of seconds are truncated, see 
+                TIMESTAMP_DTYPE.
+            values : numpy.array
+                The values to store
+            copy : bool
+                If False and the container is empty, the arrays passed may be
+                used as storage directly instead of being copied. They must 
+                not be modified afterwards.
+                (Default: True)
+        
+        Returns
+        -------
+            None
+        """
+        self._load()
+        self._source = None
+        timestamps = asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        values = asarray(values)
+        if len(timestamps) != len(values):
+            raise ValueError('Got different numbers of timestamps and values')
+        mask = self._accept.mask(values)
+        if not mask.all():
+            timestamps, values = timestamps[mask], values[mask]
+        elif not copy and self._size == 0 and len(values) != 0:
+            self._adopt(timestamps, values, timestamps.min(), timestamps.max(),
+                        not (timestamps[1:] < timestamps[:-1]).any())
+            return
+        self._store(timestamps, values)
+    
+    def _adopt(self, timestamps, values, timestamp_min, timestamp_max, 
+               is_sorted):
+        """Use arrays of accepted data points as storage of the empty 
+        container, without copying them. The arrays are never written to, as
+        appending more points reallocates the storage, and unordered arrays 
+        are sorted into new ones.
+        
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps, as datetime64 array
+            values : numpy.array
+                The values
+            timestamp_min : numpy.datetime64
+                The earliest of the timestamps
+            timestamp_max : numpy.datetime64
+                The latest of the timestamps
+            is_sorted : bool
+                Whether the timestamps are in chronological order
+        
+        Returns
+        -------
+            None
+        """
+        self._raw_timestamps, self._raw_values = timestamps, values
+        self._size = len(values)
+        self._timestamp_min = timestamp_min
+        self._timestamp_max = timestamp_max
+        if not is_sorted:
+            self._sort_stored()
+        self._data_up_to_date = False
+    
+    def _store(self, timestamps, values):
+        """Copy accepted data points into the storage buffers, growing them if
+        necessary, and update the earliest and latest timestamp.
+        
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps to store, as datetime64 array
+            values : numpy.array
+                The values to store
+        
+        Returns
+        -------
+            None
+        """
+        count = len(timestamps)
+        if count == 0:
+            return
+        if self._size == 0:
+            dtype = values.dtype
+        else:
+            dtype = result_type(self._raw_values.dtype, values.dtype)
+        self._reserve(self._size + count, dtype)
+        self._raw_timestamps[self._size:self._size + count] = timestamps
+        self._raw_values[self._size:self._size + count] = values
+        unordered = (self._size != 0 and timestamps[0] < self._timestamp_max) \
+            or (timestamps[1:] < timestamps[:-1]).any()
+        self._size += count
+        if unordered:
+            self._sort_stored()
+        timestamp_min, timestamp_max = timestamps.min(), timestamps.max()
+        if self._timestamp_min is None or timestamp_min < self._timestamp_min:
+            self._timestamp_min = timestamp_min
+        if self._timestamp_max is None or timestamp_max > self._timestamp_max:
+            self._timestamp_max = timestamp_max
+        self._data_up_to_date = False
+    
+    def _reserve(self, capacity, dtype):
+        """Make sure the storage buffers can hold capacity data points and the 
+        value buffer has the given dtype. Buffers are reallocated with at least
+        double their previous capacity when they are too small.
+        
+        Parameters
+        ----------
+            capacity : int
+                The number of data points the buffers must be able to hold
+            dtype : numpy.dtype
+                The dtype of the value buffer
+        
+        Returns
+        -------
+            None
+        """
+        current = len(self._raw_timestamps)
+        if capacity <= current and dtype == self._raw_values.dtype:
+            return
+        if capacity > current:
+            capacity = max(capacity, 2*current, _MIN_CAPACITY)
+        else:
+            capacity = current
+        timestamps = empty(capacity, dtype=TIMESTAMP_DTYPE)
+        values = empty(capacity, dtype=dtype)
+        timestamps[:self._size] = self._raw_timestamps[:self._size]
+        values[:self._size] = self._raw_values[:self._size]
+        self._raw_timestamps, self._raw_values = timestamps, values
+    
+    def _insert(self, timestamp, value, dtype):
+        """Insert a data point that is earlier than the latest stored one at 
+        its chronological position. Like _sort_stored, the data is written to
+        new buffers and the filtered data is computed from scratch afterwards.
+        
+        Parameters
+        ----------
+            timestamp : numpy.datetime64
+                The timestamp of the data point
+            value : int, float
+                The value of the data point
+            dtype : numpy.dtype
+                The dtype of the value buffer
+        
+        Returns
+        -------
+            None
+        """
+        size = self._size
+        position = searchsorted(self._raw_timestamps[:size], timestamp, 
+                                side='right')
+        capacity = len(self._raw_timestamps)
+        if size + 1 > capacity:
+            capacity = max(size + 1, 2*capacity, _MIN_CAPACITY)
+        timestamps = empty(capacity, dtype=TIMESTAMP_DTYPE)
+        values = empty(capacity, dtype=dtype)
+        for new, old, inserted in ((timestamps, self._raw_timestamps, 
+                                    timestamp), 
+                                   (values, self._raw_values, value)):
+            new[:position] = old[:position]
+            new[position] = inserted
+            new[position + 1:size + 1] = old[position:size]
+        self._raw_timestamps, self._raw_values = timestamps, values
+        self._size = size + 1
+        self._filtered_count = 0
+        self._data_epoch += 1
+    
+    def _sort_stored(self):
+        """Bring the stored data points into chronological order after points
+        were stored out of order, so the data is always read in order and
+        reading never modifies it. The sorted data is written to new buffers,
+        so arrays shared with other containers or mapped from files are never
+        modified. As filters depend on the order of the data points, the 
+        filtered data is computed from scratch afterwards.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            None
+        """
+        order = argsort(self._raw_timestamps[:self._size], kind='mergesort')
+        self._raw_timestamps = self._raw_timestamps[:self._size][order]
+        self._raw_values = self._raw_values[:self._size][order]
+        self._filtered_count = 0
+        self._data_epoch += 1
+    
+    def __len__(self):
+        """Return the number of data points stored in the container.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            int
+                The number of stored data points
+        """
+        self._load()
+        return self._size
 
     def __getitem__(self, item):
         """Return list of timestamps when called with 'timestamps' or 0, and 
@@ -113,10 +661,15 @@ class DatasetContainer:
             numpy.array
                 Depending on the selected item, an array containing the 
                 timestamps or values stored in the container are returned. 
+                The timestamps are a TIMESTAMP_DTYPE array rather than 
+                datetime objects, its tolist method converts them.
         """
+        self._load()
         if not self._data_up_to_date:
-            self._update_filtered_data()
-            self._data_up_to_date = True
+            with self._lock:
+                if not self._data_up_to_date:
+                    self._update_filtered_data()
+                    self._data_up_to_date = True
         if item == 'timestamps' or item == 0:
             return self._filtered_data['timestamps']
         elif item == 'values' or item == 1:
@@ -125,7 +678,11 @@ class DatasetContainer:
             raise IndexError('Invalid index')
     
     def _update_filtered_data(self):
-        """Update the filtered data cache from the raw datapoints.
+        """Update the filtered data cache from the raw datapoints. If the 
+        filter provider declares its context (see DatasetFilter.context), only 
+        the data appended since the last update is filtered, together with the
+        context points it needs, and the result is concatenated onto the 
+        cached data. Otherwise, all data is filtered again.
         
         Parameters
         ----------
@@ -135,16 +692,70 @@ class DatasetContainer:
         -------
             None
         """
-        timestamps, values = [], []
-        for point in self._raw_datapoints:
-            timestamps.append(point.timestamp)
-            values.append(point.value)
-        timestamps, values = self._filters(array(timestamps), 
-                                            array(values))
+        if self._filters.count() == 0:
+            #Without filters, the raw data is used without copying it:
+            self._filtered_data = {
+                'timestamps': self._raw_timestamps[:self._size],
+                'values': self._raw_values[:self._size]}
+            for view in self._filtered_data.values():
+                view.flags.writeable = False
+            return
+        context = None
+        if hasattr(self._filters, 'context') and callable(self._filters.context):
+            context = self._filters.context()
+        if context is None or self._filtered_count == 0 \
+            or self._filtered_dtype != self._raw_values.dtype:
+            self._refilter_data(context)
+            return
+        lookback, lookahead = context
+        done = self._filtered_count
+        start = max(done - lookback, 0)
+        #Filters may modify the values in place, so they get a copy:
+        values = self._raw_values[start:self._size].copy()
+        #Context points are passed with their final filtered values:
+        values[:done - start] = self._filtered_data['values'][start:done]
+        timestamps, values = self._filters(
+            self._raw_timestamps[start:self._size], values)
+        if len(timestamps) != self._size - start \
+            or len(values) != self._size - start:
+            self._refilter_data(None)
+            return
+        self._filtered_data = {
+            'timestamps': concatenate((self._filtered_data['timestamps'][:done],
+                                       timestamps[done - start:])),
+            'values': concatenate((self._filtered_data['values'][:done],
+                                   values[done - start:]))}
+        self._filtered_count = max(self._size - lookahead, done)
+    
+    def _refilter_data(self, context):
+        """Filter all raw datapoints and replace the filtered data cache.
+        
+        Parameters
+        ----------
+            context : tuple, None
+                The (lookback, lookahead) context of the filter provider, or 
+                None if it does not support incremental updates.
+            
+        Returns
+        -------
+            None
+        """
+        #Filters may modify the values in place, so they get a copy:
+        timestamps, values = self._filters(
+            self._raw_timestamps[:self._size], 
+            self._raw_values[:self._size].copy())
         self._filtered_data = {'timestamps': timestamps, 'values': values}
+        self._filtered_dtype = self._raw_values.dtype
+        self._data_epoch += 1
+        if context is None or len(values) != self._size:
+            self._filtered_count = 0
+        else:
+            self._filtered_count = max(self._size - context[1], 0)
     
     def __iter__(self):
-        """Return self as iterator.
+        """Iterate over the Datapoints stored in the container. Every call 
+        returns an independent iterator over the points stored at the time of
+        the call, so nested or concurrent loops do not interfere.
         
         Parameters
         ----------
@@ -152,28 +763,46 @@ class DatasetContainer:
         
         Returns
         -------
-            self : DatasetContainer
+            generator
+                Yields one Datapoint per stored data point
         """
-        return self
+        for timestamps, values in self.iter_chunks():
+            for timestamp, value in zip(timestamps.tolist(), values.tolist()):
+                yield Datapoint(timestamp, value)
     
-    def next(self):
-        """Iterate to the next Datapoint in the list.
+    def iter_chunks(self, chunk_size=CHUNK_SIZE, filtered=False):
+        """Iterate over the data in array slices of at most chunk_size points.
+        Like iteration over Datapoints, every call returns an independent 
+        iterator over the points stored at the time of the call. The slices 
+        are read-only views of the storage, no data is copied.
         
         Parameters
         ----------
-            None
+            chunk_size : int
+                The maximum number of data points per chunk.
+                (Default: CHUNK_SIZE)
+            filtered : bool
+                If True, iterate over the filtered data as returned by 
+                __getitem__ instead of the stored raw data.
+                (Default: False)
         
         Returns
         -------
-            Datapoint
-                The next Datapoint in the container
+            generator
+                Yields (timestamps, values) tuples of numpy.array slices
         """
-        if self._index < len(self._raw_datapoints):
-            self._index += 1
-            return self._raw_datapoints[self._index - 1]
+        self._load()
+        if filtered:
+            timestamps, values = self['timestamps'], self['values']
         else:
-            self._index = 0
-            raise StopIteration
+            timestamps = self._raw_timestamps[:self._size]
+            values = self._raw_values[:self._size]
+        for start in range(0, len(timestamps), chunk_size):
+            chunk = (timestamps[start:start + chunk_size], 
+                     values[start:start + chunk_size])
+            for view in chunk:
+                view.flags.writeable = False
+            yield chunk
     
     def time_resolution(self, value = None):
         """Manage the datasets time resolution. If called without a value, 
@@ -213,7 +842,10 @@ class DatasetContainer:
             datetime.datetime
                 The earliest timestamp stored in the dataset
         """
-        return min(self['timestamps'])
+        self._load()
+        if self._timestamp_min is None:
+            raise ValueError('The dataset is empty')
+        return self._timestamp_min.item()
     
     def timestamp_end(self):
         """Return last (chronological) timestamp for the dataset.
@@ -227,7 +859,10 @@ class DatasetContainer:
             datetime.datetime
                 The latest timestamp stored in the dataset
         """
-        return max(self['timestamps'])
+        self._load()
+        if self._timestamp_max is None:
+            raise ValueError('The dataset is empty')
+        return self._timestamp_max.item()
     
     def timerange(self):
         """Return the timerange [start, end] of the dataset as a list.
@@ -247,11 +882,15 @@ class DatasetContainer:
     def _downsample_data(self, func):
         """Arbitrary downsample function. Pass a callable that performs the actual
         downsampling. func should accept an array of values and return a single
-        number.
+        number. The Numpy sum, mean, amin and amax functions, as well as the 
+        names 'sum', 'mean', 'min', 'max' and 'count', are computed for all 
+        bins at once by the binning engine. Other callables, including the 
+        online aggregators of the aggregators module, are applied to each bin
+        separately.
         
         Parameters
         ----------
-            func : callable
+            func : callable, string
                 The downsample function to apply. func should accept numpy.array
                 and return a single float or int.
         
@@ -260,18 +899,215 @@ class DatasetContainer:
             class
                 A class that provides plotting of the data set.
         """
-        cur_time = self.timestamp_start()
-        res_timestamps = []
-        res_values = []
-        while(cur_time <= self.timestamp_end()):
-            sliced_data = self._timeslice_data(cur_time, cur_time + 
-                                                self.time_resolution())
-            val = func(sliced_data['values'])
-            res_timestamps.append(cur_time)
-            res_values.append(val)
-            cur_time += self.time_resolution()
-        return self._plotter(self._type, timestamps=array(res_timestamps), 
-                             values=array(res_values))
+        def compute():
+            rollups = self._current_rollups()
+            if not rollups is None and func_key in _ROLLUP_REDUCTIONS:
+                values = rollups.reduce(func_key, self.time_resolution())
+                if not values is None:
+                    return {'timestamps': rollups.timestamps(
+                            self.time_resolution()), 'values': values}
+            binning = TimeBinning(self['timestamps'], self.timestamp_start(),
+                                  self.time_resolution(), 
+                                  end=self.timestamp_end())
+            return {'timestamps': binning.timestamps(), 
+                    'values': _reduce_bins(binning, self['values'], func)}
+        func_key = _func_key(func)
+        return self._cached_result(('downsample', func_key), compute)
+    
+    def iter_downsampled(self, chunks, func):
+        """Downsample a stream of data chunks, such as the ones returned by
+        GadgetbridgeDatabase.iter_dataset_chunks, without storing them in the 
+        container. The bins are laid out as by _downsample_data. Finished bins
+        are emitted after each chunk. As the local time repeats an hour when 
+        DST ends, the points of the latest hour are held back until they are 
+        in order (see _settle_chunks), and the acceptance tests and filters 
+        of the container are then applied to the ordered stream, as to the 
+        sorted data stored in the container. The
+        unfinished bin before them is kept as the state of an online 
+        aggregator (see aggregators.as_aggregator), so for the built-in 
+        reductions and aggregators only the current chunk and the latest hour
+        are held in memory. Other callables keep the values of the unfinished
+        bin.
+        
+        Parameters
+        ----------
+            chunks : iterable
+                The (timestamps, values) tuples of numpy.array to consume. The
+                timestamps must be in chronological order, except that they
+                may go back by up to an hour when DST ends.
+            func : callable, string
+                The downsample function to apply, see _downsample_data.
+        
+        Returns
+        -------
+            generator
+                Yields (timestamps, values) tuples of numpy.array containing 
+                the start timestamps and downsampled values of the bins 
+                finished by each chunk.
+        """
+        aggregator = as_aggregator(func)
+        resolution = self.time_resolution()
+        width = resolution_ticks(resolution)
+        origin = None
+        #Context-dependent filters need the points in local time order:
+        for timestamps, values in self._filter_chunks(
+                self._settle_chunks(chunks)):
+            if len(timestamps) == 0:
+                continue
+            ticks = to_ticks(timestamps)
+            if origin is None:
+                origin, current = ticks[0], 0
+                state = aggregator.empty()
+            indices = (ticks - origin)//width
+            if indices[0] < current or (diff(indices) < 0).any():
+                raise ValueError('Chunks must be in chronological order')
+            last = indices[-1]
+            #Points of the unfinished bin only update its aggregator:
+            in_current = indices == current
+            state.update(values[in_current])
+            if last == current:
+                continue
+            res_timestamps = array([datetime64(origin + current*width, 'us')])
+            res_values = array([state.result()])
+            #Bins between the current one and the one of the last point are
+            #complete within this chunk:
+            if last - current > 1:
+                middle = ~in_current*(indices < last)
+                binning = TimeBinning(
+                    timestamps[middle], 
+                    datetime64(origin + (current + 1)*width, 'us'), 
+                    resolution, end=datetime64(origin + (last - 1)*width, 'us'))
+                res_timestamps = concatenate((res_timestamps, 
+                                              binning.timestamps()))
+                res_values = concatenate((res_values, _reduce_bins(
+                    binning, values[middle], func)))
+            yield res_timestamps, res_values
+            state = aggregator.empty()
+            state.update(values[indices == last])
+            current = last
+        if not origin is None:
+            yield array([datetime64(origin + current*width, 'us')]), \
+                array([state.result()])
+    
+    def downsample_chunks(self, chunks, func):
+        """Downsample a stream of data chunks with iter_downsampled and return
+        the result like the downsample_* methods do.
+        
+        Parameters
+        ----------
+            chunks : iterable
+                The (timestamps, values) tuples of numpy.array to consume. The
+                timestamps must be in chronological order, see 
+                iter_downsampled.
+            func : callable, string
+                The downsample function to apply, see _downsample_data.
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set.
+        """
+        res_timestamps, res_values = [], []
+        for timestamps, values in self.iter_downsampled(chunks, func):
+            res_timestamps.append(timestamps)
+            res_values.append(values)
+        if len(res_timestamps) == 0:
+            raise ValueError('No data to downsample')
+        return self._plotter(self._type, 
+                             timestamps=concatenate(res_timestamps),
+                             values=concatenate(res_values))
+    
+    def _settle_chunks(self, chunks):
+        """Bring a stream of data chunks into chronological order of local 
+        time. When DST ends, the timestamps of the repeated hour go back by
+        up to _CLOCK_SHIFT, so the points within _CLOCK_SHIFT of the latest
+        timestamp are held back until no later point can precede them.
+        
+        Parameters
+        ----------
+            chunks : iterable
+                The (timestamps, values) tuples of numpy.array to reorder.
+        
+        Returns
+        -------
+            generator
+                Yields (timestamps, values) tuples of numpy.array, each sorted
+                and following the previous one.
+        """
+        held = horizon = None
+        for timestamps, values in chunks:
+            timestamps = asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+            values = asarray(values)
+            if len(timestamps) == 0:
+                continue
+            if not horizon is None and (timestamps < horizon).any():
+                raise ValueError('Chunks must be in chronological order')
+            if not held is None:
+                timestamps = concatenate((held[0], timestamps))
+                values = concatenate((held[1], values))
+            if (diff(timestamps) < timedelta64(0)).any():
+                order = argsort(timestamps, kind='mergesort')
+                timestamps, values = timestamps[order], values[order]
+            horizon = timestamps[-1] - _CLOCK_SHIFT
+            settled = searchsorted(timestamps, horizon)
+            yield timestamps[:settled], values[:settled]
+            held = timestamps[settled:], values[settled:]
+        if not held is None:
+            yield held
+    
+    def _filter_chunks(self, chunks):
+        """Apply the acceptance tests and filters of the container to a stream
+        of data chunks. Filters are applied with the context they declare (see
+        DatasetFilter.context): the last points of each chunk are held back 
+        until the next chunk arrives, and the preceding filtered points are 
+        passed along with the next chunk.
+        
+        Parameters
+        ----------
+            chunks : iterable
+                The (timestamps, values) tuples of numpy.array to filter.
+        
+        Returns
+        -------
+            generator
+                Yields (timestamps, values) tuples of filtered numpy.array
+        """
+        context = None
+        if hasattr(self._filters, 'context') and callable(self._filters.context):
+            context = self._filters.context()
+        if context is None and self._filters.count() != 0:
+            raise ValueError('The filters do not support streaming')
+        lookback, lookahead = context if not context is None else (0, 0)
+        done_timestamps = done_values = None
+        for timestamps, values in chunks:
+            timestamps = asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+            values = asarray(values)
+            mask = self._accept.mask(values)
+            timestamps, values = timestamps[mask], values[mask]
+            if self._filters.count() == 0:
+                yield timestamps, values
+                continue
+            if done_timestamps is None:
+                done_timestamps, done_values = timestamps[:0], values[:0]
+                pending_timestamps, pending_values = timestamps[:0], values[:0]
+            window_timestamps = concatenate((done_timestamps, 
+                                             pending_timestamps, timestamps))
+            raw_values = concatenate((pending_values, values))
+            #Filters may modify the values in place, so they get a copy:
+            window_timestamps, window_values = self._filters(
+                window_timestamps, concatenate((done_values, raw_values)))
+            context_size = len(done_timestamps)
+            final = max(len(window_values) - lookahead, context_size)
+            yield window_timestamps[context_size:final], \
+                window_values[context_size:final]
+            pending_timestamps = window_timestamps[final:]
+            pending_values = raw_values[final - context_size:]
+            filtered_pending = window_values[final:]
+            start = max(final - lookback, 0)
+            done_timestamps = window_timestamps[start:final]
+            done_values = window_values[start:final]
+        if not done_timestamps is None:
+            yield pending_timestamps, filtered_pending
     
     def downsample_mean(self):
         """Downsample data using the Numpy mean function.
@@ -287,20 +1123,65 @@ class DatasetContainer:
         """
         return self._downsample_data(mean)
     
-    def downsample_median(self):
-        """Downsample data using the Numpy median function.
+    def downsample_median(self, approximate=False):
+        """Downsample data using the Numpy median function, or an approximate
+        median in bounded memory per bin.
 
         Parameters
         ----------
-            None
+            approximate : bool
+                If True, estimate the median with aggregators.Quantile, see 
+                there for the error bound.
+                (Default: False)
         
         Returns
         -------
             class
                 A class that provides plotting of the data set.
         """
+        if approximate:
+            return self._downsample_data(Quantile(0.5))
         return self._downsample_data(median)
     
+    def downsample_quantile(self, q, relative_accuracy=0.01, exact=False):
+        """Downsample data to a quantile of the values per time bin, using
+        aggregators.Quantile.
+
+        Parameters
+        ----------
+            q : float
+                The quantile to compute, between 0 and 1.
+            relative_accuracy : float
+                The relative accuracy of the estimate.
+                (Default: 0.01)
+            exact : bool
+                If True, compute the exact quantile instead of an estimate.
+                (Default: False)
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set.
+        """
+        return self._downsample_data(Quantile(
+            q, relative_accuracy=relative_accuracy, exact=exact))
+    
+    def downsample_variance(self, ddof=0):
+        """Downsample data to the variance of the values per time bin.
+
+        Parameters
+        ----------
+            ddof : int
+                Delta degrees of freedom, see aggregators.Variance.
+                (Default: 0)
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set.
+        """
+        return self._downsample_data(Variance(ddof=ddof))
+    
     def downsample_sum(self):
         """Downsample data using the Numpy sum function.
 
@@ -315,6 +1196,48 @@ class DatasetContainer:
         """
         return self._downsample_data(sum)
     
+    def downsample_min(self):
+        """Downsample data to the minimum value per time bin.
+
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set.
+        """
+        return self._downsample_data('min')
+    
+    def downsample_max(self):
+        """Downsample data to the maximum value per time bin.
+
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set.
+        """
+        return self._downsample_data('max')
+    
+    def downsample_count(self):
+        """Downsample data to the number of data points per time bin.
+
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set.
+        """
+        return self._downsample_data('count')
+    
     def downsample_none(self):
         """Don't downsample, just return full-resolution data as saved in the 
         dataset.
@@ -354,38 +1277,87 @@ class DatasetContainer:
                 The bin width of the histogram.
                 (Default: 5)
         
+        Each histogram row is scaled so that its maximum is 1. Rows of time
+        steps without any values inside the histogram range are all zero.
+        
         Returns
         -------
             class
                 A class that provides plotting of the data set.
         """
-        if hist_min is None:
-            #Take the minimum, round to nearest 10
-            hist_min = int(amin(self['values'])/10)*10
-        if hist_max is None:
-            #Take the maximum, round to nearest 10
-            hist_max = int(amax(self['values'])/10)*10
-        bins = arange(hist_min, hist_max, resolution)
-        cur_time = self.timestamp_start()
-        res_timestamps = []
-        res_histogram = []
-        while(cur_time <= self.timestamp_end()):
-            sliced_data = self._timeslice_data(cur_time, cur_time + 
-                                                self.time_resolution())
-        
-            hist = histogram(sliced_data['values'], bins, density=True)[0]
-            res_timestamps.append(cur_time)
-            #Scale the maximum of each histogram row to 1:
-            res_histogram.append(hist/amax(hist))
-            cur_time += self.time_resolution()
-        res_timestamps.append(self.timestamp_end())
-        return self._plotter(self._type, timestamps=array(res_timestamps), 
-                             bins=bins, histogram=array(res_histogram))
+        def compute():
+            rollups = self._current_rollups()
+            low, high = hist_min, hist_max
+            if low is None:
+                #Take the minimum, round to nearest 10
+                value_min = amin(self['values']) if rollups is None \
+                    else rollups.value_range()[0]
+                low = int(value_min/10)*10
+            if high is None:
+                #Take the maximum, round to nearest 10
+                value_max = amax(self['values']) if rollups is None \
+                    else rollups.value_range()[1]
+                high = int(value_max/10)*10
+            bins = arange(low, high, resolution)
+            hist = None
+            if not rollups is None:
+                hist = rollups.histogram(bins, self.time_resolution())
+            if hist is None:
+                binning = TimeBinning(self['timestamps'], 
+                                      self.timestamp_start(),
+                                      self.time_resolution(), 
+                                      end=self.timestamp_end())
+                hist = binning.histogram(self['values'], bins)
+                timestamps = binning.timestamps()
+            else:
+                timestamps = rollups.timestamps(self.time_resolution())
+            hist = hist.astype(float)
+            #Scale the maximum of each histogram row to 1, empty rows stay 0:
+            row_max = amax(hist, axis=1)
+            row_max[row_max == 0] = 1.
+            res_timestamps = append(timestamps, 
+                                    datetime64(self.timestamp_end(), 'us'))
+            return {'timestamps': res_timestamps, 'bins': bins, 
+                    'histogram': hist/row_max[:, newaxis]}
+        return self._cached_result(('histogram', hist_min, hist_max, 
+                                    resolution), compute)
+
+    def downsample_async(self, aggregation, executor=None, **kwargs):
+        """Downsample the data on a worker thread, like a job of 
+        downsample_many, without blocking the calling thread. The returned 
+        future can be awaited from asyncio code.
+        
+        Parameters
+        ----------
+            aggregation : string, callable
+                The aggregation, see downsample_many.
+            executor : query_executor.JobExecutor, None
+                The executor to run the downsampling on. If None, an executor
+                shared by all containers is used.
+                (Default: None)
+            **kwargs
+                Passed to the downsample method selected by the aggregation, 
+                or bound to a callable aggregation, see downsample_many.
+        
+        Returns
+        -------
+            query_executor.JobFuture
+                The future of the plotter class. Cancelling it before the 
+                downsampling started prevents it from running.
+        """
+        if executor is None:
+            executor = _shared_executor()
+        return executor.submit(_run_job, (self, aggregation, kwargs))
 
     def _timeslice_data(self, timestamp_start, timestamp_end):
         """Helper function to perform the actual time slicing common to
         downsampling. Returns a DatasetContainer with the data for which
-        timestamp_start <= timestamp < timestamp_end.
+        timestamp_start <= timestamp < timestamp_end. The range is located by 
+        binary search in the filtered data, which is always in chronological
+        order. The returned container shares the arrays of this 
+        one instead of copying them, and copies them only when points are 
+        appended to it, so slicing takes O(log N) time once the filtered data
+        is up to date.
 
         Parameters
         ----------
@@ -399,69 +1371,200 @@ class DatasetContainer:
             res : DatasetContainer
                 A container with the data between the start and end values.
         """
-        timestamps = array(self['timestamps']) 
-        values = array(self['values'])
-        mask = (timestamps >= timestamp_start)*(timestamps < timestamp_end)
+        self._load()
+        timestamps, values = self['timestamps'], self['values']
+        start = searchsorted(timestamps, _ceil_seconds(timestamp_start))
+        end = searchsorted(timestamps, _ceil_seconds(timestamp_end))
         res = DatasetContainer(self._type)
         res.time_resolution(value=self.time_resolution())
-        for timestamp, value in column_stack((timestamps[mask], values[mask])):
-            res.append(timestamp, value)
+        if end > start:
+            res._adopt(timestamps[start:end], values[start:end], 
+                       timestamps[start], timestamps[end - 1], True)
         return res
         
-class Datapoint:
-    """Container for a single data point. Holds Datapoint.timestamp and 
-    Datapoint.value. Is iterable to allow for timestamp, value = Datapoint 
-    assignments."""
-    
-    def __init__(self, timestamp, value):
-        """Initialize the Datapoint. Pass a timestamp and a value to hold.
+    def save(self, directory, device=None):
+        """Save the data points as one .npy file per column, and the dataset
+        type, device, time resolution, timestamp range and filters as JSON 
+        metadata. The files can be opened memory mapped with open_dataset.
         
         Parameters
         ----------
-            timestamp : datetime.datetime
-                The timestamp of the data point
-            value : float
-                The value of the data point
-        """
-        self.timestamp = timestamp
-        self.value = value
-        self._index = 0
-        
-    def __iter__(self):
-        """Return self as iterator.
-        
-        Parameters
-        ----------
-            None
+            directory : string
+                The directory to save the files to. It is created if necessary.
+            device : string, None
+                The name of the device the data was recorded with.
+                (Default: None)
         
         Returns
         -------
-            self : Datapoint
-                This instance of Datapoint
-        """
-        return self
-    
-    def next(self):
-        """Iterate over the values. First iteration yields timestamp, second
-        iteration yields value.
-        
-        Parameters
-        ----------
             None
-        
-        Returns
-        -------
-            datetime.datetime, float
-                Returns the timestamp on the first iteration, the value on the
-                second one.
         """
-        if self._index == 0:
-            self._index += 1
-            return self.timestamp
-        elif self._index == 1:
-            self._index += 1
-            return self.value
+        self._load()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        save(os.path.join(directory, _COLUMN_FILES['timestamps']), 
+             self._raw_timestamps[:self._size])
+        save(os.path.join(directory, _COLUMN_FILES['values']), 
+             self._raw_values[:self._size])
+        if self._size == 0:
+            timerange = [None, None]
         else:
-            self._index = 0
-            raise StopIteration
-        
\ No newline at end of file
+            timerange = [str(self._timestamp_min), str(self._timestamp_max)]
+        filters = []
+        if hasattr(self._filters, 'config'):
+            filters = [[name, dict(params)] 
+                       for name, params in self._filters.config()]
+        #The stored data is always in chronological order, see _sort_stored:
+        metadata = {'type': self._type, 'device': device, 
+                    'time_resolution': self._time_resolution.total_seconds(),
+                    'timerange': timerange, 'filters': filters, 
+                    'sorted': True}
+        with open(os.path.join(directory, _METADATA_FILE), 'w') as stream:
+            json.dump(metadata, stream, indent=4, sort_keys=True)
+
+def _shared_executor():
+    """Return the executor of DatasetContainer.downsample_async, starting it
+    on first use.
+    
+    Parameters
+    ----------
+        None
+    
+    Returns
+    -------
+        query_executor.JobExecutor
+            The executor, with one worker thread per CPU
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor(cpu_count())
+        return _executor
+
+def _run_job(job):
+    """Run a downsampling job of downsample_many.
+    
+    Parameters
+    ----------
+        job : tuple
+            The (container, aggregation) or (container, aggregation, kwargs) 
+            tuple, see downsample_many.
+    
+    Returns
+    -------
+        Plotter
+            The plotter class returned by the downsampling
+    """
+    container, aggregation = job[:2]
+    kwargs = job[2] if len(job) > 2 else {}
+    if isinstance(aggregation, basestring):
+        return getattr(container, 'downsample_' + aggregation)(**kwargs)
+    if len(kwargs) != 0:
+        if isinstance(aggregation, Aggregator):
+            raise ValueError('Aggregators take no keyword arguments, pass '
+                             'them when creating the aggregator')
+        aggregation = partial(aggregation, **kwargs)
+    return container._downsample_data(aggregation)
+
+def downsample_many(jobs, workers=None):
+    """Run several downsampling jobs concurrently on a pool of threads. The
+    binning and reductions spend most of their time in numpy, which releases
+    the global interpreter lock, so jobs on different containers run in 
+    parallel. Containers may be read by several jobs at once, but must not be
+    appended to while the jobs run.
+    
+    Parameters
+    ----------
+        jobs : list
+            (container, aggregation) or (container, aggregation, kwargs) 
+            tuples. A string aggregation selects the downsample method of that
+            name, e.g. 'histogram' calls container.downsample_histogram, and 
+            kwargs are passed to it. Any other aggregation is passed to 
+            DatasetContainer._downsample_data, with the kwargs bound to it if 
+            it is a plain callable. Aggregators are configured when they are
+            created, so kwargs raise a ValueError for them.
+        workers : int, None
+            The maximum number of threads. If None, one per CPU is used, but 
+            no more than there are jobs.
+            (Default: None)
+    
+    Returns
+    -------
+        list
+            The plotter classes returned by the jobs, in the order of the jobs
+    """
+    if len(jobs) == 0:
+        return []
+    if workers is None:
+        workers = min(len(jobs), cpu_count())
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(_run_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+def dataset_metadata(directory):
+    """Read the metadata of a dataset saved with DatasetContainer.save.
+    
+    Parameters
+    ----------
+        directory : string
+            The directory the dataset was saved to
+    
+    Returns
+    -------
+        dict
+            The metadata, containing the entries:
+                * type
+                * device
+                * time_resolution (in seconds)
+                * timerange (as strings, or None for empty datasets)
+                * filters (as list of [filtername, parameters])
+                * sorted (whether the timestamps are in chronological order)
+    """
+    with open(os.path.join(directory, _METADATA_FILE)) as stream:
+        return json.load(stream)
+
+def open_dataset(directory, mmap_mode='r'):
+    """Open a dataset saved with DatasetContainer.save. The columns are 
+    memory mapped, so opening takes constant time, only the pages of the data
+    actually accessed are read, and processes opening the same files share 
+    their pages. Points appended to the container are stored in memory.
+    
+    Parameters
+    ----------
+        directory : string
+            The directory the dataset was saved to
+        mmap_mode : string, None
+            The mode to map the files with, see numpy.memmap. If None, the 
+            files are read into memory.
+            (Default: 'r')
+    
+    Returns
+    -------
+        res : DatasetContainer
+            The container with the saved dataset and filters.
+    """
+    metadata = dataset_metadata(directory)
+    res = DatasetContainer(metadata['type'], time_resolution=timedelta(
+            seconds=metadata['time_resolution']))
+    for filtername, params in metadata['filters']:
+        res.add_filter(filtername, **dict((str(name), value) 
+                                          for name, value in params.items()))
+    timestamps, values = [load(os.path.join(directory, _COLUMN_FILES[name]), 
+                               mmap_mode=mmap_mode) 
+                          for name in ('timestamps', 'values')]
+    if len(values) != 0:
+        timestamp_min, timestamp_max = [datetime64(timestamp, 's') 
+                                        for timestamp in metadata['timerange']]
+        res._adopt(timestamps, values, timestamp_min, timestamp_max, 
+                   metadata['sorted'])
+    return res
+
+class Datapoint(namedtuple('Datapoint', ['timestamp', 'value'])):
+    """Container for a single data point. Holds Datapoint.timestamp and 
+    Datapoint.value. Is an immutable tuple without per-instance dict, and 
+    allows for timestamp, value = Datapoint assignments."""
+    
+    __slots__ = ()
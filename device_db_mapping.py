@@ -3,12 +3,14 @@
 
 device_db_mapping = {'MI Band': {'table': 'MI_BAND_ACTIVITY_SAMPLE',
                                  'timestamp': 'TIMESTAMP', 
+                                 'device_id': 'DEVICE_ID',
                                  'heartrate': 'HEART_RATE', 
                                  'activity': 'RAW_KIND',
                                  'intensity': 'RAW_INTENSITY',
                                  'steps': 'STEPS'},
                      'HPlus': {'table': 'HPLUS_HEALTH_ACTIVITY_SAMPLE',
                                'timestamp': 'TIMESTAMP',
+                               'device_id': 'DEVICE_ID',
                                'heartrate': 'HEART_RATE', 
                                'activity': 'RAW_KIND',
                                'intensity': 'RAW_INTENSITY',
@@ -17,12 +19,14 @@ device_db_mapping = {'MI Band': {'table': 'MI_BAND_ACTIVITY_SAMPLE',
                                'distance': 'DISTANCE'},
                      'NO.1 F1': {'table': 'NO1_F1_ACTIVITY_SAMPLE',
                                  'timestamp': 'TIMESTAMP', 
+                                 'device_id': 'DEVICE_ID',
                                  'heartrate': 'HEART_RATE', 
                                  'activity': 'RAW_KIND',
                                  'intensity': 'RAW_INTENSITY',
                                  'steps': 'STEPS'},
                      'Pebble': {'table': 'NO1_F1_ACTIVITY_SAMPLE',
                                 'timestamp': 'TIMESTAMP', 
+                                'device_id': 'DEVICE_ID',
                                 'heartrate': 'HEART_RATE', 
                                 'intensity': 'RAW_INTENSITY',
                                 'steps': 'STEPS'}}
\ No newline at end of file
@@ -1,9 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from numpy import arange
+from operator import ge, le, lt
+from numpy import asarray, errstate, flatnonzero, isnan, ones
+
+#Operators that can be used in rejection rules, with their SQL notation:
+_OPERATORS = {'>=': ge, '<=': le, '<': lt}
 
 class AcceptanceTester:
-    """Tests data points for acceptance into dataset_container."""
+    """Tests data points for acceptance into dataset_container. Each data type
+    has a list of rejection rules, a value is accepted if it matches none of 
+    them. The same rules are used to test single Datapoints, to test arrays of
+    values, and to build SQL conditions that reject invalid rows in the 
+    database. Missing values (None, NaN or NULL) are rejected everywhere, as 
+    the datasets only hold numbers."""
+    
+    #Rejection rules per data type, as (operator, limit) pairs:
+    rules = {'heartrate': [('>=', 255), ('<=', 0)],
+             'intensity': [('>=', 255)],
+             'steps': [('<', 0)]}
 
     def __init__(self, tester_type):
         """Initialize with the type of data to test.
@@ -17,10 +31,7 @@ class AcceptanceTester:
         -------
             None
         """
-        self._tester_map = {'heartrate': self._test_heartrate,
-                            'intensity': self._test_intensity,
-                            'steps': self._test_steps}
-        self._tester = self._tester_map.get(tester_type, self._test_accept_all)
+        self._rules = self.rules.get(tester_type, [])
     
     def __call__(self, Datapoint):
         """Pass a Datapoint to test, returns acceptance based on the type set.
@@ -35,74 +46,60 @@ class AcceptanceTester:
             bool
                 Whether or not the value is valid.
         """
-        return self._tester(Datapoint)
-        
-    def _test_accept_all(self, Datapoint):
-        """Accept all datapoints.
-        
-        Parameters
-        ----------
-            Datapoint : Datapoint
-                The Datapoint being tested.
-        
-        Returns
-        -------
-            True
-                This function always returns True to accept all data points.
-        """
+        if Datapoint.value is None:
+            return False
+        for operator, limit in self._rules:
+            if _OPERATORS[operator](Datapoint.value, limit):
+                return False
         return True
     
-    def _test_heartrate(self, Datapoint):
-        """Test HR datapoints for acceptance. Do not accept values that match 
-        the following:
-            * HR == 255
-            * HR <= 0
+    def mask(self, values):
+        """Test an array of values at once, returns a boolean array that is 
+        True where the value is accepted. Applies the same rules as testing
+        single Datapoints.
         
         Parameters
         ----------
-            Datapoint : Datapoint
-                The Datapoint to test for acceptance
-        
-        Returns
-        -------
-            bool
-                Whether or not the value is valid.
-        """
-        return not Datapoint.value >= 255 and not Datapoint.value <= 0
-        
-    def _test_intensity(self, Datapoint):
-        """Test intensity datapoints for acceptance. Do not accept values that 
-        match the following:
-            * intensity == 255
-        
-        Parameters
-        ----------
-            Datapoint : Datapoint
-                The Datapoint to test for acceptance
+            values : numpy.array
+                The values to test for acceptance
         
         Returns
         -------
-            bool
-                Whether or not the value is valid.
+            numpy.array
+                Boolean array, True for each valid value.
         """
-        return not Datapoint.value >= 255
-
-    def _test_steps(self, Datapoint):
-        """Test step datapoints for acceptance. Do not accept values that match 
-        the following:
-            * steps < 0
+        values = asarray(values)
+        if values.dtype.hasobject:
+            #Missing values are fetched as None, compare them as NaN:
+            values = values.astype(float)
+        if values.dtype.kind == 'f':
+            res = ~isnan(values)
+        else:
+            res = ones(len(values), dtype=bool)
+        with errstate(invalid='ignore'):
+            for operator, limit in self._rules:
+                res *= ~_OPERATORS[operator](values, limit)
+        return res
+    
+    def sql_conditions(self, column):
+        """Translate the rules into SQL expressions that are true for valid 
+        values of a column.
         
         Parameters
         ----------
-            Datapoint : Datapoint
-                The Datapoint to test for acceptance
+            column : string
+                The name of the database column holding the values
         
         Returns
         -------
-            bool
-                Whether or not the value is valid.
+            list
+                The SQL expressions, all of them must hold for a value to be 
+                accepted: one rejecting NULL values, and one per rule.
         """
-        return not Datapoint.value < 0
+        return ['{column:s} IS NOT NULL'.format(column=column)] + \
+            ['NOT ({column:s} {operator:s} {limit!r})'.format(
+                column=column, operator=operator, limit=limit)
+             for operator, limit in self._rules]
 
 class DatasetFilter:
     """A class providing dataset filtering."""
@@ -119,6 +116,8 @@ class DatasetFilter:
             None
         """
         self._filter_map = {'heartrate': self._filter_hr}
+        #Context each filter needs for incremental updates, see context():
+        self._filter_context = {'heartrate': (1, 1)}
         self._filter_params = {}
         self._filters = []
         
@@ -143,6 +142,20 @@ class DatasetFilter:
             self._filters.append(filtername)
             self._filter_params[filtername] = kwargs
     
+    def available(self):
+        """Return the names of the filters that can be added.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            list
+                The sorted filter names
+        """
+        return sorted(self._filter_map)
+    
     def __call__(self, timestamps, values):
         """Apply the filters that have been set up for this provider to the 
         dataset passed and return the resulting dataset.
@@ -171,12 +184,62 @@ class DatasetFilter:
                 The number of filters stored
         """
         return len(self._filters)
+
+    def config(self):
+        """Return a description of the filters and their parameters, in the
+        order they are applied. Used to tell apart results computed with
+        different filters.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            tuple
+                One (filtername, parameters) tuple per filter, where parameters
+                is a sorted tuple of (name, value) pairs.
+        """
+        return tuple((filtername,
+                      tuple(sorted(self._filter_params[filtername].items())))
+                     for filtername in self._filters)
+
+    def context(self):
+        """Return the context the filters need to update already filtered data
+        incrementally, as (lookback, lookahead) tuple. When filtering data 
+        appended to already filtered data, the lookback preceding points must 
+        be passed along with their filtered values, which the filters leave 
+        unchanged. The filtered values of the last lookahead points may still 
+        change when more points are appended. If the filters do not support 
+        incremental updates, None is returned.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            tuple, None
+                The (lookback, lookahead) tuple, or None.
+        """
+        if len(self._filters) == 0:
+            return (0, 0)
+        elif len(self._filters) == 1:
+            return self._filter_context[self._filters[0]]
+        else:
+            #The context of chained filters would include intermediate results
+            return None
     
     def _filter_hr(self, timestamps, values, delta_doublefilter=3):
         """A heartrate-specific filter. It checks if a value is twice as high as
         the ones preceding and following it, within the delta_doublefilter 
         environment, and divides the values matching by two.
         
+        The values are processed in order and modified in place, so the test
+        for a value uses the already halved preceding value. The tests are 
+        evaluated for all values at once; only values whose outcome depends on
+        whether the preceding value was halved are resolved sequentially.
+        
         Parameters
         ----------
             timestamps : numpy.array
@@ -191,11 +254,21 @@ class DatasetFilter:
         -------
             None
         """
-        for i in arange(1, len(values) - 1):
-            diff_lower = abs((float(values[i])/2.) - values[i - 1])
-            diff_upper = abs((float(values[i])/2.) - values[i + 1])
-            if (diff_lower < delta_doublefilter)*\
-              (diff_upper < delta_doublefilter):
-                values[i] /= 2.
+        if len(values) < 3:
+            return timestamps, values
+        half = values[1:-1].astype(float)/2.
+        #The value stored in place of a halved value, cast as on assignment:
+        halved = (values/2.).astype(values.dtype)
+        upper_ok = abs(half - values[2:]) < delta_doublefilter
+        lower_ok = abs(half - values[:-2]) < delta_doublefilter
+        lower_ok_halved = abs(half - halved[:-2]) < delta_doublefilter
+        hits = upper_ok*lower_ok
+        #Values whose test changes if the preceding value was halved:
+        for i in flatnonzero(upper_ok*(lower_ok != lower_ok_halved)):
+            if i > 0 and hits[i - 1]:
+                hits[i] = lower_ok_halved[i]
+            else:
+                hits[i] = lower_ok[i]
+        hits = flatnonzero(hits) + 1
+        values[hits] = halved[hits]
         return timestamps, values
-        
\ No newline at end of file
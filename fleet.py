@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import time
+import traceback
+from itertools import imap
+from multiprocessing import Pool
+from numpy import add, arange, concatenate, datetime64, fmax, fmin, full
+from numpy import int64, nan, zeros
+from binning import TimeBinning, resolution_ticks, to_ticks
+from gb_database import GadgetbridgeDatabase
+
+def _process_database(task):
+    """Compute the partial aggregates of one database. Runs in a worker
+    process, so all exceptions are caught and reported instead of raised.
+
+    Parameters
+    ----------
+        task : dict
+            The filename and device of the database, and the parameters of
+            the aggregation, see aggregate_databases.
+
+    Returns
+    -------
+        tuple
+            The (report, partial) tuple, where report is a dict containing
+            the filename, device, number of rows, processing time in seconds
+            and the error message or None, and partial is a FleetAggregate or
+            None if processing failed.
+    """
+    start = time.time()
+    report = {'filename': task['filename'], 'device': task['device'],
+              'rows': 0, 'error': None}
+    partial = None
+    try:
+        if not os.path.isfile(task['filename']):
+            raise IOError('No such database file: ' + task['filename'])
+        with GadgetbridgeDatabase(task['filename'], task['device'],
+                                  read_only=True) as database:
+            container = database.retrieve_dataset(
+                task['dataset'], timestamp_min=task['timestamp_min'],
+                timestamp_max=task['timestamp_max'])
+        for filtername, params in task['filters']:
+            container.add_filter(filtername, **params)
+        report['rows'] = len(container)
+        partial = FleetAggregate(task['origin'], task['time_resolution'],
+                                 task['hist_edges'])
+        if len(container) != 0:
+            partial.update(container['timestamps'], container['values'])
+    except Exception:
+        report['error'] = traceback.format_exc()
+        partial = None
+    report['seconds'] = time.time() - start
+    return report, partial
+
+def _pad(values, length, fill):
+    """Extend an array along its first axis to a length with a fill value.
+
+    Parameters
+    ----------
+        values : numpy.array
+            The array to extend
+        length : int
+            The length to extend to. Must not be shorter than the array.
+        fill : int, float
+            The value of the added elements
+
+    Returns
+    -------
+        numpy.array
+            The extended array
+    """
+    if len(values) == length:
+        return values
+    padding = full((length - len(values),) + values.shape[1:], fill,
+                   dtype=values.dtype)
+    return concatenate((values, padding))
+
+class FleetAggregate:
+    """Mergeable per-bin aggregates of a dataset over many databases. The bins
+    of all databases start at the same origin, so the aggregates of each
+    database can be computed separately and merged bin by bin."""
+
+    def __init__(self, origin, time_resolution, hist_edges=None):
+        """Initialize empty aggregates.
+
+        Parameters
+        ----------
+            origin : datetime.datetime
+                The start of the first bin
+            time_resolution : datetime.timedelta
+                The width of each bin
+            hist_edges : numpy.array, None
+                The value bin edges of the per-bin histograms, see
+                TimeBinning.histogram. If None, no histograms are computed.
+                (Default: None)
+
+        Returns
+        -------
+            None
+        """
+        self.origin = origin
+        self.time_resolution = time_resolution
+        self.hist_edges = hist_edges
+        self.counts = zeros(0, dtype=int64)
+        self.sums = zeros(0)
+        self.mins = zeros(0)
+        self.maxs = zeros(0)
+        self.histogram = None
+        if not hist_edges is None:
+            self.histogram = zeros((0, len(hist_edges) - 1), dtype=int64)
+        self.reports = []
+
+    def update(self, timestamps, values):
+        """Add the data points of one dataset to the aggregates. Points before
+        the origin are ignored.
+
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps of the data, as datetime64 array
+            values : numpy.array
+                The values of the data
+
+        Returns
+        -------
+            None
+        """
+        inside = timestamps >= datetime64(self.origin, 'us')
+        timestamps, values = timestamps[inside], values[inside]
+        if len(timestamps) == 0:
+            return
+        binning = TimeBinning(timestamps, self.origin, self.time_resolution)
+        partial = FleetAggregate(self.origin, self.time_resolution,
+                                 self.hist_edges)
+        partial.counts = binning.counts.astype(int64)
+        partial.sums = binning.reduce(values, 'sum').astype(float)
+        partial.mins = binning.reduce(values, 'min').astype(float)
+        partial.maxs = binning.reduce(values, 'max').astype(float)
+        if not self.hist_edges is None:
+            partial.histogram = binning.histogram(values, self.hist_edges)
+        self.merge(partial)
+
+    def merge(self, other):
+        """Add the aggregates and reports of another FleetAggregate with the
+        same bins.
+
+        Parameters
+        ----------
+            other : FleetAggregate
+                The aggregates to merge into these
+
+        Returns
+        -------
+            None
+        """
+        length = max(len(self.counts), len(other.counts))
+        self.counts = add(_pad(self.counts, length, 0),
+                          _pad(other.counts, length, 0))
+        self.sums = add(_pad(self.sums, length, 0), _pad(other.sums, length, 0))
+        self.mins = fmin(_pad(self.mins, length, nan),
+                         _pad(other.mins, length, nan))
+        self.maxs = fmax(_pad(self.maxs, length, nan),
+                         _pad(other.maxs, length, nan))
+        if not self.histogram is None:
+            self.histogram = add(_pad(self.histogram, length, 0),
+                                 _pad(other.histogram, length, 0))
+        self.reports.extend(other.reports)
+
+    def timestamps(self):
+        """Return the start timestamps of all bins.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            numpy.array
+                The bin start timestamps as datetime64 array
+        """
+        return (int(to_ticks(self.origin)) + arange(len(self.counts),
+                                                    dtype=int64)
+                *resolution_ticks(self.time_resolution))\
+            .astype('datetime64[us]')
+
+    def mean(self):
+        """Return the mean value per bin, NaN for bins without data.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            numpy.array
+                The mean per bin
+        """
+        res = full(len(self.counts), nan)
+        nonempty = self.counts > 0
+        res[nonempty] = self.sums[nonempty]/self.counts[nonempty]
+        return res
+
+    def failures(self):
+        """Return the reports of the databases that could not be processed.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            list
+                The reports with an error message
+        """
+        return [report for report in self.reports
+                if not report['error'] is None]
+
+def aggregate_databases(databases, dataset, origin, time_resolution,
+                        hist_edges=None, timestamp_min=None,
+                        timestamp_max=None, filters=(), processes=None):
+    """Aggregate a dataset over many databases in parallel. Each database is
+    opened and aggregated in a worker process, and only the per-bin partial
+    aggregates are sent back and merged. Databases that fail to be processed
+    are reported instead of aborting the run.
+
+    Parameters
+    ----------
+        databases : list
+            (filename, device) tuples of the databases to aggregate. The
+            device selects the table mapping, see device_db_mapping.
+        dataset : string
+            The dataset to aggregate
+        origin : datetime.datetime
+            The start of the first bin. Earlier data is ignored.
+        time_resolution : datetime.timedelta
+            The width of each bin
+        hist_edges : numpy.array, None
+            The value bin edges of the per-bin histograms. If None, no
+            histograms are computed.
+            (Default: None)
+        timestamp_min : datetime.datetime, None
+            The lower limit (included) of the data to aggregate.
+            (Default: None)
+        timestamp_max : datetime.datetime, None
+            The upper limit (not included) of the data to aggregate.
+            (Default: None)
+        filters : list
+            (filtername, parameters) tuples of the filters to apply to the
+            dataset of each database, see DatasetContainer.add_filter.
+            (Default: ())
+        processes : int, None
+            The number of worker processes. If None, one per CPU is used. If
+            1, the databases are processed in the calling process.
+            (Default: None)
+
+    Returns
+    -------
+        FleetAggregate
+            The merged aggregates. Its reports list holds one report per
+            database, in the order they finished, with the filename, device,
+            number of rows, processing time in seconds and error message.
+    """
+    tasks = [{'filename': filename, 'device': device, 'dataset': dataset,
+              'origin': origin, 'time_resolution': time_resolution,
+              'hist_edges': hist_edges, 'timestamp_min': timestamp_min,
+              'timestamp_max': timestamp_max, 'filters': list(filters)}
+             for filename, device in databases]
+    res = FleetAggregate(origin, time_resolution, hist_edges)
+    if processes == 1:
+        pool = None
+        results = imap(_process_database, tasks)
+    else:
+        pool = Pool(processes)
+        results = pool.imap_unordered(_process_database, tasks)
+    try:
+        for report, partial in results:
+            if not partial is None:
+                res.merge(partial)
+            res.reports.append(report)
+    finally:
+        if not pool is None:
+            pool.close()
+            pool.join()
+    return res
@@ -1,10 +1,144 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import sqlite3
 import time
 from datetime import datetime
+from functools import partial
+from threading import RLock, local
+from numpy import arange, array, asarray, concatenate, empty, full, int64
+from numpy import nan, unique, zeros
 from device_db_mapping import device_db_mapping
 from dataset_container import DatasetContainer
+from filter_provider import AcceptanceTester
+from binning import resolution_ticks
+from plotting import Plotter
+from result_cache import database_identity
+from query_executor import MAX_ASYNC_QUERIES, QueryExecutor
+from connection_pool import ConnectionPool
+from working_copy import WorkingCopy
+
+#Number of rows pulled from the cursor per fetchmany call in bulk mode:
+FETCH_BATCH_SIZE = 65536
+#Reductions available for downsampling in the database:
+_AGGREGATIONS = ('sum', 'mean', 'min', 'max', 'count')
+#SQL expression converting a Unix timestamp column to local time seconds:
+_LOCAL_SECONDS = "CAST(strftime('%s', {column:s}, 'unixepoch', 'localtime') "\
+    "AS INTEGER)"
+
+def _utc_offset(timestamp):
+    """Return the local UTC offset in seconds at a Unix timestamp.
+    
+    Parameters
+    ----------
+        timestamp : int
+            The Unix timestamp to look up the offset for
+    
+    Returns
+    -------
+        int
+            The offset of local time to UTC in seconds
+    """
+    delta = datetime.fromtimestamp(timestamp) \
+        - datetime.utcfromtimestamp(timestamp)
+    return delta.days*86400 + delta.seconds
+
+def local_datetime64(timestamps):
+    """Convert an array of Unix timestamps to naive local datetime64 values, 
+    matching what datetime.fromtimestamp returns for each of them. UTC offsets
+    only change on quarter hour boundaries, so they are looked up once per 
+    distinct quarter hour instead of once per timestamp.
+    
+    Parameters
+    ----------
+        timestamps : numpy.array
+            The Unix timestamps to convert
+    
+    Returns
+    -------
+        numpy.array
+            The local timestamps as datetime64[s] array
+    """
+    timestamps = asarray(timestamps, dtype=int64)
+    if len(timestamps) == 0:
+        return timestamps.astype('datetime64[s]')
+    quarters, inverse = unique(timestamps//900, return_inverse=True)
+    offsets = array([_utc_offset(int(quarter)*900) for quarter in quarters], 
+                    dtype=int64)
+    return (timestamps + offsets[inverse]).astype('datetime64[s]')
+
+def _unix_timestamp(timestamp):
+    """Return the Unix timestamp of a query limit.
+    
+    Parameters
+    ----------
+        timestamp : datetime.datetime, int
+            The limit as local datetime, or as Unix timestamp
+    
+    Returns
+    -------
+        int
+            The Unix timestamp
+    """
+    if isinstance(timestamp, datetime):
+        return int(time.mktime(timestamp.timetuple()))
+    return int(timestamp)
+
+def _unchanged_source(source, describe):
+    """Check that the source of data read for the result cache did not change
+    while it was read.
+    
+    Parameters
+    ----------
+        source : tuple, None
+            The description of the source taken before the data was read
+        describe : callable
+            Called without arguments to describe the source now
+    
+    Returns
+    -------
+        tuple, None
+            The description, or None if there is none or the source changed
+    """
+    if source is None or describe() != source:
+        return None
+    return source
+
+def _retrieve_loaded(database, *args):
+    """Retrieve a dataset on a worker thread of the asynchronous methods. The
+    data is loaded on the worker thread, even if the container would 
+    otherwise load it lazily, see GadgetbridgeDatabase.retrieve_dataset.
+    
+    Parameters
+    ----------
+        database : GadgetbridgeDatabase
+            The database of the worker thread
+        *args
+            The arguments of retrieve_dataset
+    
+    Returns
+    -------
+        DatasetContainer
+            The loaded container
+    """
+    return database.retrieve_dataset(*args).load()
+
+def _retrieve_all_loaded(database, *args):
+    """Retrieve several datasets on a worker thread of the asynchronous 
+    methods and load their data there, see _retrieve_loaded.
+    
+    Parameters
+    ----------
+        database : GadgetbridgeDatabase
+            The database of the worker thread
+        *args
+            The arguments of retrieve_datasets
+    
+    Returns
+    -------
+        list
+            The loaded containers
+    """
+    return [container.load() for container in 
+            database.retrieve_datasets(*args)]
 
 class ResultIterator:
     """A class used to iterate over sqlite3 cursor results in a for loop."""
@@ -68,11 +202,67 @@ class ResultIterator:
                 A list containing all rows
         """
         return self._cursor.fetchall()
+    
+    def iter_columns(self, batch_size=FETCH_BATCH_SIZE):
+        """Iterate over the remaining result rows in batches. Rows are pulled
+        from the cursor with fetchmany, and each batch is returned as one 
+        numpy.array per column.
+        
+        Parameters
+        ----------
+            batch_size : int
+                The number of rows to fetch per call to the cursor.
+                (Default: FETCH_BATCH_SIZE)
+        
+        Returns
+        -------
+            generator
+                Yields a list containing one numpy.array per result column for
+                each batch of rows
+        """
+        rows = self._cursor.fetchmany(batch_size)
+        while rows:
+            yield [array(column) for column in zip(*rows)]
+            rows = self._cursor.fetchmany(batch_size)
+    
+    def columns(self, batch_size=FETCH_BATCH_SIZE):
+        """Return all remaining result rows as one numpy.array per column. Rows
+        are pulled from the cursor in batches of batch_size using fetchmany,
+        so no Python object is kept per row.
+        
+        Parameters
+        ----------
+            batch_size : int
+                The number of rows to fetch per call to the cursor.
+                (Default: FETCH_BATCH_SIZE)
+        
+        Returns
+        -------
+            list
+                A list containing one numpy.array per result column
+        """
+        batches = [[] for i in range(len(self._cursor.description))]
+        for columns in self.iter_columns(batch_size):
+            for batch, column in zip(batches, columns):
+                batch.append(column)
+        res = []
+        for column in batches:
+            if len(column) == 0:
+                res.append(empty(0, dtype=int64))
+            else:
+                res.append(concatenate(column))
+        return res
 
 class GadgetbridgeDatabase:
-    """Provides a simple abstraction layer around the Sqlite DB."""
+    """Provides a simple abstraction layer around the Sqlite DB. Each thread
+    using the database queries on its own connection, so several threads can
+    read in parallel. The database can be used as context manager, which 
+    closes all connections on exit. Nothing is read from the file until it is
+    first needed, and the schema of the file is discovered once and cached."""
     
-    def __init__(self, filename, device):
+    def __init__(self, filename, device=None, cache=None, 
+                 max_async_queries=MAX_ASYNC_QUERIES, read_only=False, 
+                 immutable=False, pragmas=None, working_copy=None):
         """Initiate the interface. Pass a filename and a device name. The device
         name is used to pull database table mapping.
         
@@ -80,22 +270,104 @@ class GadgetbridgeDatabase:
         ----------
             filename : string
                 The name of the SQLite database file to open
-            device : string
+            device : string, None
                 The name of the device the data is stored for. This selects
-                table mappings for the database.
+                table mappings for the database and must be a key of 
+                device_db_mapping. If None, it is detected on first use, see 
+                detect_devices.
+                (Default: None)
+            cache : result_cache.ResultCache, None
+                If passed, retrieved containers store their downsampled 
+                results in the cache, and only load their data from the 
+                database when a result is not found in it.
+                (Default: None)
+            max_async_queries : int
+                The number of queries of the asynchronous methods running at 
+                once, each on its own connection and thread.
+                (Default: MAX_ASYNC_QUERIES)
+            read_only : bool
+                If True, the file is opened read-only, see 
+                connection_pool.open_connection.
+                (Default: False)
+            immutable : bool
+                If True, the file is opened read-only and assumed not to 
+                change while open, which skips all locking. Use it for 
+                exports only. Requires URI support of sqlite3, which Python 2
+                has if SQLite was built with URI filenames, see 
+                connection_pool.URI_SUPPORTED.
+                (Default: False)
+            pragmas : dict, None
+                The SQLite pragmas to apply to each connection, e.g. 
+                cache_size, mmap_size and temp_store, in addition to 
+                connection_pool.DEFAULT_PRAGMAS.
+                (Default: None)
+            working_copy : string, working_copy.WorkingCopy, None
+                If 'memory' or 'file', the file is copied into memory or into
+                a temporary file, and all queries run on the copy, which gets
+                a covering index on the timestamp, device id and dataset 
+                columns, which also covers the queries of iter_rows. The 
+                file itself is never modified. A WorkingCopy is used as is, 
+                and not deleted when the database is closed. If None, the file
+                is queried directly. Creating a working copy reads the file
+                and detects the device right away. 'memory' requires URI 
+                support of sqlite3 like immutable, see 
+                working_copy.WorkingCopy.
+                (Default: None)
         
         Returns
         -------
             None
         """
         self._db_filename = filename
-        self._db = sqlite3.connect(self._db_filename)
-        self._cursor = self._db.cursor()
-        self.results = ResultIterator(self._cursor)
-        self._query('SELECT name FROM sqlite_master WHERE type="table";')
-        self.tables = [x[0] for x in self.results.all()]
-        self.device = device
-        self._db_names = device_db_mapping[self.device]
+        self._executor = None
+        self._pool = None
+        self._owned_copy = None
+        if not device is None and not device in device_db_mapping:
+            raise LookupError('Unknown device ' + repr(device) + ', must be '
+                              'in ' + str(sorted(device_db_mapping)))
+        self._device = device
+        #Discovered schema information by key, see _discover:
+        self._schema = {}
+        #Serializes the loading of containers sharing a query, and the schema
+        #discovery:
+        self._lock = RLock()
+        self._connect_options = {'read_only': read_only, 
+                                 'immutable': immutable, 'pragmas': pragmas}
+        if working_copy in ('memory', 'file'):
+            working_copy = WorkingCopy(filename, 
+                                       in_memory=working_copy == 'memory')
+            self._owned_copy = working_copy
+        elif not working_copy is None and \
+                not isinstance(working_copy, WorkingCopy):
+            raise ValueError("working_copy must be 'memory', 'file', a "
+                             "WorkingCopy or None")
+        self._working_copy = working_copy
+        try:
+            if working_copy is None:
+                self._pool = ConnectionPool(self._db_filename, 
+                                            **self._connect_options)
+            else:
+                #The copy is private, queries cannot modify the file:
+                self._pool = ConnectionPool(working_copy.filename, 
+                                            read_only=True, pragmas=pragmas, 
+                                            uri=working_copy.uri)
+            if not self._owned_copy is None:
+                self._owned_copy.create_index(
+                    self._db_names['table'], 
+                    [self._db_names['timestamp'], 
+                     self._db_names['device_id']] + [
+                        self._db_names[name] for name 
+                        in self.available_datasets()])
+        except Exception:
+            #Do not leave the working copy behind:
+            self.close()
+            raise
+        #The cursor and results of each thread:
+        self._local = local()
+        #Built statement texts by dataset selection and restriction shape:
+        self._statements = {}
+        self._cache = cache
+        self._max_async_queries = max_async_queries
         
     def __del__(self):
         """Clear the class instance. This closes the database cleanly.
@@ -108,23 +380,236 @@ class GadgetbridgeDatabase:
         -------
             None
         """
-        self._cursor.close()
-        self._db.close()
+        self.close()
+    
+    def __enter__(self):
+        """Enter the context of the database.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            GadgetbridgeDatabase
+                The database itself
+        """
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the database when leaving its context.
+        
+        Parameters
+        ----------
+            exc_type : type, None
+                The type of the exception raised in the context, if any
+            exc_value : BaseException, None
+                The exception raised in the context, if any
+            traceback : traceback, None
+                The traceback of the exception, if any
+        
+        Returns
+        -------
+            bool
+                False, so exceptions are propagated
+        """
+        self.close()
+        return False
+    
+    def close(self):
+        """Close all connections to the database and delete its working copy,
+        if it made one. Closing it again has no effect.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            None
+        """
+        if not self._executor is None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if not self._pool is None:
+            self._pool.close()
+        if not self._owned_copy is None:
+            self._owned_copy.close()
+            self._owned_copy = None
+    
+    def _connection(self):
+        """Return the connection of the calling thread.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            sqlite3.Connection
+                The connection
+        """
+        return self._pool.connection()
+    
+    def _cursor(self):
+        """Return the cursor of the calling thread, that _query executes 
+        queries on.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            sqlite3.Cursor
+                The cursor
+        """
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._connection().cursor()
+            self._local.cursor = cursor
+            self._local.results = ResultIterator(cursor)
+        return cursor
+    
+    @property
+    def results(self):
+        """The results of the latest query of the calling thread, see _query.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            ResultIterator
+                The results
+        """
+        self._cursor()
+        return self._local.results
+    
+    def interrupt(self):
+        """Abort the queries currently running on the connections. They raise
+        a sqlite3.OperationalError in the threads running them.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            None
+        """
+        self._pool.interrupt()
         
-    def _query(self, querystring):
+    def _query(self, querystring, params=()):
         """Execute a query on the database.
         
         Parameters
         ----------
             querystring : string
                 The SQLite query string
+            params : tuple
+                The values bound to the placeholders of the query.
+                (Default: ())
+        
+        Returns
+        -------
+            None
+        """
+        self._cursor().execute(querystring, params)
+        
+    def _discover(self, key, compute):
+        """Return a piece of schema information, computing it on first use.
+        
+        Parameters
+        ----------
+            key : tuple
+                Identifies the information
+            compute : callable
+                Called without arguments to compute the information
+        
+        Returns
+        -------
+            object
+                The information
+        """
+        with self._lock:
+            if not key in self._schema:
+                self._schema[key] = compute()
+            return self._schema[key]
+    
+    def _fetch(self, querystring, params=()):
+        """Execute a query on its own cursor and return all rows, without 
+        replacing the results of the latest query.
+        
+        Parameters
+        ----------
+            querystring : string
+                The SQLite query string
+            params : tuple
+                The values bound to the placeholders of the query.
+                (Default: ())
         
         Returns
         -------
+            list
+                The rows
+        """
+        return self._connection().execute(querystring, params).fetchall()
+    
+    @property
+    def tables(self):
+        """The names of the tables in the database.
+        
+        Parameters
+        ----------
             None
+        
+        Returns
+        -------
+            list
+                The table names
         """
-        self._cursor.execute(querystring)
+        def compute():
+            return [row[0] for row in self._fetch(
+                "SELECT name FROM sqlite_master WHERE type = 'table';")]
+        return self._discover(('tables',), compute)
+    
+    @property
+    def device(self):
+        """The name of the device the data is stored for, detected on first
+        use if it was not passed.
         
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            string
+                The device name
+        """
+        if self._device is None:
+            with self._lock:
+                if self._device is None:
+                    self._device = self._detect_device()
+        return self._device
+    
+    @property
+    def _db_names(self):
+        """The table and column names of the device, see device_db_mapping.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            dict
+                The names by dataset
+        """
+        return device_db_mapping[self.device]
+    
     def query_tableinfo(self, table_name):
         """Retrieve info about a table in the database. Returns a dict 
         containing the entries:
@@ -140,75 +625,294 @@ class GadgetbridgeDatabase:
         
         Returns
         -------
-            None
+            dict, None
+                The lists of column indices, names and types, or None if the
+                table does not exist.
         """
-        if table_name in self.tables:
-            self.query('pragma table_info({table_name:s});'.format(
-                    table_name=table_name))
+        if not table_name in self.tables:
+            return None
+        def compute():
             res = {'name': [], 'type': [], 'index': []}
-            for row in self.results:
+            for row in self._fetch('PRAGMA table_info("{table_name:s}");'
+                                   .format(table_name=table_name)):
                 res['index'].append(row[0])
                 res['name'].append(row[1])
                 res['type'].append(row[2])
             return res
-        else:
-            return None
+        return self._discover(('tableinfo', table_name), compute)
+    
+    def detect_devices(self):
+        """Return the devices whose mapped table is present in the database,
+        has all mapped columns and contains at least one row.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            list
+                The sorted device names
+        """
+        def compute():
+            res = []
+            for device, names in sorted(device_db_mapping.items()):
+                info = self.query_tableinfo(names['table'])
+                if info is None or not all(
+                        column in info['name'] for key, column in 
+                        names.items() if key != 'table'):
+                    continue
+                if len(self._fetch('SELECT 1 FROM "{table:s}" LIMIT 1;'
+                                   .format(table=names['table']))) != 0:
+                    res.append(device)
+            return res
+        return self._discover(('devices',), compute)
+    
+    def _detect_device(self):
+        """Select the device of the database among the detected devices. If 
+        several devices share a table, the one mapping the most datasets is
+        selected.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            string
+                The device name
+        """
+        devices = self.detect_devices()
+        if len(devices) == 0:
+            raise LookupError('No known device table with data found in '
+                              + self._db_filename)
+        counts = [len(device_db_mapping[device]) for device in devices]
+        best = [device for device, count in zip(devices, counts) 
+                if count == max(counts)]
+        if len(best) != 1:
+            raise LookupError('Several devices found, select one of ' 
+                              + str(devices))
+        return best[0]
+    
+    def table_statistics(self, table=None):
+        """Return the number of rows and the range of timestamps of a mapped
+        table.
+        
+        Parameters
+        ----------
+            table : string, None
+                The name of the table. Must be the table of a device in 
+                device_db_mapping. If None, the table of the device is used.
+                (Default: None)
+        
+        Returns
+        -------
+            dict
+                The entries rows, timestamp_min and timestamp_max, with the 
+                timestamps as local datetime.datetime, or None if the table is
+                empty.
+        """
+        if table is None:
+            table = self._db_names['table']
+        timestamps = set(names['timestamp'] for names in 
+                         device_db_mapping.values() if names['table'] == table)
+        if len(timestamps) == 0:
+            raise LookupError('Table not in device_db_mapping: ' + table)
+        timestamp = timestamps.pop()
+        def compute():
+            rows, timestamp_min, timestamp_max = self._fetch(
+                'SELECT COUNT(*), MIN({timestamp:s}), MAX({timestamp:s}) FROM '
+                '"{table:s}";'.format(timestamp=timestamp, table=table))[0]
+            return {'rows': rows, 'timestamp_min': None if timestamp_min is 
+                    None else datetime.fromtimestamp(timestamp_min),
+                    'timestamp_max': None if timestamp_max is None else 
+                    datetime.fromtimestamp(timestamp_max)}
+        return self._discover(('statistics', table), compute)
+    
+    def schema(self):
+        """Describe the tables of all devices in device_db_mapping present in
+        the database. Computed on first use, later calls return the cached 
+        result.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            dict
+                By table name, a dict containing the entries:
+                    * devices: The devices mapped to the table, that have all
+                      their mapped columns in it
+                    * columns: The names of the columns of the table
+                    * rows, timestamp_min, timestamp_max: See 
+                      table_statistics
+        """
+        def compute():
+            res = {}
+            for device, names in sorted(device_db_mapping.items()):
+                table = names['table']
+                info = self.query_tableinfo(table)
+                if info is None:
+                    continue
+                if not table in res:
+                    res[table] = {'devices': [], 'columns': info['name']}
+                    res[table].update(self.table_statistics(table))
+                if all(column in info['name'] for key, column in 
+                       names.items() if key != 'table'):
+                    res[table]['devices'].append(device)
+            return res
+        return self._discover(('schema',), compute)
 
+    def _acceptance_expression(self, datasets):
+        """Build an SQL expression that is true for rows that are accepted by
+        the AcceptanceTester of at least one of the datasets.
+        
+        Parameters
+        ----------
+            datasets : list
+                The datasets whose acceptance rules should be applied
+        
+        Returns
+        -------
+            string, None
+                The SQL expression, or None if all rows are accepted.
+        """
+        expressions = []
+        for dataset in datasets:
+            conditions = AcceptanceTester(dataset).sql_conditions(
+                self._db_names[dataset])
+            if len(conditions) == 0:
+                return None
+            expressions.append('(' + ' AND '.join(conditions) + ')')
+        return '(' + ' OR '.join(expressions) + ')'
+    
     def _build_querystring(self, dataset, timestamp_min=None, 
-                           timestamp_max=None):
-        """Build a Sqlite query to pull the dataset from the database.
+                           timestamp_max=None, accepted_only=False,
+                           ordered=False, columns=None, present_only=False):
+        """Build a Sqlite query to pull the dataset from the database. The 
+        limits are passed as bound parameters, so the query text only depends
+        on the datasets, the columns, which limits are set and the flags. 
+        Repeated queries with other limits therefore reuse the statement 
+        prepared by the sqlite3 statement cache, and the text is only built 
+        once per combination.
         
         Parameters
         ----------
-            dataset : string
-                The dataset to build a query string for. Must be one of the 
-                following:
+            dataset : string, list
+                The dataset to build a query string for, or a list of datasets
+                to select in one query. Must be one of the following:
                     * timestamp
                     * heartrate
                     * intensity
                     * activity
                     * steps
-            timestamp_min : datetime.datetime, None
-                The lower limit (included) to return data for. If None, no 
-                lower limit will be set.
-            timestamp_max : datetime.datetime, None
-                The upper limit (not included) to return data for If None, no
-                upper limit will be set.
+            timestamp_min : datetime.datetime, int, None
+                The lower limit (included) to return data for, an int is taken
+                as Unix timestamp. If None, no lower limit will be set.
+            timestamp_max : datetime.datetime, int, None
+                The upper limit (not included) to return data for, an int is
+                taken as Unix timestamp. If None, no upper limit will be set.
+            accepted_only : bool
+                If True, rows that are rejected by the acceptance tests of all
+                requested datasets are excluded by the query.
+                (Default: False)
+            ordered : bool
+                If True, the rows are sorted by timestamp.
+                (Default: False)
+            columns : list, None
+                The datasets to select, in order. If None, the timestamp 
+                followed by the requested datasets is selected.
+                (Default: None)
+            present_only : bool
+                If True, rows with a NULL value of any requested dataset are 
+                excluded by the query.
+                (Default: False)
         
         Returns
         -------
-            string
-                An SQLite query string for the requested dataset
+            tuple
+                The (querystring, params) tuple of the SQLite query string for
+                the requested dataset and the values of its placeholders
         """
+        if isinstance(dataset, basestring):
+            dataset = [dataset]
+        if columns is None:
+            columns = ['timestamp'] + list(dataset)
+        where, params = self._build_where_clause(dataset, 
+                                                 timestamp_min=timestamp_min,
+                                                 timestamp_max=timestamp_max,
+                                                 accepted_only=accepted_only,
+                                                 present_only=present_only)
+        key = ('select', tuple(columns), where, ordered)
+        if not key in self._statements:
+            res = 'SELECT {columns:s} FROM {table:s}{where:s}'.format(
+                columns=', '.join(self._db_names[name] for name in columns),
+                table=self._db_names['table'], where=where)
+            if ordered:
+                res += ' ORDER BY ' + self._db_names['timestamp']
+            self._statements[key] = res + ';'
+        return self._statements[key], params
+    
+    def _build_where_clause(self, datasets, timestamp_min=None, 
+                            timestamp_max=None, accepted_only=False,
+                            present_only=False):
+        """Build the WHERE clause restricting a query on the datasets, with 
+        placeholders for the limits.
+        
+        Parameters
+        ----------
+            datasets : list
+                The datasets the query selects.
+            timestamp_min : datetime.datetime, int, None
+                The lower limit (included) to return data for, an int is taken
+                as Unix timestamp. If None, no lower limit will be set.
+            timestamp_max : datetime.datetime, int, None
+                The upper limit (not included) to return data for, an int is
+                taken as Unix timestamp. If None, no upper limit will be set.
+            accepted_only : bool
+                If True, rows that are rejected by the acceptance tests of all
+                datasets are excluded.
+                (Default: False)
+            present_only : bool
+                If True, rows with a NULL value of any of the datasets are 
+                excluded.
+                (Default: False)
+        
+        Returns
+        -------
+            tuple
+                The (clause, params) tuple of the WHERE clause, or an empty 
+                string if there are no restrictions, and the Unix timestamps 
+                of the set limits
+        """
+        limits = [limit for limit in (timestamp_min, timestamp_max) 
+                  if not limit is None]
+        params = tuple(_unix_timestamp(limit) for limit in limits)
+        key = ('where', tuple(datasets), timestamp_min is None, 
+               timestamp_max is None, accepted_only, present_only)
+        if key in self._statements:
+            return self._statements[key], params
         restrictions = []
         if not timestamp_min is None:
-            #val is the string of the Unix timestamp of the datetime:
-            val = str(int(time.mktime(timestamp_min.timetuple())))
-            restrictions.append([self._db_names['timestamp'],
-                                 '>=', val])
+            restrictions.append(self._db_names['timestamp'] + ' >= ?')
         if not timestamp_max is None:
-            #val is the string of the Unix timestamp of the datetime:
-            val = str(int(time.mktime(timestamp_max.timetuple())))
-            restrictions.append([self._db_names['timestamp'],
-                                 '<', val])
-        #Build the base query (timestamps is always selected):
-        query_template = 'SELECT {dataset_col:s} FROM {table:s}'
-        dataset_cols = self._db_names['timestamp'] + ', '\
-            + self._db_names[dataset]
-        res = query_template.format(dataset_col=dataset_cols,
-                                     table=self._db_names['table'])
-        #Append restriction expressions, if there are any:
+            restrictions.append(self._db_names['timestamp'] + ' < ?')
+        if accepted_only:
+            expression = self._acceptance_expression(datasets)
+            if not expression is None:
+                restrictions.append(expression)
+        if present_only:
+            restrictions.extend(self._db_names[dataset] + ' IS NOT NULL' 
+                                for dataset in datasets)
+        res = ''
         if len(restrictions) != 0:
-            field, operator, limit = restrictions[0]
-            query_restrictions = ' WHERE ' + field + ' ' + operator + ' '\
-                + limit
-            for field, operator, limit in restrictions[1:]:
-                query_restrictions += ' AND ' + field + ' ' + operator + ' '\
-                    + limit
-            res += query_restrictions 
-        return res + ';'
-        
-    def query_dataset(self, dataset, timestamp_min=None, timestamp_max=None):
+            res = ' WHERE ' + ' AND '.join(restrictions)
+        self._statements[key] = res
+        return res, params
+        
+    def query_dataset(self, dataset, timestamp_min=None, timestamp_max=None,
+                      accepted_only=False):
         """Builds the query to pull a dataset from the database and executes it.
         
         Parameters
@@ -227,24 +931,114 @@ class GadgetbridgeDatabase:
             timestamp_max : datetime.datetime, None
                 The upper limit (not included) to return data for If None, no
                 upper limit will be set.
+            accepted_only : bool
+                If True, rows that are rejected by the acceptance tests of all
+                requested datasets are not returned by the database.
+                (Default: False)
         
         Returns
         -------
             None
         """
-        datasets = self._db_names.keys()
-        datasets.remove('table')
-        datasets.remove('timestamp')
-        if not dataset in datasets:
-            raise LookupError('Dataset not available, must be in ' + \
-                              str(datasets))
-        self._query(self._build_querystring(dataset,
-                                            timestamp_min=timestamp_min, 
-                                            timestamp_max=timestamp_max))
+        self.query_datasets([dataset], timestamp_min=timestamp_min, 
+                            timestamp_max=timestamp_max, 
+                            accepted_only=accepted_only)
+    
+    def available_datasets(self):
+        """Return the names of the datasets available for the device.
         
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            list
+                The sorted dataset names
+        """
+        return sorted(name for name in self._db_names 
+                      if not name in ('table', 'timestamp', 'device_id'))
+    
+    def _check_datasets(self, datasets):
+        """Raise a LookupError if any of the datasets is not available for the 
+        device.
+        
+        Parameters
+        ----------
+            datasets : list
+                The dataset names to check
+        
+        Returns
+        -------
+            None
+        """
+        available = self.available_datasets()
+        for dataset in datasets:
+            if not dataset in available:
+                raise LookupError('Dataset not available, must be in ' + \
+                                  str(available))
+    
+    def query_datasets(self, datasets, timestamp_min=None, timestamp_max=None,
+                       accepted_only=False):
+        """Builds one query pulling several datasets from the database at once
+        and executes it. The result rows contain the timestamp followed by one 
+        column per dataset, in the order requested.
+        
+        Parameters
+        ----------
+            datasets : list
+                The datasets to query from the database. See query_dataset for
+                valid names.
+            timestamp_min : datetime.datetime, None
+                The lower limit (included) to return data for. If None, no 
+                lower limit will be set.
+            timestamp_max : datetime.datetime, None
+                The upper limit (not included) to return data for If None, no
+                upper limit will be set.
+            accepted_only : bool
+                If True, rows that are rejected by the acceptance tests of all
+                requested datasets are not returned by the database.
+                (Default: False)
+        
+        Returns
+        -------
+            None
+        """
+        self._check_datasets(datasets)
+        self._query(*self._build_querystring(datasets,
+                                             timestamp_min=timestamp_min, 
+                                             timestamp_max=timestamp_max,
+                                             accepted_only=accepted_only))
+        
+    def _cache_source(self, datasets, timestamp_min, timestamp_max):
+        """Describe the data of a retrieval for the result cache. Besides the
+        query, the data depends on the state of the database file and on the
+        local timezone the timestamps are converted to.
+        
+        Parameters
+        ----------
+            datasets : list
+                The datasets retrieved in one query
+            timestamp_min : datetime.datetime, None
+                The lower limit of the query
+            timestamp_max : datetime.datetime, None
+                The upper limit of the query
+        
+        Returns
+        -------
+            tuple
+                The description of the data
+        """
+        limits = tuple(None if limit is None else str(limit) 
+                       for limit in (timestamp_min, timestamp_max))
+        timezone = (time.timezone, time.altzone) + tuple(time.tzname)
+        return (database_identity(self._db_filename), self.device, 
+                tuple(datasets), timezone) + limits
+    
     def retrieve_dataset(self, dataset, timestamp_min=None, timestamp_max=None,
-                         time_resolution=None):
-        """Retrieve a dataset from the database.
+                         time_resolution=None, bulk=True):
+        """Retrieve a dataset from the database. Rows rejected by the 
+        acceptance tests of the dataset are already excluded by the query.
         
         Parameters
         ----------
@@ -265,35 +1059,398 @@ class GadgetbridgeDatabase:
             time_resolution : datetime.timedelta, None
                 The time resolution of the dataset container returned. If None,
                 the default of 1 minute will be used.
+            bulk : bool
+                If True, the rows are fetched in batches into arrays and passed
+                to the container in one call. If False, the rows are appended 
+                one by one.
+                (Default: True)
         
         Returns
         -------
             res : DatasetContainer
-                The container with the retrieved dataset.
+                The container with the retrieved dataset. If the database has 
+                a result cache, the data is only loaded when first needed.
         """
-        self.query_dataset(dataset, timestamp_min=timestamp_min, 
-                           timestamp_max=timestamp_max)
-        res = DatasetContainer(dataset, time_resolution=time_resolution)
-        for ts, val in self.results:
-            res.append(datetime.fromtimestamp(ts), val)
+        if time_resolution is None:
+            res = DatasetContainer(dataset)
+        else:
+            res = DatasetContainer(dataset, time_resolution=time_resolution)
+        describe = partial(self._cache_source, [dataset], timestamp_min, 
+                           timestamp_max)
+        def load(container):
+            source = None if self._cache is None else describe()
+            self.query_dataset(dataset, timestamp_min=timestamp_min, 
+                               timestamp_max=timestamp_max, accepted_only=True)
+            if bulk:
+                timestamps, values = self.results.columns()
+                container.append_many(local_datetime64(timestamps), values, 
+                                      copy=False)
+            else:
+                for ts, val in self.results:
+                    container.append(datetime.fromtimestamp(ts), val)
+            return _unchanged_source(source, describe)
+        if self._cache is None:
+            load(res)
+        else:
+            self._check_datasets([dataset])
+            res.attach_cache(self._cache, describe, loader=load)
         return res
     
+    def retrieve_datasets(self, datasets, timestamp_min=None, 
+                          timestamp_max=None, time_resolution=None):
+        """Retrieve several datasets from the database in a single pass. All
+        columns are selected in one query, and the timestamp column is fetched
+        and converted only once and shared by all returned containers. Rows
+        rejected by the acceptance tests of all datasets are excluded by the
+        query.
+        
+        Parameters
+        ----------
+            datasets : list
+                The datasets to retrieve from the database. See 
+                retrieve_dataset for valid names.
+            timestamp_min : datetime.datetime, None
+                The lower limit (included) to return data for. If None, no 
+                lower limit will be set.
+            timestamp_max : datetime.datetime, None
+                The upper limit (not included) to return data for If None, no
+                upper limit will be set.
+            time_resolution : datetime.timedelta, None
+                The time resolution of the dataset containers returned. If 
+                None, the default of 1 minute will be used.
+        
+        Returns
+        -------
+            res : list
+                One DatasetContainer per requested dataset, in the order 
+                requested. If the database has a result cache, the data is only
+                loaded when first needed, by a single query for all of them.
+        """
+        self._check_datasets(datasets)
+        describe = partial(self._cache_source, datasets, timestamp_min, 
+                           timestamp_max)
+        #The columns of the query and the description of their source, shared
+        #until every container has taken its column:
+        shared = {'columns': None, 'source': None, 'pending': len(datasets)}
+        def load(container, index):
+            with self._lock:
+                if shared['columns'] is None:
+                    source = None if self._cache is None else describe()
+                    self.query_datasets(datasets, timestamp_min=timestamp_min, 
+                                        timestamp_max=timestamp_max, 
+                                        accepted_only=True)
+                    columns = list(self.results.columns())
+                    columns[0] = local_datetime64(columns[0])
+                    shared['columns'] = columns
+                    shared['source'] = _unchanged_source(source, describe)
+                columns, source = shared['columns'], shared['source']
+                values, columns[index + 1] = columns[index + 1], None
+                shared['pending'] -= 1
+                if shared['pending'] == 0:
+                    shared['columns'] = None
+            container.append_many(columns[0], values, copy=False)
+            return source
+        res = []
+        for index, dataset in enumerate(datasets):
+            if time_resolution is None:
+                container = DatasetContainer(dataset)
+            else:
+                container = DatasetContainer(dataset, 
+                                             time_resolution=time_resolution)
+            if self._cache is None:
+                load(container, index)
+            else:
+                container.attach_cache(self._cache, describe, 
+                                       loader=partial(load, index=index))
+            res.append(container)
+        return res
+    
+    def _query_executor(self):
+        """Return the executor of the asynchronous methods, starting it on 
+        first use. Its worker threads open their own connections to the 
+        database file.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            QueryExecutor
+                The executor
+        """
+        if self._executor is None:
+            self._executor = QueryExecutor(
+                partial(GadgetbridgeDatabase, self._db_filename, self.device,
+                        cache=self._cache, working_copy=self._working_copy,
+                        **self._connect_options), 
+                max_workers=self._max_async_queries)
+        return self._executor
+    
+    def retrieve_dataset_async(self, dataset, timestamp_min=None, 
+                               timestamp_max=None, time_resolution=None):
+        """Retrieve a dataset from the database without blocking the calling
+        thread. The query runs and the data is loaded on a worker thread, see
+        QueryExecutor. The returned future can be awaited from asyncio code.
+        
+        Parameters
+        ----------
+            dataset : string
+                The dataset to retrieve, see retrieve_dataset.
+            timestamp_min : datetime.datetime, None
+                The lower limit (included) to return data for. If None, no 
+                lower limit will be set.
+            timestamp_max : datetime.datetime, None
+                The upper limit (not included) to return data for If None, no
+                upper limit will be set.
+            time_resolution : datetime.timedelta, None
+                The time resolution of the dataset container returned. If None,
+                the default of 1 minute will be used.
+        
+        Returns
+        -------
+            query_executor.JobFuture
+                The future of the DatasetContainer. Cancelling it interrupts 
+                the query.
+        """
+        return self._query_executor().run(_retrieve_loaded, dataset, 
+                                          timestamp_min, timestamp_max, 
+                                          time_resolution)
+    
+    def retrieve_datasets_async(self, datasets, timestamp_min=None, 
+                                timestamp_max=None, time_resolution=None):
+        """Retrieve several datasets from the database in a single pass 
+        without blocking the calling thread, see retrieve_datasets and 
+        retrieve_dataset_async.
+        
+        Parameters
+        ----------
+            datasets : list
+                The datasets to retrieve, see retrieve_datasets.
+            timestamp_min : datetime.datetime, None
+                The lower limit (included) to return data for. If None, no 
+                lower limit will be set.
+            timestamp_max : datetime.datetime, None
+                The upper limit (not included) to return data for If None, no
+                upper limit will be set.
+            time_resolution : datetime.timedelta, None
+                The time resolution of the dataset containers returned. If 
+                None, the default of 1 minute will be used.
+        
+        Returns
+        -------
+            query_executor.JobFuture
+                The future of the list of DatasetContainers. Cancelling it 
+                interrupts the query.
+        """
+        return self._query_executor().run(
+            _retrieve_all_loaded, datasets, timestamp_min, timestamp_max, 
+            time_resolution)
+    
+    def iter_dataset_chunks(self, dataset, timestamp_min=None, 
+                            timestamp_max=None, chunk_size=FETCH_BATCH_SIZE):
+        """Iterate over a dataset in chunks of at most chunk_size rows, in 
+        chronological order, without materializing the full result. The query
+        runs on its own cursor, so other queries can be issued while iterating.
+        Rows rejected by the acceptance tests of the dataset are excluded.
+        
+        Parameters
+        ----------
+            dataset : string
+                The dataset to retrieve from the database. See 
+                retrieve_dataset for valid names.
+            timestamp_min : datetime.datetime, None
+                The lower limit (included) to return data for. If None, no 
+                lower limit will be set.
+            timestamp_max : datetime.datetime, None
+                The upper limit (not included) to return data for If None, no
+                upper limit will be set.
+            chunk_size : int
+                The maximum number of rows per chunk.
+                (Default: FETCH_BATCH_SIZE)
+        
+        Returns
+        -------
+            generator
+                Yields (timestamps, values) tuples of numpy.array, with the 
+                timestamps as local datetime64 values
+        """
+        self._check_datasets([dataset])
+        cursor = self._connection().cursor()
+        try:
+            cursor.execute(*self._build_querystring(
+                dataset, timestamp_min=timestamp_min, 
+                timestamp_max=timestamp_max, accepted_only=True, ordered=True))
+            for timestamps, values in ResultIterator(cursor).iter_columns(
+                    chunk_size):
+                yield local_datetime64(timestamps), values
+        finally:
+            cursor.close()
+    
+    def iter_rows(self, dataset, timestamp_min=None, 
+                  batch_size=FETCH_BATCH_SIZE, present_only=False):
+        """Iterate over the raw rows of a dataset in batches, in chronological
+        order. Unlike the other retrieval functions, no rows are rejected 
+        unless present_only is set, timestamps are returned as stored in the 
+        database, and the device id of each row is returned, as rows of 
+        several device ids may share a timestamp. The query runs on its own 
+        cursor, and its cost only depends on the number of rows returned, as
+        the timestamp is the leading column of the primary key.
+        
+        Parameters
+        ----------
+            dataset : string
+                The dataset to retrieve from the database. See 
+                retrieve_dataset for valid names.
+            timestamp_min : int, None
+                The lower limit (included) as Unix timestamp. If None, no lower
+                limit will be set.
+                (Default: None)
+            batch_size : int
+                The maximum number of rows per batch.
+                (Default: FETCH_BATCH_SIZE)
+            present_only : bool
+                If True, rows with a NULL value are excluded by the query.
+                (Default: False)
+        
+        Returns
+        -------
+            generator
+                Yields lists of (Unix timestamp, device id, value) tuples
+        """
+        self._check_datasets([dataset])
+        cursor = self._connection().cursor()
+        try:
+            cursor.execute(*self._build_querystring(
+                dataset, timestamp_min=timestamp_min, ordered=True,
+                columns=['timestamp', 'device_id', dataset],
+                present_only=present_only))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+    
+    def retrieve_downsampled(self, dataset, aggregation, time_resolution,
+                             timestamp_min=None, timestamp_max=None, 
+                             plotter=Plotter):
+        """Retrieve a dataset downsampled by the database. The rows are grouped
+        into time bins with GROUP BY, so only one row per bin is transferred.
+        The bins are laid out like in DatasetContainer._downsample_data: they 
+        start at the earliest accepted local time and are aligned on local 
+        time, so the hour repeated when DST ends shares its bins.
+        Acceptance tests are applied, dataset filters are not.
+        
+        Parameters
+        ----------
+            dataset : string
+                The dataset to retrieve from the database. See 
+                retrieve_dataset for valid names.
+            aggregation : string
+                The reduction to perform per bin. Must be one of the following:
+                    * sum
+                    * mean
+                    * min
+                    * max
+                    * count
+            time_resolution : datetime.timedelta
+                The width of the time bins. Must be a whole number of seconds.
+            timestamp_min : datetime.datetime, None
+                The lower limit (included) to return data for. If None, no 
+                lower limit will be set.
+            timestamp_max : datetime.datetime, None
+                The upper limit (not included) to return data for If None, no
+                upper limit will be set.
+            plotter : class
+                The class providing plotting functionality for the result.
+                (Default: Plotter)
+        
+        Returns
+        -------
+            class
+                A class that provides plotting of the data set, as returned by
+                the DatasetContainer.downsample_* methods.
+        """
+        if not aggregation in _AGGREGATIONS:
+            raise ValueError('Aggregation must be one of ' 
+                             + str(sorted(_AGGREGATIONS)))
+        resolution = resolution_ticks(time_resolution)
+        if resolution % 1000000 != 0 or resolution <= 0:
+            raise ValueError('Time resolution must be a positive whole number'
+                             + ' of seconds.')
+        resolution //= 1000000
+        self._check_datasets([dataset])
+        where, params = self._build_where_clause([dataset], 
+                                                 timestamp_min=timestamp_min,
+                                                 timestamp_max=timestamp_max, 
+                                                 accepted_only=True)
+        timestamp = self._db_names['timestamp']
+        column = self._db_names[dataset]
+        #The earliest UTC timestamp is not the earliest local time if the 
+        #range starts in an hour that is repeated when DST ends:
+        local = _LOCAL_SECONDS.format(column=timestamp)
+        self._query('SELECT MIN({local:s}), MAX({local:s}) FROM '
+                    '{table:s}{where:s};'.format(
+                        local=local, table=self._db_names['table'], 
+                        where=where), params)
+        origin, end = self.results.all()[0]
+        if origin is None:
+            raise ValueError('No data to downsample')
+        nbins = (end - origin)//resolution + 1
+        self._query('SELECT ({local:s} - ?)/? AS BIN, SUM({column:s}), '
+                    'COUNT({column:s}), MIN({column:s}), MAX({column:s}) FROM '
+                    '{table:s}{where:s} GROUP BY BIN;'
+                    .format(local=local, column=column, 
+                            table=self._db_names['table'], where=where), 
+                    (origin, int(resolution)) + params)
+        bins, sums, counts, mins, maxs = self.results.columns()
+        #Guard against bins outside the range, which would wrap around:
+        inside = (bins >= 0) & (bins < nbins)
+        bins, sums, counts, mins, maxs = [result[inside] for result in 
+                                          (bins, sums, counts, mins, maxs)]
+        res_counts = zeros(nbins, dtype=int64)
+        res_counts[bins] = counts
+        if aggregation == 'count':
+            res_values = res_counts
+        elif aggregation == 'sum':
+            res_values = zeros(nbins, dtype=sums.dtype)
+            res_values[bins] = sums
+        elif aggregation == 'mean':
+            res_values = full(nbins, nan)
+            res_values[bins] = sums.astype(float)/counts
+        else:
+            res_values = full(nbins, nan)
+            res_values[bins] = mins if aggregation == 'min' else maxs
+        res_timestamps = (origin + arange(nbins, dtype=int64)*resolution)\
+            .astype('datetime64[s]')
+        return plotter(dataset, timestamps=res_timestamps, values=res_values)
+    
 if __name__ == '__main__':
     from datetime import timedelta
     from sys import argv
     from matplotlib import gridspec, pyplot as plt
+    from result_cache import ResultCache
+    from dataset_container import downsample_many
+    #Pass --no-cache to recompute all results, refreshing the cache:
+    bypass_cache = '--no-cache' in argv
+    argv = [arg for arg in argv if arg != '--no-cache']
     time_resolution = timedelta(days=1)
-    db = GadgetbridgeDatabase(argv[1], 'MI Band')
+    cache = ResultCache(argv[1] + '.cache', bypass=bypass_cache)
+    db = GadgetbridgeDatabase(argv[1], cache=cache)
     time_resolution=timedelta(days=1)
-    heartrate = db.retrieve_dataset('heartrate', time_resolution=time_resolution)
+    heartrate, steps = db.retrieve_datasets(['heartrate', 'steps'], 
+                                            time_resolution=time_resolution)
     heartrate.add_filter('heartrate')
-    steps = db.retrieve_dataset('steps', time_resolution=time_resolution)
+    heartrate_histogram, steps_sum = downsample_many([(heartrate, 'histogram'),
+                                                      (steps, 'sum')])
     fig = plt.figure()
     gs = gridspec.GridSpec(2,1,height_ratios=[4,1])
     plt.subplot(gs[0])
-    heartrate.downsample_histogram().plot()
+    heartrate_histogram.plot()
     plt.xticks([])
     plt.subplot(gs[1])
     plt.subplots_adjust(hspace=0)
-    steps.downsample_sum().plot()
+    steps_sum.plot()
     plt.savefig(argv[2])
\ No newline at end of file
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sqlite3
+from datetime import timedelta
+from dataset_container import DatasetContainer
+from gb_database import FETCH_BATCH_SIZE, ResultIterator, local_datetime64
+from gb_database import _unix_timestamp
+
+#Rows up to this much older than the watermark are imported again, as a
+#device may sync older samples after newer ones were exported:
+RESCAN_WINDOW = timedelta(days=2)
+#Stands for rows that are not stored yet, see LocalStore.import_database:
+_MISSING = object()
+
+class LocalStore:
+    """A persistent local store of the samples imported from Gadgetbridge
+    database exports. For each device and dataset, the latest imported
+    timestamp is recorded as watermark, so importing a new export only reads
+    the rows added since the previous import and those within a rescan window
+    before it. Rows are kept per device id, as several device ids may store
+    samples with the same timestamp."""
+
+    def __init__(self, filename):
+        """Open or create the store.
+
+        Parameters
+        ----------
+            filename : string
+                The name of the SQLite file holding the store
+
+        Returns
+        -------
+            None
+        """
+        self._filename = filename
+        self._db = sqlite3.connect(self._filename)
+        self._db.execute('CREATE TABLE IF NOT EXISTS SAMPLES (DEVICE TEXT NOT '
+                         'NULL, DATASET TEXT NOT NULL, TIMESTAMP INTEGER NOT '
+                         'NULL, DEVICE_ID INTEGER NOT NULL, VALUE NOT NULL, '
+                         'PRIMARY KEY (DEVICE, DATASET, TIMESTAMP, '
+                         'DEVICE_ID));')
+        self._db.execute('CREATE TABLE IF NOT EXISTS WATERMARKS (DEVICE TEXT '
+                         'NOT NULL, DATASET TEXT NOT NULL, TIMESTAMP INTEGER '
+                         'NOT NULL, PRIMARY KEY (DEVICE, DATASET));')
+        self._db.commit()
+
+    def __del__(self):
+        """Close the store.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        self._db.close()
+
+    def watermark(self, device, dataset):
+        """Return the latest imported timestamp of a dataset.
+
+        Parameters
+        ----------
+            device : string
+                The name of the device
+            dataset : string
+                The name of the dataset
+
+        Returns
+        -------
+            int, None
+                The Unix timestamp, or None if nothing was imported yet.
+        """
+        row = self._db.execute('SELECT TIMESTAMP FROM WATERMARKS WHERE '
+                               'DEVICE = ? AND DATASET = ?;',
+                               (device, dataset)).fetchone()
+        return None if row is None else row[0]
+
+    def import_database(self, database, datasets=None,
+                        batch_size=FETCH_BATCH_SIZE,
+                        rescan_window=RESCAN_WINDOW):
+        """Import the rows of a database newer than the watermarks minus the
+        rescan window. The rows of the rescan window are compared with the
+        stored ones, and only new rows and rows whose value changed are
+        written. Rows with a NULL value are excluded by the query, so they are
+        neither stored nor counted. The rows and the new watermark of each
+        dataset are committed together, so an interrupted import is repeated
+        completely the next time.
+
+        Parameters
+        ----------
+            database : gb_database.GadgetbridgeDatabase
+                The database to import from
+            datasets : list, None
+                The datasets to import. If None, all datasets available for
+                the device of the database are imported.
+                (Default: None)
+            batch_size : int
+                The number of rows read and written at once.
+                (Default: FETCH_BATCH_SIZE)
+            rescan_window : datetime.timedelta
+                How far before the watermark rows are imported again.
+                (Default: RESCAN_WINDOW)
+
+        Returns
+        -------
+            dict
+                The number of new or changed rows by dataset
+        """
+        if datasets is None:
+            datasets = database.available_datasets()
+        res = {}
+        for dataset in datasets:
+            watermark = self.watermark(database.device, dataset)
+            timestamp_min = None if watermark is None else \
+                watermark - int(rescan_window.total_seconds())
+            stored = self._stored_values(database.device, dataset,
+                                         timestamp_min)
+            count = 0
+            latest = watermark
+            for rows in database.iter_rows(dataset, timestamp_min=timestamp_min,
+                                           batch_size=batch_size,
+                                           present_only=True):
+                #Only rows that are new or changed are written:
+                rows = [(database.device, dataset) + tuple(row)
+                        for row in rows
+                        if stored.get(tuple(row[:2]), _MISSING) != row[2]]
+                if len(rows) == 0:
+                    continue
+                self._db.executemany('INSERT OR REPLACE INTO SAMPLES VALUES '
+                                     '(?, ?, ?, ?, ?);', rows)
+                count += len(rows)
+                if latest is None or rows[-1][2] > latest:
+                    latest = rows[-1][2]
+            if latest != watermark:
+                self._db.execute('INSERT OR REPLACE INTO WATERMARKS VALUES '
+                                 '(?, ?, ?);',
+                                 (database.device, dataset, latest))
+            self._db.commit()
+            res[dataset] = count
+        return res
+
+    def _stored_values(self, device, dataset, timestamp_min):
+        """Return the stored values of a dataset from a timestamp on, to
+        compare the rows of the rescan window with.
+
+        Parameters
+        ----------
+            device : string
+                The name of the device
+            dataset : string
+                The name of the dataset
+            timestamp_min : int, None
+                The lower limit (included) as Unix timestamp. If None, nothing
+                is stored yet and no values are returned.
+
+        Returns
+        -------
+            dict
+                The values by (Unix timestamp, device id) tuple
+        """
+        if timestamp_min is None:
+            return {}
+        cursor = self._db.execute('SELECT TIMESTAMP, DEVICE_ID, VALUE FROM '
+                                  'SAMPLES WHERE DEVICE = ? AND DATASET = ? '
+                                  'AND TIMESTAMP >= ?;',
+                                  (device, dataset, timestamp_min))
+        return dict(((ts, device_id), value)
+                    for ts, device_id, value in cursor)
+
+    def retrieve_dataset(self, device, dataset, timestamp_min=None,
+                         timestamp_max=None, time_resolution=None):
+        """Retrieve a dataset from the store. Like
+        GadgetbridgeDatabase.retrieve_dataset, rows rejected by the acceptance
+        tests of the dataset are dropped by the container.
+
+        Parameters
+        ----------
+            device : string
+                The name of the device
+            dataset : string
+                The name of the dataset
+            timestamp_min : datetime.datetime, None
+                The lower limit (included) to return data for. If None, no
+                lower limit will be set.
+                (Default: None)
+            timestamp_max : datetime.datetime, None
+                The upper limit (not included) to return data for If None, no
+                upper limit will be set.
+                (Default: None)
+            time_resolution : datetime.timedelta, None
+                The time resolution of the dataset container returned. If None,
+                the default of 1 minute will be used.
+                (Default: None)
+
+        Returns
+        -------
+            res : DatasetContainer
+                The container with the retrieved dataset.
+        """
+        query = 'SELECT TIMESTAMP, VALUE FROM SAMPLES WHERE DEVICE = ? AND '\
+            'DATASET = ?'
+        params = [device, dataset]
+        if not timestamp_min is None:
+            query += ' AND TIMESTAMP >= ?'
+            params.append(_unix_timestamp(timestamp_min))
+        if not timestamp_max is None:
+            query += ' AND TIMESTAMP < ?'
+            params.append(_unix_timestamp(timestamp_max))
+        cursor = self._db.cursor()
+        try:
+            cursor.execute(query + ' ORDER BY TIMESTAMP, DEVICE_ID;', params)
+            timestamps, values = ResultIterator(cursor).columns()
+        finally:
+            cursor.close()
+        if time_resolution is None:
+            res = DatasetContainer(dataset)
+        else:
+            res = DatasetContainer(dataset, time_resolution=time_resolution)
+        res.append_many(local_datetime64(timestamps), values, copy=False)
+        return res
+
+    def datasets(self):
+        """Return the devices and datasets in the store.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            list
+                Sorted (device, dataset) tuples
+        """
+        return [tuple(row) for row in self._db.execute(
+                'SELECT DEVICE, DATASET FROM WATERMARKS ORDER BY DEVICE, '
+                'DATASET;')]
@@ -59,6 +59,24 @@ class Plotter:
         """
         self._plotfunc()
     
+    def data(self):
+        """Return the data stored in the class.
+        
+        Parameters
+        ----------
+            None
+        
+        Returns
+        -------
+            dict
+                The arrays passed to the class by name, i.e. timestamps and 
+                values, or timestamps, bins and histogram.
+        """
+        if self._plotfunc == self._line_plot:
+            return {'timestamps': self._timestamps, 'values': self._values}
+        return {'timestamps': self._timestamps, 'bins': self._bins, 
+                'histogram': self._histogram}
+    
     def _line_plot(self):
         """Plot the data stored in the class as a line plot.
         
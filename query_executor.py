@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from threading import Condition, Lock, local
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+#Default number of queries running at once on a QueryExecutor:
+MAX_ASYNC_QUERIES = 4
+
+class CancelledError(Exception):
+    """Raised when the result of a cancelled JobFuture is requested."""
+    pass
+
+class JobFuture:
+    """The result of a job running on a JobExecutor. The result is waited for
+    with result, and with asyncio it can also be awaited, which does not
+    block the event loop. Cancelling the future drops the job if it has not
+    started yet, and calls the cancel hook of the job otherwise."""
+
+    def __init__(self, on_cancel=None):
+        """Initialize a pending future.
+
+        Parameters
+        ----------
+            on_cancel : callable, None
+                Called without arguments when the future is cancelled.
+                (Default: None)
+
+        Returns
+        -------
+            None
+        """
+        self._condition = Condition()
+        self._on_cancel = on_cancel
+        self._callbacks = []
+        self._done = False
+        self._cancelled = False
+        self._result = self._error = None
+
+    def _finish(self, result=None, error=None, cancelled=False):
+        """Set the outcome of the future, unless it is already done, and run
+        the callbacks.
+
+        Parameters
+        ----------
+            result : object
+                The result of the job
+            error : Exception, None
+                The exception raised by the job, if any
+            cancelled : bool
+                Whether the future is cancelled
+
+        Returns
+        -------
+            bool
+                Whether the outcome was set
+        """
+        with self._condition:
+            if self._done:
+                return False
+            self._done, self._cancelled = True, cancelled
+            self._result, self._error = result, error
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for callback in callbacks:
+            callback(self)
+        return True
+
+    def done(self):
+        """Return whether the job has finished or was cancelled.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            bool
+                Whether the future is done
+        """
+        return self._done
+
+    def cancelled(self):
+        """Return whether the future was cancelled.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            bool
+                Whether the future was cancelled
+        """
+        return self._cancelled
+
+    def cancel(self):
+        """Cancel the job. A running job is asked to stop by the cancel hook,
+        the future is cancelled right away either way.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            bool
+                False if the job had already finished, True otherwise
+        """
+        if not self._finish(cancelled=True):
+            return False
+        if not self._on_cancel is None:
+            self._on_cancel()
+        return True
+
+    def result(self, timeout=None):
+        """Wait for the job and return its result.
+
+        Parameters
+        ----------
+            timeout : float, None
+                The maximum number of seconds to wait. If None, wait until the
+                job has finished.
+                (Default: None)
+
+        Returns
+        -------
+            object
+                The result of the job. The exception raised by the job is
+                raised again, CancelledError if the future was cancelled.
+        """
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise RuntimeError('The job did not finish within the timeout')
+        if self._cancelled:
+            raise CancelledError('The job was cancelled')
+        if not self._error is None:
+            raise self._error
+        return self._result
+
+    def add_done_callback(self, callback):
+        """Call a function with the future once it is done, right away if it
+        already is.
+
+        Parameters
+        ----------
+            callback : callable
+                Called with the future as only argument, on the thread that
+                finishes the future.
+
+        Returns
+        -------
+            None
+        """
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def __await__(self):
+        """Wait for the job from a coroutine without blocking the event loop
+        of the calling thread. Cancelling the awaiting task cancels the job.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            iterator
+                The iterator of the awaitable
+        """
+        if asyncio is None:
+            raise RuntimeError('Awaiting a job requires asyncio')
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        def forward(future):
+            if waiter.done():
+                return
+            if future.cancelled():
+                waiter.cancel()
+            elif not future._error is None:
+                waiter.set_exception(future._error)
+            else:
+                waiter.set_result(future._result)
+        def cancel(waiter):
+            if waiter.cancelled():
+                self.cancel()
+        waiter.add_done_callback(cancel)
+        self.add_done_callback(
+            lambda future: loop.call_soon_threadsafe(forward, future))
+        return waiter.__await__()
+
+class JobExecutor:
+    """Runs blocking work on a pool of threads and returns JobFutures of the
+    results. The number of threads caps the number of jobs running at once,
+    further jobs wait in the queue of the pool."""
+
+    def __init__(self, max_workers=MAX_ASYNC_QUERIES):
+        """Start the pool of threads.
+
+        Parameters
+        ----------
+            max_workers : int
+                The number of worker threads.
+                (Default: MAX_ASYNC_QUERIES)
+
+        Returns
+        -------
+            None
+        """
+        self._pool = ThreadPool(max_workers)
+
+    def _start(self, future, func, *args):
+        """Run a job on a worker thread unless its future was cancelled, and
+        set the outcome of the future.
+
+        Parameters
+        ----------
+            future : JobFuture
+                The future of the job
+            func : callable
+                The function to run
+            *args
+                The arguments to call the function with
+
+        Returns
+        -------
+            None
+        """
+        if future.done():
+            return
+        try:
+            result = func(*args)
+        except Exception as error:
+            future._finish(error=error)
+        else:
+            future._finish(result=result)
+
+    def submit(self, func, *args):
+        """Run a function on a worker thread.
+
+        Parameters
+        ----------
+            func : callable
+                The function to run
+            *args
+                The arguments to call the function with
+
+        Returns
+        -------
+            JobFuture
+                The future of the result of the function
+        """
+        future = JobFuture()
+        self._pool.apply_async(partial(self._start, future, func, *args))
+        return future
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once the queued jobs are done.
+
+        Parameters
+        ----------
+            wait : bool
+                If True, wait for the jobs to finish.
+                (Default: True)
+
+        Returns
+        -------
+            None
+        """
+        self._pool.close()
+        if wait:
+            self._pool.join()
+
+class QueryExecutor(JobExecutor):
+    """Runs blocking database work on a dedicated pool of threads. Each worker
+    thread opens its own connection on first use and keeps it, so queries on
+    different threads never share a connection. Cancelling the future of a
+    waiting job drops it, and cancelling the future of a running job
+    interrupts the query of its connection."""
+
+    def __init__(self, connect, max_workers=MAX_ASYNC_QUERIES):
+        """Start the pool of threads.
+
+        Parameters
+        ----------
+            connect : callable
+                Called without arguments once per worker thread to open its
+                connection. The connection must expose an interrupt method,
+                which aborts the query running on it.
+            max_workers : int
+                The number of worker threads and connections.
+                (Default: MAX_ASYNC_QUERIES)
+
+        Returns
+        -------
+            None
+        """
+        JobExecutor.__init__(self, max_workers)
+        self._connect = connect
+        self._local = local()
+
+    def _connection(self):
+        """Return the connection of the calling worker thread, opening it on
+        first use.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            object
+                The connection returned by the connect callable
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    def run(self, func, *args):
+        """Run a function with the connection of a worker thread.
+
+        Parameters
+        ----------
+            func : callable
+                The function to run. It is called with the connection followed
+                by the arguments.
+            *args
+                The further arguments to call the function with
+
+        Returns
+        -------
+            JobFuture
+                The future of the result of the function. Cancelling it
+                interrupts the function if it is already running.
+        """
+        #The connection the job runs on while it runs, so cancelling the
+        #future can interrupt it:
+        job = {'connection': None}
+        lock = Lock()
+        def work():
+            with lock:
+                if future.done():
+                    return None
+                job['connection'] = self._connection()
+            try:
+                return func(job['connection'], *args)
+            finally:
+                with lock:
+                    job['connection'] = None
+        def cancel():
+            with lock:
+                if not job['connection'] is None:
+                    job['connection'].interrupt()
+        future = JobFuture(cancel)
+        self._pool.apply_async(partial(self._start, future, work))
+        return future
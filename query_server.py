@@ -0,0 +1,593 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from numpy import asarray, isnan, percentile
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import parse_qs, urlparse
+from filter_provider import DatasetFilter
+from gb_database import GadgetbridgeDatabase
+from result_cache import database_identity
+
+#Default port of the server, which only listens on localhost by default:
+DEFAULT_PORT = 8765
+#Default number of threads answering requests, each with its own connection:
+DEFAULT_WORKERS = 4
+#Default number of responses kept in the LRU cache:
+DEFAULT_CACHE_ENTRIES = 256
+#Number of latest latencies per endpoint the percentiles are computed from:
+_LATENCY_SAMPLES = 1000
+#Aggregations of the /series endpoint, each a downsample method of the
+#container:
+_SERIES_AGGREGATIONS = ('mean', 'median', 'sum', 'min', 'max', 'count',
+                        'variance')
+#Accepted formats of the start and end parameters:
+_TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+#Default of query parameters that must be passed:
+_REQUIRED = object()
+
+def _parse_timestamp(value):
+    """Parse a timestamp parameter in local time.
+
+    Parameters
+    ----------
+        value : string
+            The timestamp in one of the _TIMESTAMP_FORMATS
+
+    Returns
+    -------
+        datetime.datetime
+            The parsed timestamp
+    """
+    for timestamp_format in _TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid timestamp ' + value + ', must be formatted '
+                     'like 2018-03-25T12:00:00')
+
+def _json_array(values):
+    """Convert an array to a nested list for JSON, with timestamps as ISO
+    strings and NaN as None.
+
+    Parameters
+    ----------
+        values : numpy.array
+            The array to convert
+
+    Returns
+    -------
+        list
+            The converted values
+    """
+    values = asarray(values)
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[s]').astype(str).tolist()
+    values = values.astype(float)
+    if not isnan(values).any():
+        return values.tolist()
+    res = values.astype(object)
+    res[isnan(values)] = None
+    return res.tolist()
+
+class LRUCache:
+    """A thread-safe mapping holding a limited number of entries. When it is
+    full, the least recently used entry is evicted."""
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        """Initialize an empty cache.
+
+        Parameters
+        ----------
+            max_entries : int
+                The maximum number of entries.
+                (Default: DEFAULT_CACHE_ENTRIES)
+
+        Returns
+        -------
+            None
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        """Return the number of entries.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            int
+                The number of entries
+        """
+        return len(self._entries)
+
+    def get(self, key):
+        """Return an entry and mark it as most recently used.
+
+        Parameters
+        ----------
+            key : hashable
+                The key of the entry
+
+        Returns
+        -------
+            object
+                The entry, or None if there is none.
+        """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store an entry, evicting the least recently used entry if the cache
+        is full.
+
+        Parameters
+        ----------
+            key : hashable
+                The key of the entry
+            value : object
+                The entry, must not be None
+
+        Returns
+        -------
+            None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class LatencyStats:
+    """Collects the response times of a server per endpoint."""
+
+    def __init__(self):
+        """Initialize empty statistics.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        self._endpoints = {}
+        self._lock = Lock()
+
+    def record(self, endpoint, seconds, cached):
+        """Record the response time of a request.
+
+        Parameters
+        ----------
+            endpoint : string
+                The endpoint of the request
+            seconds : float
+                The response time in seconds
+            cached : bool
+                Whether the response was served from the cache
+
+        Returns
+        -------
+            None
+        """
+        with self._lock:
+            if not endpoint in self._endpoints:
+                self._endpoints[endpoint] = {
+                    'requests': 0, 'cached': 0, 'total': 0., 'max': 0.,
+                    'latest': deque(maxlen=_LATENCY_SAMPLES)}
+            stats = self._endpoints[endpoint]
+            stats['requests'] += 1
+            stats['cached'] += int(cached)
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['latest'].append(seconds)
+
+    def summary(self):
+        """Summarize the response times per endpoint in milliseconds.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            dict
+                By endpoint, a dict containing the number of requests and of
+                cached responses, and the mean and maximum response time of
+                all requests and the median and 95th percentile of the
+                _LATENCY_SAMPLES latest ones.
+        """
+        with self._lock:
+            res = {}
+            for endpoint, stats in self._endpoints.items():
+                latest = list(stats['latest'])
+                res[endpoint] = {
+                    'requests': stats['requests'], 'cached': stats['cached'],
+                    'mean_ms': 1e3*stats['total']/stats['requests'],
+                    'max_ms': 1e3*stats['max'],
+                    'p50_ms': 1e3*percentile(latest, 50),
+                    'p95_ms': 1e3*percentile(latest, 95)}
+            return res
+
+class QueryService:
+    """Answers JSON queries for the datasets of a database. Downsampled
+    responses are kept in an LRU cache, so repeated queries are answered from
+    memory. The cache keys include the state of the database file, so
+    responses are recomputed once the file changes. The endpoints are:
+        * /datasets: The available datasets
+        * /series: A dataset downsampled with the aggregation agg
+        * /histogram: A dataset downsampled into value histograms
+        * /stats: The response times per endpoint and the cache statistics
+    /series and /histogram take the parameters dataset, start and end (see
+    _TIMESTAMP_FORMATS), resolution (in seconds) and any number of filter
+    parameters naming dataset filters. /histogram also takes the value range
+    min and max, and the value bin width step."""
+
+    def __init__(self, filename, device, cache_entries=DEFAULT_CACHE_ENTRIES):
+        """Open the database read-only. Each worker thread of the server 
+        queries on its own connection, which it keeps.
+
+        Parameters
+        ----------
+            filename : string
+                The name of the SQLite database file to open
+            device : string, None
+                The name of the device the data is stored for. If None, it is
+                detected, see GadgetbridgeDatabase.detect_devices.
+            cache_entries : int
+                The number of responses kept in the cache.
+                (Default: DEFAULT_CACHE_ENTRIES)
+
+        Returns
+        -------
+            None
+        """
+        self._filename = filename
+        self._database = GadgetbridgeDatabase(filename, device,
+                                              read_only=True)
+        self.cache = LRUCache(cache_entries)
+        self.stats = LatencyStats()
+        self._endpoints = {'/datasets': self._datasets, '/series': self._series,
+                           '/histogram': self._histogram,
+                           '/stats': self._stats}
+
+    def respond(self, path, params):
+        """Answer a query.
+
+        Parameters
+        ----------
+            path : string
+                The endpoint of the query
+            params : dict
+                The lists of values of the query parameters by name, as
+                returned by urlparse.parse_qs
+
+        Returns
+        -------
+            tuple
+                The (status, body) tuple, where status is the HTTP status code
+                and body the JSON encoded response. Errors are returned as
+                JSON object with an error message: invalid queries with status
+                400, and failures of the server, such as database errors, with
+                status 500.
+        """
+        start = time.time()
+        if not path in self._endpoints:
+            return 404, json.dumps({'error': 'Unknown endpoint ' + path,
+                                    'endpoints': sorted(self._endpoints)})
+        status, cached = 200, False
+        try:
+            if path == '/stats':
+                body = json.dumps(self._stats(params))
+            else:
+                key = (path, tuple(sorted((name, tuple(values)) for name, 
+                                          values in params.items())),
+                       database_identity(self._filename))
+                body = self.cache.get(key)
+                cached = not body is None
+                if body is None:
+                    body = json.dumps(self._endpoints[path](params))
+                    self.cache.put(key, body)
+        except (LookupError, ValueError) as error:
+            status, body = 400, json.dumps({'error': str(error)})
+        except Exception as error:
+            #Answer instead of dropping the connection of the client:
+            status, body = 500, json.dumps({
+                'error': error.__class__.__name__ + ': ' + str(error)})
+        self.stats.record(path, time.time() - start, cached)
+        return status, body
+
+    def _param(self, params, name, convert=str, default=_REQUIRED):
+        """Return a query parameter.
+
+        Parameters
+        ----------
+            params : dict
+                The query parameters, see respond.
+            name : string
+                The name of the parameter
+            convert : callable
+                Converts the value of the parameter.
+                (Default: str)
+            default : object
+                The value if the parameter is not passed. If not given, the
+                parameter is required.
+
+        Returns
+        -------
+            object
+                The converted value of the last occurrence of the parameter
+        """
+        if not name in params:
+            if default is _REQUIRED:
+                raise ValueError('Missing parameter ' + name)
+            return default
+        return convert(params[name][-1])
+
+    def _retrieve(self, params):
+        """Retrieve and filter the dataset selected by the query parameters.
+
+        Parameters
+        ----------
+            params : dict
+                The query parameters, see QueryService.
+
+        Returns
+        -------
+            DatasetContainer
+                The dataset
+        """
+        resolution = self._param(params, 'resolution', int, 60)
+        if resolution <= 0:
+            raise ValueError('The resolution must be positive')
+        res = self._database.retrieve_dataset(
+            self._param(params, 'dataset'),
+            timestamp_min=self._param(params, 'start', _parse_timestamp, None),
+            timestamp_max=self._param(params, 'end', _parse_timestamp, None),
+            time_resolution=timedelta(seconds=resolution))
+        for filtername in params.get('filter', []):
+            if not filtername in DatasetFilter().available():
+                raise LookupError('Unknown filter ' + filtername)
+            res.add_filter(filtername)
+        if len(res) == 0:
+            raise LookupError('No data in the requested time range')
+        return res
+
+    def _datasets(self, params):
+        """Answer a /datasets query.
+
+        Parameters
+        ----------
+            params : dict
+                The query parameters, none are used.
+
+        Returns
+        -------
+            dict
+                The response
+        """
+        return {'datasets': self._database.available_datasets()}
+
+    def _series(self, params):
+        """Answer a /series query.
+
+        Parameters
+        ----------
+            params : dict
+                The query parameters, see QueryService.
+
+        Returns
+        -------
+            dict
+                The response, containing the dataset, the aggregation and the
+                timestamps and values of the bins
+        """
+        aggregation = self._param(params, 'agg', str, 'mean')
+        if not aggregation in _SERIES_AGGREGATIONS:
+            raise ValueError('Unknown aggregation, must be in '
+                             + str(_SERIES_AGGREGATIONS))
+        container = self._retrieve(params)
+        data = getattr(container, 'downsample_' + aggregation)().data()
+        return {'dataset': self._param(params, 'dataset'),
+                'agg': aggregation,
+                'timestamps': _json_array(data['timestamps']),
+                'values': _json_array(data['values'])}
+
+    def _histogram(self, params):
+        """Answer a /histogram query.
+
+        Parameters
+        ----------
+            params : dict
+                The query parameters, see QueryService.
+
+        Returns
+        -------
+            dict
+                The response, containing the dataset, the edges of the time
+                bins and the value bins, and the histogram with one row per
+                time bin, scaled to a maximum of 1 per row
+        """
+        container = self._retrieve(params)
+        data = container.downsample_histogram(
+            hist_min=self._param(params, 'min', float, None),
+            hist_max=self._param(params, 'max', float, None),
+            resolution=self._param(params, 'step', float, 5)).data()
+        return {'dataset': self._param(params, 'dataset'),
+                'timestamps': _json_array(data['timestamps']),
+                'bins': _json_array(data['bins']),
+                'histogram': _json_array(data['histogram'])}
+
+    def _stats(self, params):
+        """Answer a /stats query.
+
+        Parameters
+        ----------
+            params : dict
+                The query parameters, none are used.
+
+        Returns
+        -------
+            dict
+                The response, containing the latency summary, see
+                LatencyStats.summary, and the cache statistics
+        """
+        return {'latency': self.stats.summary(),
+                'cache': {'entries': len(self.cache),
+                          'max_entries': self.cache.max_entries,
+                          'hits': self.cache.hits,
+                          'misses': self.cache.misses}}
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Handles HTTP GET requests with the QueryService of the server."""
+
+    def do_GET(self):
+        """Answer a GET request.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        url = urlparse(self.path)
+        status, body = self.server.service.respond(url.path,
+                                                   parse_qs(url.query))
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Do not log requests, their latencies are collected by the service
+        instead.
+
+        Parameters
+        ----------
+            format : string
+                The format string of the message
+            *args
+                The arguments of the format string
+
+        Returns
+        -------
+            None
+        """
+        pass
+
+class QueryServer(HTTPServer):
+    """An HTTP server answering requests with a shared QueryService on a fixed
+    set of worker threads. As the threads live as long as the server, their
+    database connections and page caches are reused across requests."""
+
+    def __init__(self, address, service, workers=DEFAULT_WORKERS):
+        """Bind the server to an address and start the worker threads.
+
+        Parameters
+        ----------
+            address : tuple
+                The (host, port) tuple to listen on. Port 0 selects a free
+                port.
+            service : QueryService
+                The service answering the requests
+            workers : int
+                The number of worker threads. Further requests wait until a
+                thread is free.
+                (Default: DEFAULT_WORKERS)
+
+        Returns
+        -------
+            None
+        """
+        HTTPServer.__init__(self, address, QueryHandler)
+        self.service = service
+        self._workers = ThreadPool(workers)
+
+    def process_request(self, request, client_address):
+        """Queue a request for the worker threads.
+
+        Parameters
+        ----------
+            request : socket.socket
+                The connection of the client
+            client_address : tuple
+                The address of the client
+
+        Returns
+        -------
+            None
+        """
+        self._workers.apply_async(self._answer, (request, client_address))
+
+    def _answer(self, request, client_address):
+        """Answer a request on a worker thread and close its connection.
+
+        Parameters
+        ----------
+            request : socket.socket
+                The connection of the client
+            client_address : tuple
+                The address of the client
+
+        Returns
+        -------
+            None
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        """Close the socket and stop the worker threads once the queued 
+        requests are answered.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        HTTPServer.server_close(self)
+        self._workers.close()
+        self._workers.join()
+
+if __name__ == '__main__':
+    from sys import argv
+    #Usage: query_server.py databasefile [device] [port], the device is
+    #detected if not passed
+    device = argv[2] if len(argv) > 2 else None
+    port = int(argv[3]) if len(argv) > 3 else DEFAULT_PORT
+    server = QueryServer(('127.0.0.1', port), QueryService(argv[1], device))
+    print('Serving on http://127.0.0.1:' + str(server.server_address[1]))
+    server.serve_forever()
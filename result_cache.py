@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import time
+from hashlib import sha1
+from io import BytesIO
+from threading import Lock
+from numpy import load, savez
+
+#Default upper limit of the total size of the cached results in bytes:
+DEFAULT_MAX_BYTES = 64*1024*1024
+
+def database_identity(filename):
+    """Return a tuple identifying the current state of a database file. The
+    identity changes whenever the file is replaced or written to.
+
+    Parameters
+    ----------
+        filename : string
+            The name of the database file
+
+    Returns
+    -------
+        tuple
+            The absolute path, size and modification time of the file
+    """
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+
+class ResultCache:
+    """A persistent cache of downsampled results in a SQLite sidecar file.
+    Results are stored as sets of named numpy arrays, under a key computed from
+    a tuple of everything the result depends on. When the total size of the
+    stored results exceeds the limit, the least recently used results are
+    evicted. The cache can be used from several threads."""
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, bypass=False):
+        """Open or create the cache file.
+
+        Parameters
+        ----------
+            filename : string
+                The name of the SQLite file to store the results in
+            max_bytes : int
+                The upper limit of the total size of the stored results.
+                (Default: DEFAULT_MAX_BYTES)
+            bypass : bool
+                If True, cached results are never returned, but results are
+                still stored, which refreshes the cache.
+                (Default: False)
+
+        Returns
+        -------
+            None
+        """
+        self._filename = filename
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self._lock = Lock()
+        self._db = sqlite3.connect(self._filename, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS RESULTS (KEY TEXT '
+                         'PRIMARY KEY, DATA BLOB NOT NULL, SIZE INTEGER NOT '
+                         'NULL, ACCESSED REAL NOT NULL);')
+        self._db.commit()
+
+    def __del__(self):
+        """Close the cache file.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        self._db.close()
+
+    def _key(self, parts):
+        """Compute the key of a result.
+
+        Parameters
+        ----------
+            parts : tuple
+                Everything the result depends on. Must only contain numbers,
+                strings, None and tuples of them, so its repr is stable.
+
+        Returns
+        -------
+            string
+                The key of the result
+        """
+        return sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def get(self, parts):
+        """Return a stored result, or None if there is none or the cache is
+        bypassed.
+
+        Parameters
+        ----------
+            parts : tuple
+                Everything the result depends on, see _key.
+
+        Returns
+        -------
+            dict, None
+                The arrays of the result by name, or None.
+        """
+        if self.bypass:
+            return None
+        key = self._key(parts)
+        with self._lock:
+            row = self._db.execute('SELECT DATA FROM RESULTS WHERE KEY = ?;',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE RESULTS SET ACCESSED = ? WHERE KEY = ?;',
+                             (time.time(), key))
+            self._db.commit()
+        with load(BytesIO(bytes(row[0])), allow_pickle=False) as stored:
+            return dict((name, stored[name]) for name in stored.files)
+
+    def put(self, parts, arrays):
+        """Store a result and evict the least recently used results if the
+        cache is too large afterwards. Results containing object arrays, and
+        results larger than the cache, are not stored.
+
+        Parameters
+        ----------
+            parts : tuple
+                Everything the result depends on, see _key.
+            arrays : dict
+                The arrays of the result by name
+
+        Returns
+        -------
+            None
+        """
+        if any(array.dtype.hasobject for array in arrays.values()):
+            return
+        stream = BytesIO()
+        savez(stream, **arrays)
+        data = stream.getvalue()
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO RESULTS VALUES (?, ?, ?, '
+                             '?);', (self._key(parts), sqlite3.Binary(data), 
+                                     len(data), time.time()))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Delete the least recently used results until the total size is
+        below the limit.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        total = 0
+        evicted = []
+        for key, size in self._db.execute('SELECT KEY, SIZE FROM RESULTS '
+                                          'ORDER BY ACCESSED DESC;').fetchall():
+            total += size
+            if total > self.max_bytes:
+                evicted.append((key,))
+        self._db.executemany('DELETE FROM RESULTS WHERE KEY = ?;', evicted)
+
+    def size(self):
+        """Return the total size of the stored results.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            int
+                The size in bytes
+        """
+        with self._lock:
+            return self._db.execute('SELECT COALESCE(SUM(SIZE), 0) FROM '
+                                    'RESULTS;').fetchone()[0]
+
+    def clear(self):
+        """Delete all stored results.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM RESULTS;')
+            self._db.commit()
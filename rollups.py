@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from numpy import add, arange, asarray, concatenate, cumsum
+from numpy import fmax, fmin, int32, int64, nan, result_type, round as around
+from numpy import datetime64, searchsorted, zeros
+from binning import TimeBinning, resolution_ticks, to_ticks
+
+#Default widths of the rollup levels, each a multiple of the previous one:
+ROLLUP_LEVELS = (timedelta(minutes=1), timedelta(minutes=5),
+                 timedelta(hours=1), timedelta(days=1))
+#Maximum number of value bins of the stored histograms:
+HISTOGRAM_MAX_COLUMNS = 4096
+#Reductions the rollups can answer:
+_REDUCTIONS = ('sum', 'mean', 'min', 'max', 'count')
+
+class RollupPyramid:
+    """Pre-aggregated rollups of a dataset at several fixed time resolutions.
+    Each level stores the count, sum, minimum and maximum of the values per
+    bin, and the coarser levels also store value histograms. All levels are
+    anchored at the same origin, and each level is aggregated from the one
+    below it. A downsampling request is answered from the coarsest level whose
+    width divides the requested resolution, so it only touches one row per
+    bin of that level instead of every data point. Appended data is folded 
+    into the latest bins with extend."""
+
+    def __init__(self, timestamps, values, origin, levels=ROLLUP_LEVELS,
+                 histogram_step=0.5, histogram_min_width=timedelta(hours=1),
+                 histogram_max_columns=HISTOGRAM_MAX_COLUMNS):
+        """Build the rollups of a dataset.
+
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps of the data, as datetime64 array
+            values : numpy.array
+                The values of the data
+            origin : datetime.datetime, numpy.datetime64
+                The start of the first bin of every level. Must not be later
+                than the earliest timestamp.
+            levels : tuple
+                The widths of the levels as datetime.timedelta, in increasing
+                order. Each width must be a multiple of the previous one.
+                (Default: ROLLUP_LEVELS)
+            histogram_step : float
+                The width of the value bins of the stored histograms.
+                Requested histogram edges must be multiples of it.
+                (Default: 0.5)
+            histogram_min_width : datetime.timedelta
+                Histograms are only stored for levels at least this wide, as
+                they need one row of value bins per time bin.
+                (Default: timedelta(hours=1))
+            histogram_max_columns : int
+                Histograms are not stored if the values span more value bins,
+                so outliers cannot allocate huge histograms.
+                (Default: HISTOGRAM_MAX_COLUMNS)
+
+        Returns
+        -------
+            None
+        """
+        values = asarray(values)
+        self._widths = [resolution_ticks(level) for level in levels]
+        for finer, coarser in zip(self._widths[:-1], self._widths[1:]):
+            if coarser % finer != 0:
+                raise ValueError('Each rollup level must be a multiple of the '
+                                 'previous one')
+        self._origin = int(to_ticks(origin))
+        self._step = histogram_step
+        self._max_columns = histogram_max_columns
+        self._hist_levels = [i for i, width in enumerate(self._widths) if
+                             width >= resolution_ticks(histogram_min_width)]
+        #The value bins of the histograms are columns start, start + 1, ... 
+        #of the grid of multiples of the histogram step, see _grid_columns:
+        self._grid_start = None
+        self._ncolumns = 0
+        self._levels, self._histograms = self._aggregate(timestamps, values,
+                                                         self._origin)
+
+    def _grid_columns(self, values):
+        """Return the histogram columns of values, widening the grid to cover
+        them. Histograms are exact if all values lie on the grid of value
+        bins. If they do not, or the grid would get wider than the maximum
+        number of columns, no histograms are stored from then on.
+
+        Parameters
+        ----------
+            values : numpy.array
+                The values
+
+        Returns
+        -------
+            numpy.array, None
+                The column of each value, or None if histograms cannot be
+                stored.
+        """
+        if len(self._hist_levels) == 0 or len(values) == 0:
+            return None
+        grid = values/float(self._step)
+        if not (grid == around(grid)).all():
+            self._hist_levels = []
+            return None
+        grid = around(grid).astype(int64)
+        start, end = int(grid.min()), int(grid.max()) + 1
+        if not self._grid_start is None:
+            start = min(start, self._grid_start)
+            end = max(end, self._grid_start + self._ncolumns)
+        if end - start > self._max_columns:
+            self._hist_levels = []
+            return None
+        self._grid_start, self._ncolumns = start, end - start
+        return grid - start
+
+    def _aggregate(self, timestamps, values, origin):
+        """Aggregate data into the levels, and into the histograms if the 
+        values allow it.
+
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps of the data, as datetime64 array
+            values : numpy.array
+                The values of the data
+            origin : int
+                The start of the first bin of every level, in microseconds. 
+                Must be a multiple of the coarsest width from the origin of
+                the rollups.
+
+        Returns
+        -------
+            tuple
+                The (levels, histograms) tuple, where levels is the list of
+                count, sum, min and max arrays per level, and histograms the
+                dict of histograms by level, empty if there are none.
+        """
+        levels = []
+        binning = TimeBinning(timestamps, datetime64(origin, 'us'), 
+                              timedelta(microseconds=self._widths[0]))
+        level = {'count': binning.counts,
+                 'sum': binning.reduce(values, 'sum').astype(
+                    result_type(values.dtype, int64)),
+                 'min': binning.reduce(values, 'min'),
+                 'max': binning.reduce(values, 'max')}
+        levels.append(level)
+        for finer, coarser in zip(self._widths[:-1], self._widths[1:]):
+            level = self._group(level, coarser//finer)
+            levels.append(level)
+        histograms = {}
+        columns = self._grid_columns(values)
+        if columns is None:
+            return levels, histograms
+        first = self._hist_levels[0]
+        binning = TimeBinning(timestamps, datetime64(origin, 'us'),
+                              timedelta(microseconds=self._widths[first]))
+        histogram = binning.histogram(
+            columns, arange(self._ncolumns + 1)).astype(int32)
+        for i in self._hist_levels:
+            if i != first:
+                ratio = self._widths[i]//self._widths[i - 1]
+                histogram = add.reduceat(
+                    histogram, arange(0, len(histogram), ratio), axis=0)
+            histograms[i] = histogram
+        return levels, histograms
+
+    def extend(self, timestamps, values, unchanged):
+        """Update the rollups after data was appended. Only the bins of the
+        coarsest level from the one containing the first changed point on 
+        are aggregated again, the earlier bins are kept.
+
+        Parameters
+        ----------
+            timestamps : numpy.array
+                The timestamps of all data, as datetime64 array in 
+                chronological order
+            values : numpy.array
+                The values of all data
+            unchanged : int
+                The number of leading data points that are the same as when
+                the rollups were built or last extended. The timestamps of the
+                later points the rollups contain must not have changed.
+
+        Returns
+        -------
+            None
+        """
+        values = asarray(values)
+        if unchanged >= len(timestamps):
+            return
+        #The bins of the last unchanged point are aggregated again as well,
+        #so no bins are skipped between the kept and the new ones:
+        coarsest = self._widths[-1]
+        start = self._origin + (int(to_ticks(timestamps[max(unchanged - 1, 0)]))
+                                - self._origin)//coarsest*coarsest
+        first = searchsorted(to_ticks(timestamps), start)
+        old_start, old_ncolumns = self._grid_start, self._ncolumns
+        levels, histograms = self._aggregate(timestamps[first:], 
+                                             values[first:], start)
+        for i, width in enumerate(self._widths):
+            kept = (start - self._origin)//width
+            for name in levels[i]:
+                self._levels[i][name] = concatenate(
+                    (self._levels[i][name][:kept], levels[i][name]))
+        if len(histograms) == 0:
+            self._histograms = {}
+            return
+        for i, histogram in histograms.items():
+            kept = (start - self._origin)//self._widths[i]
+            widened = zeros((kept, self._ncolumns), dtype=int32)
+            if i in self._histograms:
+                offset = old_start - self._grid_start
+                widened[:, offset:offset + old_ncolumns] = \
+                    self._histograms[i][:kept]
+            self._histograms[i] = concatenate((widened, histogram))
+
+    def _group(self, level, ratio):
+        """Aggregate a level into bins of ratio times its width.
+
+        Parameters
+        ----------
+            level : dict
+                The count, sum, min and max arrays of the level
+            ratio : int
+                The number of bins of the level per new bin
+
+        Returns
+        -------
+            dict
+                The count, sum, min and max arrays of the new bins
+        """
+        starts = arange(0, len(level['count']), ratio)
+        return {'count': add.reduceat(level['count'], starts),
+                'sum': add.reduceat(level['sum'], starts),
+                'min': fmin.reduceat(level['min'], starts),
+                'max': fmax.reduceat(level['max'], starts)}
+
+    def level_for(self, time_resolution):
+        """Return the coarsest level whose width divides a time resolution.
+
+        Parameters
+        ----------
+            time_resolution : datetime.timedelta
+                The requested time resolution
+
+        Returns
+        -------
+            int, None
+                The index of the level, or None if no level divides the
+                resolution.
+        """
+        ticks = resolution_ticks(time_resolution)
+        for i in reversed(range(len(self._widths))):
+            if ticks % self._widths[i] == 0:
+                return i
+        return None
+
+    def value_range(self):
+        """Return the smallest and largest value, from the coarsest level.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            tuple
+                The (minimum, maximum) tuple, NaN if there are no values.
+        """
+        level = self._levels[-1]
+        return fmin.reduce(level['min']), fmax.reduce(level['max'])
+
+    def timestamps(self, time_resolution):
+        """Return the start timestamps of the bins of a time resolution, like
+        TimeBinning.timestamps.
+
+        Parameters
+        ----------
+            time_resolution : datetime.timedelta
+                The requested time resolution
+
+        Returns
+        -------
+            numpy.array
+                The bin start timestamps as datetime64 array
+        """
+        i = self.level_for(time_resolution)
+        ratio = resolution_ticks(time_resolution)//self._widths[i]
+        nbins = (len(self._levels[i]['count']) + ratio - 1)//ratio
+        return (self._origin + arange(nbins, dtype=int64)
+                *resolution_ticks(time_resolution)).astype('datetime64[us]')
+
+    def reduce(self, how, time_resolution):
+        """Reduce the values per bin of a time resolution, with the same
+        results as TimeBinning.reduce for bins starting at the origin.
+
+        Parameters
+        ----------
+            how : string
+                The reduction to perform, see TimeBinning.reduce.
+            time_resolution : datetime.timedelta
+                The requested time resolution
+
+        Returns
+        -------
+            numpy.array, None
+                One reduced value per bin, or None if no level divides the
+                resolution.
+        """
+        if not how in _REDUCTIONS:
+            raise ValueError('Unknown reduction ' + str(how))
+        i = self.level_for(time_resolution)
+        if i is None:
+            return None
+        level = self._group(self._levels[i],
+                            resolution_ticks(time_resolution)//self._widths[i])
+        if how == 'mean':
+            res = level['sum'].astype(float)
+            empty = level['count'] == 0
+            res[empty] = nan
+            res[~empty] /= level['count'][~empty]
+            return res
+        return level[how]
+
+    def histogram(self, edges, time_resolution):
+        """Compute the histograms of the values per bin of a time resolution,
+        with the same results as TimeBinning.histogram for bins starting at
+        the origin.
+
+        Parameters
+        ----------
+            edges : numpy.array
+                The monotonically increasing value bin edges
+            time_resolution : datetime.timedelta
+                The requested time resolution
+
+        Returns
+        -------
+            numpy.array, None
+                The counts, with shape (number of time bins, len(edges) - 1),
+                or None if no level with histograms divides the resolution,
+                the edges are not multiples of the histogram step, or the
+                values are not.
+        """
+        edges = asarray(edges, dtype=float)/self._step
+        if len(edges) < 2 or not (edges == around(edges)).all():
+            return None
+        ticks = resolution_ticks(time_resolution)
+        levels = [i for i in self._histograms if ticks % self._widths[i] == 0]
+        if len(levels) == 0:
+            return None
+        i = max(levels)
+        histogram = self._histograms[i]
+        ratio = ticks//self._widths[i]
+        histogram = add.reduceat(histogram, arange(0, len(histogram), ratio),
+                                 axis=0).astype(int64)
+        #Counts of the value bins below each column, to sum column ranges:
+        below = concatenate((zeros((len(histogram), 1), dtype=int64),
+                             cumsum(histogram, axis=1)), axis=1)
+        columns = around(edges).astype(int64) - self._grid_start
+        clipped = columns.clip(0, self._ncolumns)
+        res = below[:, clipped[1:]] - below[:, clipped[:-1]]
+        #The last value bin includes its upper edge:
+        if 0 <= columns[-1] < self._ncolumns:
+            res[:, -1] += histogram[:, columns[-1]]
+        return res
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..gb_database import GadgetbridgeDatabase
+import os
+import sqlite3
+import time
+import pytest
+
+#Start of the test data, 2018-03-25 is a DST change in many timezones:
+TEST_START = 1521936000
+TEST_ROWS = 1440
+#2018-10-28 00:00 in Europe/Berlin, three hours before DST ends there:
+DST_END_START = 1540677600
+
+def create_test_database(filename, rows=TEST_ROWS, start=TEST_START):
+    """Write a small MI Band database with per minute samples starting at 
+    start. Databases with more rows contain those with less rows, like
+    successive exports of the same device.
+    """
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE MI_BAND_ACTIVITY_SAMPLE (TIMESTAMP INTEGER NOT '
+               'NULL, DEVICE_ID INTEGER NOT NULL, USER_ID INTEGER NOT NULL, '
+               'RAW_INTENSITY INTEGER NOT NULL, STEPS INTEGER NOT NULL, '
+               'RAW_KIND INTEGER NOT NULL, HEART_RATE INTEGER NOT NULL, '
+               'PRIMARY KEY (TIMESTAMP, DEVICE_ID));')
+    rows = [(start + 60*i, 1, 1, i % 100, i % 13, 1, 
+             255 if i % 7 == 0 else 60 + i % 40) for i in range(rows)]
+    db.executemany('INSERT INTO MI_BAND_ACTIVITY_SAMPLE VALUES '
+                   '(?, ?, ?, ?, ?, ?, ?);', rows)
+    db.commit()
+    db.close()
+
+@pytest.fixture
+def database_file(tmpdir):
+    """Return the filename of a small MI Band database with one day of per
+    minute samples.
+    """
+    filename = str(tmpdir.join('gadgetbridge.db'))
+    create_test_database(filename)
+    return filename
+
+@pytest.fixture
+def database(database_file):
+    """Return a GadgetbridgeDatabase instance for the test database."""
+    return GadgetbridgeDatabase(database_file, 'MI Band')
+
+@pytest.fixture
+def berlin_time():
+    """Pin the local timezone of the process and of SQLite to Europe/Berlin
+    during a test.
+    """
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'Europe/Berlin'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+@pytest.fixture
+def dst_end_database(tmpdir, berlin_time):
+    """Return a GadgetbridgeDatabase instance with per minute samples from
+    midnight to 6:00 in Europe/Berlin on the night DST ends.
+    """
+    filename = str(tmpdir.join('dst_end.db'))
+    create_test_database(filename, 420, DST_END_START)
+    return GadgetbridgeDatabase(filename, 'MI Band')
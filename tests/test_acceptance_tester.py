@@ -4,6 +4,7 @@
 from ..filter_provider import AcceptanceTester
 from ..dataset_container import Datapoint
 from datetime import datetime
+from numpy import array, nan
 
 def test_heartrate_accept():
     """Test the correct acceptance for a valid heartrate Datapoint."""
@@ -58,3 +59,50 @@ def test_nofilter():
     acc_tester = AcceptanceTester('')
     dp = Datapoint(datetime(2018, 1, 1, 12, 0, 0), 1)
     assert acc_tester(dp) is True
+
+def test_mask():
+    """Test that array masks match testing single datapoints."""
+    values = array((-1, 0, 1, 100, 254, 255, 256))
+    for tester_type in ('heartrate', 'intensity', 'steps', ''):
+        acc_tester = AcceptanceTester(tester_type)
+        expected = [acc_tester(Datapoint(datetime(2018, 1, 1, 12, 0, 0), val))
+                    for val in values]
+        assert (acc_tester.mask(values) == array(expected)).all()
+
+def test_sql_conditions():
+    """Test that the SQL conditions select the same values as the mask."""
+    import sqlite3
+    values = (-1, 0, 1, 100, 254, 255, 256)
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE T (VALUE INTEGER);')
+    db.executemany('INSERT INTO T VALUES (?);', [(val,) for val in values])
+    for tester_type in ('heartrate', 'intensity', 'steps', ''):
+        acc_tester = AcceptanceTester(tester_type)
+        conditions = acc_tester.sql_conditions('VALUE')
+        query = 'SELECT VALUE FROM T'
+        if len(conditions) != 0:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        res = [row[0] for row in db.execute(query + ' ORDER BY VALUE;')]
+        assert res == [val for val, accepted 
+                       in zip(values, acc_tester.mask(array(values))) 
+                       if accepted]
+
+def test_missing_values():
+    """Test that NULL values are rejected by the SQL conditions, like missing
+    values by the mask and by testing single Datapoints.
+    """
+    import sqlite3
+    values = (None, -1, 0, 70, 255)
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE T (ID INTEGER, VALUE INTEGER);')
+    db.executemany('INSERT INTO T VALUES (?, ?);', enumerate(values))
+    for tester_type in ('heartrate', 'intensity', 'steps', 'activity'):
+        acc_tester = AcceptanceTester(tester_type)
+        mask = acc_tester.mask(array(values))
+        assert not mask[0] and mask[3]
+        assert not acc_tester.mask(array([nan, 70.]))[0]
+        assert not acc_tester(Datapoint(datetime(2018, 1, 1, 12, 0, 0), None))
+        query = 'SELECT ID FROM T WHERE ' + ' AND '.join(
+            acc_tester.sql_conditions('VALUE'))
+        res = [row[0] for row in db.execute(query + ' ORDER BY ID;')]
+        assert res == [i for i, accepted in enumerate(mask) if accepted]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..aggregators import Count, Sum, Mean, Min, Max, Variance, Quantile
+from ..aggregators import Collect, as_aggregator
+from numpy import array, concatenate, isnan, median, sort, var
+from numpy.random import RandomState
+import pytest
+
+@pytest.fixture
+def batches():
+    """Return random batches of values of different sizes."""
+    rand = RandomState(0)
+    return [rand.normal(70, 15, size) for size in (1, 10, 0, 500, 37)]
+
+def test_aggregators_match_numpy(batches):
+    """Test that updating in batches and merging match numpy results."""
+    values = concatenate(batches)
+    expected = {Count: len(values), Sum: values.sum(), Mean: values.mean(),
+                Min: values.min(), Max: values.max(), Variance: var(values)}
+    for cls, result in expected.items():
+        single = cls()
+        merged = cls()
+        for batch in batches:
+            single.update(batch)
+            part = cls()
+            part.update(batch)
+            merged.merge(part)
+        assert abs(single.result() - result) < 1e-9
+        assert abs(merged.result() - result) < 1e-9
+        assert abs(cls()(values) - result) < 1e-9
+
+def test_empty_results():
+    """Test the results of aggregators without data."""
+    assert Count().result() == 0 and Sum().result() == 0
+    for cls in (Mean, Min, Max, Variance, Quantile):
+        assert isnan(cls().result())
+    assert isnan(Variance(ddof=1)(array((1.,))))
+
+def test_quantile_error_bound():
+    """Test that quantile estimates are within the documented bound."""
+    rand = RandomState(1)
+    values = concatenate((rand.lognormal(3, 2, 5000), 
+                          -rand.lognormal(1, 1, 1000), [0.]*100))
+    ordered = sort(values)
+    for q in (0., 0.1, 0.5, 0.9, 0.99, 1.):
+        sketch = Quantile(q, relative_accuracy=0.02)
+        for batch in (values[:3000], values[3000:]):
+            part = sketch.empty()
+            part.update(batch)
+            sketch.merge(part)
+        exact = ordered[int(q*(len(values) - 1))]
+        assert abs(sketch.result() - exact) <= 0.02*abs(exact) + 1e-12
+    assert Quantile(0.5, exact=True)(values) == median(values)
+
+def test_quantile_bounded_buckets():
+    """Test that the number of buckets stays bounded, with the bound kept for
+    quantiles of the large values.
+    """
+    values = 10.**(array(range(-50, 50))/2.)
+    sketch = Quantile(0.9, max_buckets=20)
+    sketch.update(values)
+    assert len(sketch._positive) <= 20
+    exact = sort(values)[int(0.9*99)]
+    assert abs(sketch.result() - exact) <= 0.01*exact
+
+def test_invalid_quantile():
+    """Test that invalid quantile parameters raise errors."""
+    with pytest.raises(ValueError):
+        Quantile(1.5)
+    with pytest.raises(ValueError):
+        Quantile(0.5, relative_accuracy=1)
+    with pytest.raises(ValueError):
+        Quantile(0.5).merge(Quantile(0.5, exact=True))
+
+def test_as_aggregator():
+    """Test the mapping of downsample functions to aggregators."""
+    assert isinstance(as_aggregator('sum'), Sum)
+    assert isinstance(as_aggregator(median), Collect)
+    quantile = Quantile(0.3)
+    assert isinstance(as_aggregator(quantile), Quantile)
+    assert as_aggregator(quantile) is not quantile
+    assert as_aggregator(median)(array((1, 2, 3))) == 2
+    with pytest.raises(ValueError):
+        as_aggregator('mode')
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..binning import TimeBinning
+from datetime import datetime, timedelta
+from numpy import array, isnan, median
+from numpy.random import RandomState
+import pytest
+
+@pytest.fixture
+def random_data():
+    """Return unsorted timestamps with gaps and random integer values."""
+    rand = RandomState(0)
+    seconds = rand.randint(0, 86400, 2000)
+    seconds[(seconds > 20000)*(seconds < 30000)] = 0
+    timestamps = array([datetime(2018, 1, 1) + timedelta(seconds=int(sec)) 
+                        for sec in seconds])
+    values = rand.randint(0, 200, 2000)
+    return timestamps, values
+
+def reference(timestamps, values, start, resolution, func):
+    """Reduce values per time bin by masking the full data for each bin."""
+    res = []
+    cur_time = start
+    while cur_time <= max(timestamps):
+        mask = (timestamps >= cur_time)*(timestamps < cur_time + resolution)
+        res.append(func(values[mask]))
+        cur_time += resolution
+    return array(res, dtype=float)
+
+def test_bin_timestamps():
+    """Test that bins start at the origin and cover the latest timestamp."""
+    timestamps = array((datetime(2018, 1, 1, 12, 0, 0),
+                        datetime(2018, 1, 1, 12, 10, 0)))
+    binning = TimeBinning(timestamps, datetime(2018, 1, 1, 12, 0, 0), 
+                          timedelta(minutes=5))
+    assert binning.nbins == 3
+    assert (binning.timestamps() == array((datetime(2018, 1, 1, 12, 0, 0),
+                                           datetime(2018, 1, 1, 12, 5, 0),
+                                           datetime(2018, 1, 1, 12, 10, 0))))\
+                                           .all()
+    assert (binning.counts == array((1, 0, 1))).all()
+
+def test_reductions(random_data):
+    """Test that vectorized reductions match reducing each bin separately."""
+    timestamps, values = random_data
+    start = min(timestamps)
+    resolution = timedelta(minutes=17)
+    binning = TimeBinning(timestamps, start, resolution)
+    empty = binning.counts == 0
+    assert empty.any()
+    expected = reference(timestamps, values, start, resolution, len)
+    assert (binning.reduce(values, 'count') == expected).all()
+    expected = reference(timestamps, values, start, resolution, sum)
+    assert (binning.reduce(values, 'sum') == expected).all()
+    for how, func in (('mean', lambda x: x.mean() if len(x) else float('nan')),
+                      ('min', lambda x: x.min() if len(x) else float('nan')),
+                      ('max', lambda x: x.max() if len(x) else float('nan'))):
+        expected = reference(timestamps, values, start, resolution, func)
+        res = binning.reduce(values, how)
+        assert isnan(res[empty]).all()
+        assert (abs(res[~empty] - expected[~empty]) < 1e-9).all()
+
+def test_apply(random_data):
+    """Test that applying a function per bin matches the reference."""
+    timestamps, values = random_data
+    start = min(timestamps)
+    resolution = timedelta(hours=1)
+    binning = TimeBinning(timestamps, start, resolution)
+    func = lambda x: median(x) if len(x) else -1
+    expected = reference(timestamps, values, start, resolution, func)
+    assert (array(binning.apply(values, func)) == expected).all()
+
+def test_invalid_reduction(random_data):
+    """Test that unknown reductions raise an error."""
+    timestamps, values = random_data
+    binning = TimeBinning(timestamps, min(timestamps), timedelta(hours=1))
+    with pytest.raises(ValueError):
+        binning.reduce(values, 'mode')
+
+def test_histogram(random_data):
+    """Test that the one-pass histogram matches numpy.histogram per bin."""
+    from numpy import histogram
+    timestamps, values = random_data
+    start = min(timestamps)
+    resolution = timedelta(hours=2)
+    edges = array((0, 20, 50, 100, 150, 180))
+    binning = TimeBinning(timestamps, start, resolution)
+    expected = []
+    cur_time = start
+    while cur_time <= max(timestamps):
+        mask = (timestamps >= cur_time)*(timestamps < cur_time + resolution)
+        expected.append(histogram(values[mask], edges)[0])
+        cur_time += resolution
+    assert (binning.histogram(values, edges) == array(expected)).all()
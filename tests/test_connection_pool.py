@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..connection_pool import ConnectionPool, open_connection
+from threading import Thread
+import sqlite3
+import pytest
+
+def test_read_only(database_file, tmpdir):
+    """Test that read-only connections refuse writes and do not create
+    missing files.
+    """
+    connection = open_connection(database_file, read_only=True)
+    with pytest.raises(sqlite3.OperationalError):
+        connection.execute('CREATE TABLE TEST (ID INTEGER);')
+    assert connection.execute('SELECT COUNT(*) FROM '
+                              'MI_BAND_ACTIVITY_SAMPLE;').fetchone()[0] > 0
+    missing = tmpdir.join('missing.db')
+    with pytest.raises(sqlite3.OperationalError):
+        open_connection(str(missing), read_only=True)
+    assert not missing.check()
+
+def test_immutable(database_file, monkeypatch):
+    """Test that immutable connections refuse writes, and that they are
+    refused without URI support instead of silently locking the file.
+    """
+    from .. import connection_pool
+    if connection_pool.URI_SUPPORTED:
+        connection = open_connection(database_file, immutable=True)
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute('DELETE FROM MI_BAND_ACTIVITY_SAMPLE;')
+    monkeypatch.setattr(connection_pool, 'URI_SUPPORTED', False)
+    with pytest.raises(sqlite3.NotSupportedError):
+        open_connection(database_file, immutable=True)
+    with pytest.raises(sqlite3.NotSupportedError):
+        ConnectionPool(database_file, immutable=True)
+    connection = open_connection(database_file, read_only=True)
+    with pytest.raises(sqlite3.OperationalError):
+        connection.execute('DELETE FROM MI_BAND_ACTIVITY_SAMPLE;')
+
+def test_pragmas(database_file):
+    """Test that the default pragmas are applied and can be overridden."""
+    connection = open_connection(database_file)
+    assert connection.execute('PRAGMA cache_size;').fetchone()[0] == -65536
+    assert connection.execute('PRAGMA temp_store;').fetchone()[0] == 2
+    connection = open_connection(database_file, pragmas={'cache_size': 100})
+    assert connection.execute('PRAGMA cache_size;').fetchone()[0] == 100
+    with pytest.raises(ValueError):
+        open_connection(database_file, pragmas={'cache_size': '1; DROP'})
+    with pytest.raises(ValueError):
+        open_connection(database_file, pragmas={'cache size': 100})
+
+def test_connection_per_thread(database_file):
+    """Test that each thread gets its own connection, and that the
+    connections of finished threads are closed.
+    """
+    pool = ConnectionPool(database_file, read_only=True)
+    connection = pool.connection()
+    assert pool.connection() is connection
+    others = []
+    thread = Thread(target=lambda: others.append(pool.connection()))
+    thread.start()
+    thread.join()
+    assert not others[0] is connection and len(pool) == 2
+    #Opening another connection prunes the one of the finished thread:
+    thread = Thread(target=lambda: others.append(pool.connection()))
+    thread.start()
+    thread.join()
+    assert len(pool) == 2
+    with pytest.raises(sqlite3.ProgrammingError):
+        others[0].execute('SELECT 1;')
+    pool.close()
+    assert len(pool) == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection.execute('SELECT 1;')
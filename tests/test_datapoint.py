@@ -3,6 +3,7 @@
 
 from ..dataset_container import Datapoint
 from datetime import datetime
+import pytest
 
 def test_datapoint_construction():
     """Test that datapoints correctly store the values passed to them."""
@@ -13,4 +14,11 @@ def test_datapoint_iteration():
     """Test that data points correctly return values when iterated over"""
     dp = Datapoint(datetime(2018, 1, 1, 12, 0, 0), 2)
     ts, val = dp
-    assert ts == datetime(2018, 1, 1, 12, 0, 0) and val == 2
\ No newline at end of file
+    assert ts == datetime(2018, 1, 1, 12, 0, 0) and val == 2
+
+def test_datapoint_compact():
+    """Test that data points do not carry a per-instance dict."""
+    dp = Datapoint(datetime(2018, 1, 1, 12, 0, 0), 2)
+    with pytest.raises(AttributeError):
+        dp.extra = 1
+    assert tuple(dp) == (datetime(2018, 1, 1, 12, 0, 0), 2)
@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from ..dataset_container import DatasetContainer, Datapoint
+from ..dataset_container import TIMESTAMP_DTYPE, DatasetContainer, Datapoint
 from datetime import datetime, timedelta
-from numpy import array
+from numpy import arange, array
 import pytest
 
 @pytest.fixture
@@ -23,17 +23,50 @@ def test_append(dataset_container):
     dataset_container.append(datetime(2018, 1, 1, 12, 0, 0), 1)
     expected_timestamps = array((datetime(2018, 1, 1, 12, 0, 0)))
     expected_values = array((1))
-    assert len(dataset_container._raw_datapoints) == 1
-    assert dataset_container._raw_datapoints[0].value == 1 \
-        and dataset_container._raw_datapoints[0].timestamp == datetime(2018, 
-                                                                   1, 
-                                                                   1, 
-                                                                   12, 0, 0)
+    assert len(dataset_container) == 1
+    assert dataset_container._raw_values[0] == 1 \
+        and dataset_container._raw_timestamps[0] == datetime(2018, 1, 1, 
+                                                             12, 0, 0)
     assert (dataset_container._filtered_data['timestamps'] == 
             expected_timestamps).all() \
             and (dataset_container._filtered_data['values'] == 
                  expected_values).all()
 
+def test_append_invalid_value(dataset_container):
+    """Test that appending a missing or non-numeric value raises a ValueError
+    and leaves the container unchanged.
+    """
+    dataset_container.append(datetime(2018, 1, 1, 12, 0, 0), 1)
+    for value in (None, 'a', [1]):
+        with pytest.raises(ValueError):
+            dataset_container.append(datetime(2018, 1, 1, 12, 1, 0), value)
+    assert len(dataset_container) == 1
+
+def test_append_many(dataset_container):
+    """Test that batches of data points get appended correctly."""
+    timestamps = array((datetime(2018, 1, 1, 12, 0, 0),
+                        datetime(2018, 1, 1, 12, 1, 0),
+                        datetime(2018, 1, 1, 12, 2, 0)), 
+                       dtype='datetime64[s]')
+    dataset_container.append(datetime(2018, 1, 1, 11, 59, 0), 0)
+    dataset_container.append_many(timestamps, array((1, 2, 3)))
+    expected_timestamps = array((datetime(2018, 1, 1, 11, 59, 0),
+                                 datetime(2018, 1, 1, 12, 0, 0),
+                                 datetime(2018, 1, 1, 12, 1, 0),
+                                 datetime(2018, 1, 1, 12, 2, 0)))
+    assert (dataset_container['timestamps'] == expected_timestamps).all()
+    assert (dataset_container['values'] == array((0, 1, 2, 3))).all()
+
+def test_append_many_rejects():
+    """Test that batch appends apply the acceptance tests of the type."""
+    dataset_container = DatasetContainer('heartrate')
+    timestamps = array((datetime(2018, 1, 1, 12, 0, 0),
+                        datetime(2018, 1, 1, 12, 1, 0),
+                        datetime(2018, 1, 1, 12, 2, 0)))
+    dataset_container.append_many(timestamps, array((255, 60, 0)))
+    assert (dataset_container['timestamps'] == timestamps[1:2]).all()
+    assert (dataset_container['values'] == array((60,))).all()
+
 def test_iteration(dataset_container):
     """Test that iteration correctly returns the sequence of datapoints 
     stored.
@@ -67,6 +100,17 @@ def test_get_timestamps(dataset_container):
                                  datetime(2018, 1, 1, 12, 2, 0)))
     assert (dataset_container[0] == expected_timestamps).all()
     assert (dataset_container['timestamps'] == expected_timestamps).all()
+    assert dataset_container['timestamps'].dtype == TIMESTAMP_DTYPE
+    assert dataset_container['timestamps'].tolist() == \
+        expected_timestamps.tolist()
+
+def test_subsecond_timestamps(dataset_container):
+    """Test that fractions of seconds of timestamps are truncated."""
+    dataset_container.append(datetime(2018, 1, 1, 12, 0, 0, 750000), 1)
+    dataset_container.append_many(array([datetime(2018, 1, 1, 12, 1, 0, 
+                                                  999999)]), array([2]))
+    assert dataset_container.timerange() == [datetime(2018, 1, 1, 12, 0, 0),
+                                             datetime(2018, 1, 1, 12, 1, 0)]
 
 def test_get_values(dataset_container):
     """Test getting the stored values."""
@@ -253,3 +297,311 @@ def test_downsample_histogram(dataset_container):
     assert (plotter._timestamps == expected_timestamps).all()
     assert (plotter._bins == expected_bins).all()
     assert (plotter._histogram == expected_histogram).all()
+
+
+def test_downsample_min_max_count(dataset_container):
+    """Test the min, max and count downsampling, including empty bins."""
+    dataset_container.append(datetime(2018, 1, 1, 12, 0, 0), 4)
+    dataset_container.append(datetime(2018, 1, 1, 12, 1, 0), 2)
+    dataset_container.append(datetime(2018, 1, 1, 12, 11, 0), 3)
+    dataset_container.time_resolution(timedelta(minutes=5))
+    expected_timestamps = array((datetime(2018, 1, 1, 12, 0, 0),
+                                 datetime(2018, 1, 1, 12, 5, 0),
+                                 datetime(2018, 1, 1, 12, 10, 0)))
+    plotter = dataset_container.downsample_min()
+    assert (plotter._timestamps == expected_timestamps).all()
+    assert plotter._values[0] == 2 and plotter._values[2] == 3
+    assert plotter._values[1] != plotter._values[1]
+    plotter = dataset_container.downsample_max()
+    assert plotter._values[0] == 4 and plotter._values[2] == 3
+    plotter = dataset_container.downsample_count()
+    assert (plotter._values == array((2, 0, 1))).all()
+    plotter = dataset_container.downsample_sum()
+    assert (plotter._values == array((6, 0, 3))).all()
+
+def test_downsample_histogram_empty_rows(dataset_container):
+    """Test that histogram rows of empty time bins are zero."""
+    dataset_container.append(datetime(2018, 1, 1, 12, 0, 0), 1)
+    dataset_container.append(datetime(2018, 1, 1, 12, 1, 0), 1)
+    dataset_container.append(datetime(2018, 1, 1, 12, 2, 0), 2)
+    dataset_container.append(datetime(2018, 1, 1, 12, 11, 0), 3)
+    dataset_container.time_resolution(timedelta(minutes=5))
+    expected_histogram = array(((1., .5, 0.),
+                                (0., 0., 0.),
+                                (0., 0., 1.)))
+    plotter = dataset_container.downsample_histogram(hist_min=1, hist_max=5, 
+                                                     resolution=1)
+    assert (plotter._histogram == expected_histogram).all()
+    assert plotter._timestamps[-1] == datetime(2018, 1, 1, 12, 11, 0)
+
+def test_storage_growth(dataset_container):
+    """Test that buffers grow by doubling and keep all appended points."""
+    start = datetime(2018, 1, 1, 12, 0, 0)
+    for i in range(3000):
+        dataset_container.append(start + timedelta(minutes=3000 - i), i)
+    assert len(dataset_container) == 3000
+    assert len(dataset_container._raw_timestamps) == 4096
+    assert dataset_container._raw_values.dtype.kind == 'i'
+    assert dataset_container.timestamp_start() == start + timedelta(minutes=1)
+    assert dataset_container.timestamp_end() == start + timedelta(minutes=3000)
+    assert (dataset_container['values'] == arange(3000)[::-1]).all()
+    dataset_container.append(start, 0.5)
+    assert dataset_container._raw_values.dtype.kind == 'f'
+    assert dataset_container['values'][0] == 0.5
+    assert dataset_container.timestamp_start() == start
+
+def test_append_many_no_copy(dataset_container):
+    """Test that arrays are shared with an empty container if requested, and
+    not modified by later appends.
+    """
+    timestamps = array((datetime(2018, 1, 1, 12, 0, 0),
+                        datetime(2018, 1, 1, 12, 1, 0)), 
+                       dtype='datetime64[s]')
+    values = array((1, 2))
+    dataset_container.append_many(timestamps, values, copy=False)
+    assert dataset_container._raw_timestamps is timestamps
+    dataset_container.append(datetime(2018, 1, 1, 12, 2, 0), 3)
+    assert dataset_container._raw_timestamps is not timestamps
+    assert (values == array((1, 2))).all()
+    assert (dataset_container['values'] == array((1, 2, 3))).all()
+
+def test_empty_timerange(dataset_container):
+    """Test that asking an empty container for its timerange raises."""
+    with pytest.raises(ValueError):
+        dataset_container.timestamp_start()
+
+def test_nested_iteration(dataset_container):
+    """Test that nested loops over the same container are independent."""
+    dataset_container.append(datetime(2018, 1, 1, 12, 0, 0), 1)
+    dataset_container.append(datetime(2018, 1, 1, 12, 1, 0), 2)
+    dataset_container.append(datetime(2018, 1, 1, 12, 2, 0), 3)
+    pairs = [(outer.value, inner.value) for outer in dataset_container 
+             for inner in dataset_container]
+    assert len(pairs) == 9 and pairs[-1] == (3, 3)
+    iterator = iter(dataset_container)
+    next(iterator)
+    assert [point.value for point in dataset_container] == [1, 2, 3]
+    assert [point.value for point in iterator] == [2, 3]
+
+def test_iter_chunks(dataset_container):
+    """Test that chunked iteration yields read-only slices of all data."""
+    start = datetime(2018, 1, 1, 12, 0, 0)
+    for i in range(10):
+        dataset_container.append(start + timedelta(minutes=i), i)
+    chunks = list(dataset_container.iter_chunks(chunk_size=4))
+    assert [len(values) for timestamps, values in chunks] == [4, 4, 2]
+    assert (chunks[1][0] == dataset_container['timestamps'][4:8]).all()
+    assert (chunks[2][1] == array((8, 9))).all()
+    with pytest.raises(ValueError):
+        chunks[0][1][0] = 5
+    dataset_container.add_filter('heartrate')
+    chunks = list(dataset_container.iter_chunks(chunk_size=4, filtered=True))
+    assert len(chunks) == 3
+
+def test_incremental_filtering():
+    """Test that the filtered data cache is updated incrementally and matches
+    filtering all data at once.
+    """
+    from ..filter_provider import DatasetFilter
+    from numpy.random import RandomState
+    lengths = []
+    class RecordingFilter(DatasetFilter):
+        def __call__(self, timestamps, values):
+            lengths.append(len(values))
+            return DatasetFilter.__call__(self, timestamps, values)
+    rand = RandomState(0)
+    values = rand.randint(50, 70, 2000)
+    values[rand.random_sample(2000) < 0.3] *= 2
+    timestamps = array([datetime(2018, 1, 1) + timedelta(minutes=i) 
+                        for i in range(2000)])
+    incremental = DatasetContainer('heartrate', 
+                                   filter_provider=RecordingFilter)
+    incremental.add_filter('heartrate')
+    start = 0
+    for size in (3, 2, 5, 100, 1, 892, 997):
+        incremental.append_many(timestamps[start:start + size], 
+                                values[start:start + size])
+        del lengths[:]
+        incremental['values']
+        #The new points plus one lookback and one lookahead point:
+        assert lengths == [size + 2] or start == 0
+        start += size
+        full = DatasetContainer('heartrate')
+        full.add_filter('heartrate')
+        full.append_many(timestamps[:start], values[:start])
+        assert (incremental['values'] == full['values']).all()
+        assert (incremental['timestamps'] == full['timestamps']).all()
+
+def test_streaming_filtered_downsample():
+    """Test that streaming downsampling applies the heartrate filter across
+    chunk borders like filtering the full dataset.
+    """
+    from numpy.random import RandomState
+    rand = RandomState(1)
+    values = rand.randint(50, 70, 1000)
+    values[rand.random_sample(1000) < 0.3] *= 2
+    timestamps = array([datetime(2018, 1, 1) + timedelta(minutes=i) 
+                        for i in range(1000)])
+    container = DatasetContainer('heartrate')
+    container.add_filter('heartrate')
+    container.append_many(timestamps, values)
+    container.time_resolution(timedelta(minutes=10))
+    expected = container.downsample_max()
+    assert (container['values'] != values).any()
+    for chunk_size in (1, 2, 3, 64):
+        res = container.downsample_chunks(
+            container.iter_chunks(chunk_size=chunk_size), 'max')
+        assert (res._timestamps == expected._timestamps).all()
+        assert (res._values == expected._values).all()
+
+def test_downsample_quantile(dataset_container):
+    """Test quantile and variance downsampling, in memory and streaming."""
+    from numpy import var
+    start = datetime(2018, 1, 1, 12, 0, 0)
+    for i in range(100):
+        dataset_container.append(start + timedelta(minutes=i), 100 + i % 17)
+    dataset_container.time_resolution(timedelta(minutes=30))
+    exact = dataset_container.downsample_median()
+    approximate = dataset_container.downsample_median(approximate=True)
+    assert (abs(approximate._values - exact._values) 
+            <= 0.01*exact._values + 1).all()
+    plotter = dataset_container.downsample_quantile(0.5, exact=True)
+    assert (plotter._values == exact._values).all()
+    plotter = dataset_container.downsample_variance()
+    assert abs(plotter._values[0] - var(dataset_container['values'][:30])) \
+        < 1e-9
+    from ..aggregators import Quantile
+    for func in (Quantile(0.5), 'mean'):
+        expected = dataset_container._downsample_data(func)
+        res = dataset_container.downsample_chunks(
+            dataset_container.iter_chunks(chunk_size=7), func)
+        assert (res._timestamps == expected._timestamps).all()
+        assert (abs(res._values - expected._values) < 1e-9).all()
+
+def test_save_open(tmpdir):
+    """Test that saved datasets are opened memory mapped with their metadata, 
+    and give the same results as the original container.
+    """
+    from numpy import memmap
+    from ..dataset_container import dataset_metadata, open_dataset
+    container = DatasetContainer('heartrate', 
+                                 time_resolution=timedelta(minutes=10))
+    container.add_filter('heartrate', delta_doublefilter=4)
+    start = datetime(2018, 1, 1, 12, 0, 0)
+    for i in range(100):
+        container.append(start + timedelta(minutes=i), 60 + (i % 9)*(i % 2))
+    directory = str(tmpdir.join('heartrate'))
+    container.save(directory, device='MI Band')
+    metadata = dataset_metadata(directory)
+    assert metadata['device'] == 'MI Band' and metadata['type'] == 'heartrate'
+    mapped = open_dataset(directory)
+    assert isinstance(mapped._raw_values, memmap)
+    assert mapped.time_resolution() == container.time_resolution()
+    assert mapped._filters.config() == container._filters.config()
+    assert mapped.timerange() == container.timerange()
+    assert (mapped['values'] == container['values']).all()
+    assert (mapped.downsample_mean()._values == 
+            container.downsample_mean()._values).all()
+    #Appended points are kept in memory, the files stay unchanged:
+    mapped.append(start + timedelta(minutes=100), 70)
+    assert len(mapped) == 101 and not isinstance(mapped._raw_values, memmap)
+    assert len(open_dataset(directory)) == 100
+    empty_directory = str(tmpdir.join('empty'))
+    DatasetContainer('steps').save(empty_directory)
+    assert len(open_dataset(empty_directory)) == 0
+
+def test_timeslice_views():
+    """Test that time slices share the data of the container, and that 
+    unordered data is sorted when stored, without modifying arrays shared 
+    with others.
+    """
+    from numpy import shares_memory
+    timestamps = array([datetime(2018, 1, 1, 12, (3 + 3*i) % 10, 0) 
+                        for i in range(10)], dtype='datetime64[s]')
+    values = arange(10)
+    container = DatasetContainer('activity')
+    container.append_many(timestamps, values, copy=False)
+    sorted_values = container['values'].copy()
+    assert (sorted_values == values[timestamps.argsort()]).all()
+    res = container._timeslice_data(datetime(2018, 1, 1, 12, 3, 0, 500000),
+                                    datetime(2018, 1, 1, 12, 8, 0))
+    assert (res['timestamps'] == timestamps[[7, 4, 1, 8]]).all()
+    assert (res['values'] == array((7, 4, 1, 8))).all()
+    assert res.timerange() == [datetime(2018, 1, 1, 12, 4, 0),
+                               datetime(2018, 1, 1, 12, 7, 0)]
+    #Slicing does not modify the data, and the adopted arrays were not 
+    #sorted in place:
+    assert (container['values'] == sorted_values).all()
+    assert (values == arange(10)).all()
+    assert shares_memory(res['values'], container['values'])
+    res.append(datetime(2018, 1, 1, 12, 9, 0), 100)
+    assert len(res) == 5 and len(container) == 10
+    assert not shares_memory(res['values'], container['values'])
+    assert len(container._timeslice_data(datetime(2018, 1, 2), 
+                                         datetime(2018, 1, 3))) == 0
+
+def test_sorting_refilters():
+    """Test that filtered data is computed from scratch after unordered data
+    is sorted, and that reading the data does not change it.
+    """
+    start = datetime(2018, 1, 1, 12, 0, 0)
+    values = [60, 61, 120, 60, 62, 61, 124, 63, 60]
+    order = [0, 1, 2, 3, 8, 4, 5, 6, 7]
+    expected = DatasetContainer('heartrate')
+    expected.add_filter('heartrate')
+    unordered = DatasetContainer('heartrate')
+    unordered.add_filter('heartrate')
+    for i, value in enumerate(values):
+        expected.append(start + timedelta(minutes=i), value)
+    for i in order:
+        unordered.append(start + timedelta(minutes=i), values[i])
+    assert (unordered['values'] == expected['values']).all()
+    res = unordered._timeslice_data(start, start + timedelta(hours=1))
+    assert (res['values'] == expected['values']).all()
+    assert (unordered['values'] == expected['values']).all()
+
+def test_downsample_many():
+    """Test that concurrent downsampling of shared containers returns the same
+    results as sequential downsampling, in the order of the jobs.
+    """
+    from ..dataset_container import downsample_many
+    from numpy import median
+    from numpy.random import RandomState
+    rand = RandomState(0)
+    timestamps = (array('2018-01-01T00:00:00', dtype='datetime64[s]') 
+                  + arange(20000)*60)
+    heartrate = DatasetContainer('heartrate', time_resolution=timedelta(hours=1))
+    heartrate.append_many(timestamps, rand.randint(40, 180, 20000))
+    heartrate.add_filter('heartrate')
+    steps = DatasetContainer('steps', time_resolution=timedelta(days=1))
+    steps.append_many(timestamps, rand.randint(0, 100, 20000))
+    expected = [heartrate.downsample_histogram(resolution=10)._histogram,
+                steps.downsample_sum()._values,
+                heartrate._downsample_data(median)._values]
+    jobs = [(heartrate, 'histogram', {'resolution': 10}), (steps, 'sum'),
+            (heartrate, median)]*4
+    res = downsample_many(jobs, workers=4)
+    assert len(res) == len(jobs)
+    for i, plotter in enumerate(res):
+        result = plotter._histogram if i % 3 == 0 else plotter._values
+        assert (result == expected[i % 3]).all()
+    assert downsample_many([]) == []
+
+def test_downsample_many_kwargs():
+    """Test that keyword arguments are bound to callable aggregations, and
+    rejected for aggregators.
+    """
+    from ..aggregators import Quantile
+    from ..dataset_container import downsample_many
+    from numpy import percentile
+    container = DatasetContainer('steps', time_resolution=timedelta(hours=1))
+    container.append_many(array('2018-01-01T00:00:00', dtype='datetime64[s]')
+                          + arange(600)*60, arange(600) % 17)
+    expected = container._downsample_data(lambda values: 
+                                          percentile(values, 90))._values
+    res = downsample_many([(container, percentile, {'q': 90})])
+    assert (res[0]._values == expected).all()
+    res = container.downsample_async(percentile, q=90).result()
+    assert (res._values == expected).all()
+    with pytest.raises(ValueError):
+        downsample_many([(container, Quantile(0.9), {'q': 90})])
@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 
 from ..filter_provider import DatasetFilter
-from numpy import array
+from numpy import arange, array
+from numpy.random import RandomState
 from datetime import datetime
 
 def test_addition():
@@ -20,6 +21,7 @@ def test_invalid_addition():
     ds_filter = DatasetFilter()
     ds_filter.add_filter('not defined as filter name')
     assert len(ds_filter._filters) == 0
+    assert ds_filter.available() == ['heartrate']
 
 def test_double_addition():
     """Test adding the same filter twice to the DatasetFilter class. Expected
@@ -89,3 +91,36 @@ def test_no_filter():
     res_times, res_values = ds_filter(test_times, test_values)
     assert (test_times == res_times).all()
     assert (test_values == res_values).all()
+
+
+def sequential_filter_hr(values, delta_doublefilter=3):
+    """Reference implementation of the heartrate filter as a sequential loop
+    over the values, halving matches in place.
+    """
+    for i in arange(1, len(values) - 1):
+        diff_lower = abs((float(values[i])/2.) - values[i - 1])
+        diff_upper = abs((float(values[i])/2.) - values[i + 1])
+        if (diff_lower < delta_doublefilter)*\
+          (diff_upper < delta_doublefilter):
+            values[i] /= 2.
+    return values
+
+def test_heartrate_filter_randomized():
+    """Test that the heartrate filter matches the sequential reference on 
+    random data containing runs of doubled values.
+    """
+    rand = RandomState(0)
+    for dtype in (int, float):
+        for delta in (1, 3, 10):
+            values = rand.randint(50, 70, 5000)
+            doubled = rand.random_sample(5000) < 0.3
+            values[doubled] *= 2
+            quadrupled = rand.random_sample(5000) < 0.1
+            values[quadrupled] *= 4
+            values = values.astype(dtype)
+            expected = sequential_filter_hr(values.copy(), delta)
+            ds_filter = DatasetFilter()
+            ds_filter.add_filter('heartrate', delta_doublefilter=delta)
+            res_times, res_values = ds_filter(arange(5000), values.copy())
+            assert res_values.dtype == expected.dtype
+            assert (res_values == expected).all()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..binning import TimeBinning
+from ..fleet import aggregate_databases
+from ..gb_database import GadgetbridgeDatabase
+from .conftest import TEST_START, create_test_database
+from datetime import datetime, timedelta
+from numpy import arange, concatenate, isnan
+
+def test_aggregate_databases(tmpdir):
+    """Test that aggregating several databases in worker processes matches
+    aggregating their combined data, and that failures are reported.
+    """
+    filenames = []
+    for rows in (500, 1440, 1000):
+        filenames.append(str(tmpdir.join('export%d.db' % rows)))
+        create_test_database(filenames[-1], rows)
+    databases = [(filename, 'MI Band') for filename in filenames]
+    databases.append((str(tmpdir.join('missing.db')), 'MI Band'))
+    databases.append((filenames[0], 'Pebble'))
+    origin = datetime.fromtimestamp(TEST_START - 1800)
+    resolution = timedelta(hours=1)
+    edges = arange(50, 110, 10)
+    timestamps, values = [], []
+    for filename in filenames:
+        container = GadgetbridgeDatabase(filename, 'MI Band')\
+            .retrieve_dataset('heartrate')
+        container.add_filter('heartrate')
+        timestamps.append(container['timestamps'])
+        values.append(container['values'])
+    binning = TimeBinning(concatenate(timestamps), origin, resolution)
+    values = concatenate(values)
+    for processes in (1, 2):
+        res = aggregate_databases(databases, 'heartrate', origin, resolution,
+                                  hist_edges=edges, processes=processes,
+                                  filters=[('heartrate', {})])
+        assert (res.counts == binning.counts).all()
+        assert (abs(res.sums - binning.reduce(values, 'sum')) < 1e-9).all()
+        assert (res.maxs == binning.reduce(values, 'max')).all()
+        expected = binning.reduce(values, 'mean')
+        assert (isnan(res.mean()) == isnan(expected)).all()
+        assert (abs(res.mean() - expected)[~isnan(expected)] < 1e-9).all()
+        assert (res.histogram == binning.histogram(values, edges)).all()
+        assert (res.timestamps() == binning.timestamps()).all()
+        assert len(res.reports) == 5 and len(res.failures()) == 2
+        assert sorted(report['rows'] for report in res.reports) == \
+            sorted([0, 0] + [len(chunk) for chunk in timestamps])
+        assert all(report['seconds'] >= 0 for report in res.reports)
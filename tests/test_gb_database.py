@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..gb_database import GadgetbridgeDatabase, local_datetime64
+from .conftest import TEST_START, TEST_ROWS
+from datetime import datetime
+from numpy import array
+import pytest
+
+def test_local_datetime64():
+    """Test that the vectorized conversion matches datetime.fromtimestamp."""
+    timestamps = array(range(TEST_START - 86400, TEST_START + 86400, 450))
+    expected = array([datetime.fromtimestamp(ts) for ts in timestamps])
+    assert (local_datetime64(timestamps) == expected).all()
+
+def test_result_columns(database):
+    """Test that fetching result columns in batches returns all rows."""
+    database.query_dataset('steps')
+    timestamps, values = database.results.columns(batch_size=100)
+    assert len(timestamps) == TEST_ROWS and len(values) == TEST_ROWS
+    assert timestamps[0] == TEST_START and values[13] == 0
+
+def test_retrieve_dataset_bulk(database):
+    """Test that bulk retrieval returns the same data as row-wise retrieval."""
+    for dataset in ('heartrate', 'steps', 'intensity'):
+        bulk = database.retrieve_dataset(dataset)
+        rowwise = database.retrieve_dataset(dataset, bulk=False)
+        assert (bulk['timestamps'] == rowwise['timestamps']).all()
+        assert (bulk['values'] == rowwise['values']).all()
+    assert len(bulk['values']) == TEST_ROWS
+
+def test_retrieve_null_values(tmpdir):
+    """Test that rows with NULL values are rejected by bulk and row-wise
+    retrieval alike, so the values stay numeric.
+    """
+    import sqlite3
+    filename = str(tmpdir.join('nulls.db'))
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE MI_BAND_ACTIVITY_SAMPLE (TIMESTAMP INTEGER NOT '
+               'NULL, DEVICE_ID INTEGER NOT NULL, USER_ID INTEGER NOT NULL, '
+               'RAW_INTENSITY INTEGER, STEPS INTEGER, RAW_KIND INTEGER, '
+               'HEART_RATE INTEGER, PRIMARY KEY (TIMESTAMP, DEVICE_ID));')
+    db.executemany('INSERT INTO MI_BAND_ACTIVITY_SAMPLE VALUES '
+                   '(?, 1, 1, 10, 5, 1, ?);', 
+                   [(TEST_START + 60*i, None if i % 5 == 0 else 70) 
+                    for i in range(6)])
+    db.commit()
+    db.close()
+    database = GadgetbridgeDatabase(filename, 'MI Band')
+    bulk = database.retrieve_dataset('heartrate')
+    rowwise = database.retrieve_dataset('heartrate', bulk=False)
+    assert bulk['values'].dtype.kind == 'i' and list(bulk['values']) == [70]*4
+    assert list(rowwise['values']) == [70]*4
+    assert bulk.downsample_sum()._values.sum() == 280
+    database.close()
+
+def test_retrieve_datasets(database):
+    """Test that single-pass retrieval of several datasets returns the same
+    data as retrieving each of them separately.
+    """
+    datasets = ['heartrate', 'steps', 'intensity', 'activity']
+    containers = database.retrieve_datasets(datasets)
+    assert len(containers) == len(datasets)
+    for dataset, container in zip(datasets, containers):
+        single = database.retrieve_dataset(dataset)
+        assert container._type == dataset
+        assert (container['timestamps'] == single['timestamps']).all()
+        assert (container['values'] == single['values']).all()
+
+def test_retrieve_datasets_invalid(database):
+    """Test that requesting an unknown dataset raises an error."""
+    with pytest.raises(LookupError):
+        database.retrieve_datasets(['heartrate', 'calories'])
+
+def test_query_accepted_only(database):
+    """Test that invalid rows are excluded by the database query."""
+    database.query_dataset('heartrate')
+    all_rows = database.results.all()
+    database.query_dataset('heartrate', accepted_only=True)
+    accepted_rows = database.results.all()
+    assert accepted_rows == [row for row in all_rows if 0 < row[1] < 255]
+    assert len(accepted_rows) < len(all_rows)
+    database.query_datasets(['heartrate', 'activity'], accepted_only=True)
+    assert len(database.results.all()) == len(all_rows)
+
+def test_retrieve_downsampled(database):
+    """Test that downsampling in the database matches downsampling in the
+    container.
+    """
+    from datetime import timedelta
+    for dataset in ('heartrate', 'steps'):
+        container = database.retrieve_dataset(dataset)
+        for resolution in (timedelta(minutes=7), timedelta(hours=1)):
+            container.time_resolution(resolution)
+            for aggregation in ('sum', 'mean', 'min', 'max', 'count'):
+                expected = container._downsample_data(aggregation)
+                res = database.retrieve_downsampled(dataset, aggregation,
+                                                    resolution)
+                assert (res._timestamps == expected._timestamps).all()
+                assert res._values.dtype.kind == expected._values.dtype.kind
+                empty = expected._values != expected._values
+                assert (res._values[empty] != res._values[empty]).all()
+                assert (abs(res._values[~empty] - expected._values[~empty]) 
+                        < 1e-9).all()
+
+def test_retrieve_downsampled_dst_end(dst_end_database):
+    """Test that downsampling in the database starts at the earliest local
+    time when the range starts in the hour repeated at the end of DST.
+    """
+    from datetime import timedelta
+    from .conftest import DST_END_START
+    #2:30 CEST, followed by 2:00 CET an hour later:
+    start = DST_END_START + int(2.5*3600)
+    resolution = timedelta(minutes=15)
+    container = dst_end_database.retrieve_dataset('steps', 
+                                                  timestamp_min=start)
+    container.time_resolution(resolution)
+    expected = container._downsample_data('sum')
+    res = dst_end_database.retrieve_downsampled('steps', 'sum', resolution,
+                                                timestamp_min=start)
+    assert (res._timestamps == expected._timestamps).all()
+    assert (res._values == expected._values).all()
+    assert res._values.sum() == container['values'].sum()
+
+def test_retrieve_downsampled_invalid(database):
+    """Test that invalid aggregations and resolutions raise errors."""
+    from datetime import timedelta
+    with pytest.raises(ValueError):
+        database.retrieve_downsampled('steps', 'median', timedelta(hours=1))
+    with pytest.raises(ValueError):
+        database.retrieve_downsampled('steps', 'sum', timedelta(seconds=0.5))
+    with pytest.raises(LookupError):
+        database.retrieve_downsampled('calories', 'sum', timedelta(hours=1))
+
+def test_iter_dataset_chunks(database):
+    """Test that chunked retrieval yields all accepted rows in order."""
+    chunks = list(database.iter_dataset_chunks('heartrate', chunk_size=100))
+    assert max(len(values) for timestamps, values in chunks) == 100
+    container = database.retrieve_dataset('heartrate')
+    from numpy import concatenate
+    timestamps = concatenate([chunk[0] for chunk in chunks])
+    values = concatenate([chunk[1] for chunk in chunks])
+    assert (timestamps == container['timestamps']).all()
+    assert (values == container['values']).all()
+
+def test_streaming_downsample(database):
+    """Test that downsampling a stream of chunks matches downsampling the
+    full dataset, with and without filters.
+    """
+    from datetime import timedelta
+    from numpy import median
+    for use_filter in (False, True):
+        container = database.retrieve_dataset('heartrate')
+        container.time_resolution(timedelta(minutes=13))
+        if use_filter:
+            container.add_filter('heartrate')
+        for func in ('sum', 'mean', 'min', 'max', 'count', median):
+            expected = container._downsample_data(func)
+            for chunk_size in (7, 100, 5000):
+                chunks = database.iter_dataset_chunks('heartrate', 
+                                                      chunk_size=chunk_size)
+                res = container.downsample_chunks(chunks, func)
+                assert (res._timestamps == expected._timestamps).all()
+                assert (abs(res._values - expected._values) < 1e-9).all()
+
+def test_streaming_downsample_unordered(database):
+    """Test that chunks out of chronological order are rejected."""
+    container = database.retrieve_dataset('steps')
+    chunks = list(database.iter_dataset_chunks('steps', chunk_size=100))
+    with pytest.raises(ValueError):
+        container.downsample_chunks(chunks[::-1], 'sum')
+
+def test_streaming_downsample_dst_end(dst_end_database):
+    """Test that streaming downsampling accepts the hour repeated at the end
+    of DST and matches downsampling the full dataset, also with a filter that
+    depends on the neighbours of each point.
+    """
+    import sqlite3
+    from datetime import timedelta
+    from ..aggregators import Quantile
+    from .conftest import DST_END_START
+    #Heart rates of the repeated hour that are halved as they alternate with
+    #the first pass of the hour in local time, but not in stream order:
+    db = sqlite3.connect(dst_end_database._db_filename)
+    db.execute('UPDATE MI_BAND_ACTIVITY_SAMPLE SET HEART_RATE = CASE WHEN '
+               'TIMESTAMP BETWEEN ? AND ? THEN 140 ELSE 70 END;', 
+               (DST_END_START + 3*3600, DST_END_START + 4*3600 - 1))
+    db.commit()
+    db.close()
+    steps = dst_end_database.retrieve_dataset('steps')
+    heartrate = dst_end_database.retrieve_dataset('heartrate')
+    heartrate.add_filter('heartrate')
+    for container in (steps, heartrate):
+        container.time_resolution(timedelta(minutes=15))
+        for func in ('sum', 'max', Quantile(0.5)):
+            expected = container._downsample_data(func)
+            for chunk_size in (1, 2, 3, 7, 100, 500):
+                chunks = dst_end_database.iter_dataset_chunks(
+                    container._type, chunk_size=chunk_size)
+                res = container.downsample_chunks(chunks, func)
+                assert (res._timestamps == expected._timestamps).all()
+                assert (abs(res._values - expected._values) < 1e-9).all()
+
+def test_result_cache(database_file, tmpdir):
+    """Test that downsampled results are taken from the cache without loading
+    the data, and that changes of the database or filters are detected.
+    """
+    import os
+    from datetime import timedelta
+    from ..result_cache import ResultCache
+    cache = ResultCache(str(tmpdir.join('results.cache')))
+    def render(use_filter=False):
+        database = GadgetbridgeDatabase(database_file, 'MI Band', cache=cache)
+        heartrate, steps = database.retrieve_datasets(
+            ['heartrate', 'steps'], time_resolution=timedelta(hours=1))
+        if use_filter:
+            heartrate.add_filter('heartrate')
+        return heartrate, heartrate.downsample_histogram(), \
+            steps.downsample_sum()
+    container, histogram, steps = render()
+    assert container._loader is None
+    cached_container, cached_histogram, cached_steps = render()
+    assert not cached_container._loader is None
+    assert (cached_histogram._histogram == histogram._histogram).all()
+    assert (cached_histogram._timestamps == histogram._timestamps).all()
+    assert (cached_steps._values == steps._values).all()
+    container, filtered, steps = render(use_filter=True)
+    assert container._loader is None
+    assert len(cached_container) == len(container)
+    #Modifying the database changes its identity:
+    stat = os.stat(database_file)
+    os.utime(database_file, (stat.st_atime, stat.st_mtime + 10))
+    container, histogram, steps = render()
+    assert container._loader is None
+    cache.bypass = True
+    container, histogram, steps = render()
+    assert container._loader is None
+
+def test_result_cache_lazy(database_file, tmpdir):
+    """Test that lazily loaded containers are cached under the identity of the
+    database at load time, and that the columns of a shared query are 
+    released once their containers have loaded.
+    """
+    import os
+    import sqlite3
+    from datetime import timedelta
+    from ..result_cache import ResultCache
+    cache = ResultCache(str(tmpdir.join('results.cache')))
+    def retrieve():
+        database = GadgetbridgeDatabase(database_file, 'MI Band', cache=cache)
+        return database.retrieve_datasets(['heartrate', 'steps'], 
+                                          time_resolution=timedelta(hours=1))
+    heartrate, steps = retrieve()
+    db = sqlite3.connect(database_file)
+    db.executemany('INSERT INTO MI_BAND_ACTIVITY_SAMPLE VALUES '
+                   '(?, 1, 1, 1, 10, 1, 60);', 
+                   [(TEST_START + 60*(TEST_ROWS + i),) for i in range(120)])
+    db.commit()
+    db.close()
+    stat = os.stat(database_file)
+    os.utime(database_file, (stat.st_atime, stat.st_mtime + 10))
+    shared = [cell.cell_contents for cell in steps._loader.func.__closure__
+              if isinstance(cell.cell_contents, dict)][0]
+    expected = steps.downsample_sum()
+    assert len(steps) == TEST_ROWS + 120
+    assert shared['columns'][2] is None and not shared['columns'][1] is None
+    heartrate.load()
+    assert shared['columns'] is None
+    cached_heartrate, cached_steps = retrieve()
+    assert (cached_steps.downsample_sum()._values == expected._values).all()
+    assert not cached_steps._loader is None
+
+def test_downsample_many_lazy(database_file, tmpdir):
+    """Test that lazily loaded containers can be loaded and downsampled from
+    several threads at once.
+    """
+    from datetime import timedelta
+    from ..dataset_container import downsample_many
+    from ..result_cache import ResultCache
+    cache = ResultCache(str(tmpdir.join('results.cache')))
+    database = GadgetbridgeDatabase(database_file, 'MI Band', cache=cache)
+    heartrate, steps = database.retrieve_datasets(
+        ['heartrate', 'steps'], time_resolution=timedelta(hours=1))
+    jobs = [(heartrate, 'mean'), (steps, 'sum'), (heartrate, 'max'),
+            (steps, 'count')]*3
+    res = downsample_many(jobs, workers=4)
+    assert heartrate._loader is None and steps._loader is None
+    for plotter, (container, aggregation) in zip(res, jobs):
+        expected = getattr(container, 'downsample_' + aggregation)()
+        assert (plotter._values == expected._values).all()
+
+def test_retrieve_async(database):
+    """Test that the asynchronous retrieval and downsampling return the same
+    results as the blocking methods.
+    """
+    futures = [database.retrieve_dataset_async('steps') for i in range(6)]
+    containers = [future.result() for future in futures]
+    steps = database.retrieve_dataset('steps')
+    for container in containers:
+        assert (container['values'] == steps['values']).all()
+    plotter = containers[0].downsample_async('sum').result()
+    assert (plotter._values == steps.downsample_sum()._values).all()
+    heartrate, activity = database.retrieve_datasets_async(
+        ['heartrate', 'activity']).result()
+    assert len(heartrate) == len(database.retrieve_dataset('heartrate'))
+    with pytest.raises(LookupError):
+        database.retrieve_dataset_async('calories').result()
+    database.close()
+
+def test_retrieve_async_cached(database_file, tmpdir):
+    """Test that the asynchronous retrieval loads the data on the worker 
+    thread when the containers are lazy.
+    """
+    from ..result_cache import ResultCache
+    cache = ResultCache(str(tmpdir.join('results.cache')))
+    database = GadgetbridgeDatabase(database_file, 'MI Band', cache=cache)
+    container = database.retrieve_dataset_async('steps').result()
+    assert container._loader is None
+    containers = database.retrieve_datasets_async(
+        ['steps', 'heartrate']).result()
+    assert all(container._loader is None for container in containers)
+    database.close()
+
+def test_cancel_async(database):
+    """Test that cancelled jobs raise CancelledError and are not run."""
+    from threading import Event
+    from ..query_executor import CancelledError, JobExecutor
+    executor = JobExecutor(1)
+    started, release, runs = Event(), Event(), []
+    blocking = executor.submit(lambda: started.set() or release.wait(10))
+    waiting = executor.submit(runs.append, 1)
+    started.wait(10)
+    assert waiting.cancel()
+    release.set()
+    assert blocking.result(10)
+    executor.shutdown()
+    assert waiting.cancelled() and runs == []
+    with pytest.raises(CancelledError):
+        waiting.result()
+    assert not blocking.cancel()
+
+def test_retrieve_asyncio(database):
+    """Test that the futures of the asynchronous methods can be awaited."""
+    asyncio = pytest.importorskip('asyncio')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        #A coroutine function would be a syntax error on Python 2:
+        gather = asyncio.gather(*[database.retrieve_dataset_async('steps') 
+                                  for i in range(3)])
+        containers = loop.run_until_complete(gather)
+        steps = database.retrieve_dataset('steps')
+        for container in containers:
+            assert (container['values'] == steps['values']).all()
+    finally:
+        loop.close()
+
+def test_parallel_readers(database_file):
+    """Test that threads query on their own connections, and that the context
+    manager closes all of them.
+    """
+    import sqlite3
+    from threading import Thread
+    with GadgetbridgeDatabase(database_file, 'MI Band', 
+                              read_only=True) as database:
+        expected = database.retrieve_dataset('steps')['values']
+        results = []
+        def read():
+            database.query_dataset('steps', accepted_only=True)
+            results.append(database.results.columns()[1])
+        threads = [Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 4
+        for values in results:
+            assert (values == expected).all()
+    with pytest.raises(sqlite3.ProgrammingError):
+        database.retrieve_dataset('steps')
+
+def test_parameterized_queries(database):
+    """Test that the limits are bound as parameters, so queries of other 
+    ranges use the same statement text, and that columns can be selected.
+    """
+    first, params = database._build_querystring(
+        'steps', timestamp_min=TEST_START, timestamp_max=TEST_START + 600, 
+        accepted_only=True, ordered=True)
+    second, other_params = database._build_querystring(
+        'steps', timestamp_min=datetime.fromtimestamp(TEST_START + 60),
+        timestamp_max=TEST_START + 1200, accepted_only=True, ordered=True)
+    assert first is second and first.count('?') == 2
+    assert params == (TEST_START, TEST_START + 600)
+    assert other_params == (TEST_START + 60, TEST_START + 1200)
+    assert first.endswith(' ORDER BY TIMESTAMP;')
+    querystring, params = database._build_querystring(
+        ['heartrate', 'steps'], timestamp_max=TEST_START + 600, 
+        columns=['steps'])
+    assert querystring.startswith('SELECT STEPS FROM') and len(params) == 1
+    database._query(querystring, params)
+    assert len(database.results.all()) == 10
+
+@pytest.mark.parametrize('working_copy', ['memory', 'file'])
+def test_working_copy(database_file, working_copy):
+    """Test that working copies return the same data, answer range queries 
+    with the covering index, and leave the file untouched.
+    """
+    import os
+    import sqlite3
+    from ..connection_pool import URI_SUPPORTED
+    if working_copy == 'memory' and not URI_SUPPORTED:
+        with pytest.raises(sqlite3.NotSupportedError):
+            GadgetbridgeDatabase(database_file, 'MI Band', 
+                                 working_copy=working_copy)
+        return
+    with open(database_file, 'rb') as stream:
+        original = stream.read()
+    expected = GadgetbridgeDatabase(database_file, 'MI Band')\
+        .retrieve_datasets(['heartrate', 'steps'])
+    with GadgetbridgeDatabase(database_file, 'MI Band', 
+                              working_copy=working_copy) as database:
+        copy_filename = database._working_copy.filename
+        heartrate, steps = database.retrieve_datasets(['heartrate', 'steps'])
+        assert (heartrate['values'] == expected[0]['values']).all()
+        assert (steps['timestamps'] == expected[1]['timestamps']).all()
+        querystring, params = database._build_querystring(
+            'steps', timestamp_min=TEST_START, timestamp_max=TEST_START + 600)
+        database._query('EXPLAIN QUERY PLAN ' + querystring, params)
+        plan = ' '.join(str(row[-1]) for row in database.results.all())
+        assert 'COVERING INDEX WORKING_COPY_' in plan
+        #The raw rows of LocalStore imports include the device id:
+        querystring, params = database._build_querystring(
+            'steps', timestamp_min=TEST_START, ordered=True,
+            columns=['timestamp', 'device_id', 'steps'], present_only=True)
+        database._query('EXPLAIN QUERY PLAN ' + querystring, params)
+        plan = ' '.join(str(row[-1]) for row in database.results.all())
+        assert 'COVERING INDEX WORKING_COPY_' in plan
+    assert not os.path.isfile(copy_filename)
+    with open(database_file, 'rb') as stream:
+        assert stream.read() == original
+    with pytest.raises(ValueError):
+        GadgetbridgeDatabase(database_file, 'MI Band', working_copy='disk')
+
+def test_working_copy_indexes(database_file):
+    """Test that working copies keep the indexes of the file."""
+    import sqlite3
+    from ..working_copy import WorkingCopy
+    connection = sqlite3.connect(database_file)
+    connection.execute('CREATE INDEX STEPS_INDEX ON MI_BAND_ACTIVITY_SAMPLE '
+                       '(STEPS);')
+    connection.commit()
+    connection.close()
+    copy = WorkingCopy(database_file, in_memory=False)
+    try:
+        connection = sqlite3.connect(copy.filename)
+        assert connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND "
+            "name = 'STEPS_INDEX';").fetchone()[0] == 1
+        connection.close()
+    finally:
+        copy.close()
+
+def test_failed_construction(database_file, capfd):
+    """Test that invalid arguments are rejected on construction, and that a
+    failed construction neither leaves a working copy behind nor fails again
+    when the instance is collected.
+    """
+    import gc
+    import os
+    import sqlite3
+    import tempfile
+    with pytest.raises(LookupError):
+        GadgetbridgeDatabase(database_file, 'Unknown Band')
+    with pytest.raises(ValueError):
+        GadgetbridgeDatabase(database_file, 'MI Band', working_copy='disk')
+    #The test database has no Pebble table to index:
+    files = set(os.listdir(tempfile.gettempdir()))
+    with pytest.raises(sqlite3.OperationalError):
+        GadgetbridgeDatabase(database_file, 'Pebble', working_copy='file')
+    assert set(os.listdir(tempfile.gettempdir())) <= files
+    gc.collect()
+    assert not 'ignored' in capfd.readouterr()[1]
+
+def test_schema_discovery(database_file, tmpdir):
+    """Test that nothing is read on construction, that the device is detected
+    and that the schema information is discovered once.
+    """
+    import sqlite3
+    database = GadgetbridgeDatabase(database_file)
+    assert len(database._pool) == 0
+    assert database.detect_devices() == ['MI Band']
+    assert database.device == 'MI Band'
+    assert database.tables == ['MI_BAND_ACTIVITY_SAMPLE']
+    info = database.query_tableinfo('MI_BAND_ACTIVITY_SAMPLE')
+    assert info['name'][0] == 'TIMESTAMP' and info['index'][0] == 0
+    assert database.query_tableinfo('MI_BAND_ACTIVITY_SAMPLE') is info
+    assert database.query_tableinfo('UNKNOWN') is None
+    statistics = database.table_statistics()
+    assert statistics['rows'] == TEST_ROWS
+    assert statistics['timestamp_min'] == datetime.fromtimestamp(TEST_START)
+    assert statistics['timestamp_max'] == \
+        datetime.fromtimestamp(TEST_START + 60*(TEST_ROWS - 1))
+    schema = database.schema()
+    assert list(schema) == ['MI_BAND_ACTIVITY_SAMPLE']
+    assert schema['MI_BAND_ACTIVITY_SAMPLE']['devices'] == ['MI Band']
+    assert schema['MI_BAND_ACTIVITY_SAMPLE']['rows'] == TEST_ROWS
+    assert len(database.retrieve_dataset('steps')) == TEST_ROWS
+    #Empty tables are not detected:
+    filename = str(tmpdir.join('empty.db'))
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE MI_BAND_ACTIVITY_SAMPLE (TIMESTAMP INTEGER, '
+               'RAW_INTENSITY INTEGER, STEPS INTEGER, RAW_KIND INTEGER, '
+               'HEART_RATE INTEGER);')
+    db.close()
+    database = GadgetbridgeDatabase(filename)
+    assert database.detect_devices() == []
+    with pytest.raises(LookupError):
+        database.device
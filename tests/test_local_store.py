@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..gb_database import GadgetbridgeDatabase
+from ..local_store import LocalStore
+from .conftest import TEST_START, TEST_ROWS, create_test_database
+from datetime import datetime
+import sqlite3
+
+def test_incremental_import(tmpdir):
+    """Test that successive exports are imported incrementally, and that the
+    store returns the same data as the latest export.
+    """
+    store = LocalStore(str(tmpdir.join('store.db')))
+    exports = [(str(tmpdir.join('export%d.db' % i)), rows) 
+               for i, rows in enumerate((1000, 1000, TEST_ROWS))]
+    imported = []
+    for filename, rows in exports:
+        create_test_database(filename, rows)
+        database = GadgetbridgeDatabase(filename, 'MI Band')
+        imported.append(store.import_database(database, batch_size=300))
+    assert imported[0]['steps'] == 1000
+    assert imported[1]['steps'] == 0
+    assert imported[2] == dict((dataset, TEST_ROWS - 1000) for dataset in 
+                               database.available_datasets())
+    assert store.watermark('MI Band', 'steps') == TEST_START + 60*1439
+    assert store.watermark('MI Band', 'calories') is None
+    assert ('MI Band', 'heartrate') in store.datasets()
+    for dataset in ('heartrate', 'steps'):
+        expected = database.retrieve_dataset(dataset)
+        res = store.retrieve_dataset('MI Band', dataset)
+        assert (res['timestamps'] == expected['timestamps']).all()
+        assert (res['values'] == expected['values']).all()
+    timestamp_min = datetime.fromtimestamp(TEST_START + 3600)
+    res = store.retrieve_dataset('MI Band', 'steps', 
+                                 timestamp_min=timestamp_min)
+    assert len(res) == TEST_ROWS - 60 and res.timestamp_start() == \
+        timestamp_min
+
+def test_late_rows(tmpdir):
+    """Test that rows synced late below the watermark and rows of further
+    device ids with existing timestamps are imported, and that changed values
+    are updated.
+    """
+    store = LocalStore(str(tmpdir.join('store.db')))
+    filename = str(tmpdir.join('export.db'))
+    create_test_database(filename, 1000)
+    db = sqlite3.connect(filename)
+    db.execute('DELETE FROM MI_BAND_ACTIVITY_SAMPLE WHERE TIMESTAMP = ?;',
+               (TEST_START + 60*990,))
+    db.commit()
+    database = GadgetbridgeDatabase(filename, 'MI Band')
+    assert store.import_database(database, ['steps'])['steps'] == 999
+    database.close()
+    db.executemany('INSERT INTO MI_BAND_ACTIVITY_SAMPLE VALUES '
+                   '(?, ?, 1, 1, ?, 1, 60);',
+                   [(TEST_START + 60*990, 1, 2), (TEST_START + 60*995, 2, 7)])
+    db.execute('UPDATE MI_BAND_ACTIVITY_SAMPLE SET STEPS = 12 WHERE '
+               'TIMESTAMP = ? AND DEVICE_ID = 1;', (TEST_START + 60*998,))
+    db.commit()
+    db.close()
+    database = GadgetbridgeDatabase(filename, 'MI Band')
+    assert store.import_database(database, ['steps'])['steps'] == 3
+    assert store.import_database(database, ['steps'])['steps'] == 0
+    assert store.watermark('MI Band', 'steps') == TEST_START + 60*999
+    res = store.retrieve_dataset('MI Band', 'steps')
+    assert len(res) == 1001
+    expected = [i % 13 for i in range(1000)]
+    expected[998] = 12
+    expected.insert(996, 7)
+    assert list(res['values']) == expected
+
+def test_rescan_writes(tmpdir):
+    """Test that rescanning unchanged rows writes nothing, and that rows with
+    NULL values are neither stored nor counted.
+    """
+    store = LocalStore(str(tmpdir.join('store.db')))
+    filename = str(tmpdir.join('export.db'))
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE MI_BAND_ACTIVITY_SAMPLE (TIMESTAMP INTEGER NOT '
+               'NULL, DEVICE_ID INTEGER NOT NULL, USER_ID INTEGER NOT NULL, '
+               'RAW_INTENSITY INTEGER, STEPS INTEGER, RAW_KIND INTEGER, '
+               'HEART_RATE INTEGER, PRIMARY KEY (TIMESTAMP, DEVICE_ID));')
+    db.executemany('INSERT INTO MI_BAND_ACTIVITY_SAMPLE VALUES '
+                   '(?, 1, 1, 10, 5, 1, ?);', 
+                   [(TEST_START + 60*i, None if i % 5 == 0 else 70) 
+                    for i in range(100)])
+    db.commit()
+    db.close()
+    database = GadgetbridgeDatabase(filename, 'MI Band')
+    assert store.import_database(database, ['heartrate'])['heartrate'] == 80
+    changes = store._db.total_changes
+    assert store.import_database(database, ['heartrate'])['heartrate'] == 0
+    assert store._db.total_changes == changes
+    res = store.retrieve_dataset('MI Band', 'heartrate')
+    assert len(res) == 80 and (res['values'] == 70).all()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..query_server import LRUCache, QueryServer, QueryService
+from threading import Thread
+import json
+import pytest
+
+@pytest.fixture
+def service(database_file):
+    """Return a QueryService instance for the test database."""
+    return QueryService(database_file, 'MI Band', cache_entries=4)
+
+def query(service, path, **params):
+    """Answer a query with single valued parameters and decode the response."""
+    status, body = service.respond(path, dict((name, [value]) for name, value
+                                              in params.items()))
+    return status, json.loads(body)
+
+def test_lru_cache():
+    """Test that the least recently used entries are evicted."""
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2 and cache.hits == 3 and cache.misses == 1
+
+def test_series(service):
+    """Test that series are downsampled like by the container and repeated
+    queries are answered from the cache.
+    """
+    status, datasets = query(service, '/datasets')
+    assert status == 200 and 'heartrate' in datasets['datasets']
+    status, res = query(service, '/series', dataset='steps', agg='sum', 
+                        resolution='3600', start='2018-03-25')
+    assert status == 200
+    container = service._database.retrieve_dataset('steps')
+    assert sum(res['values']) == container['values'].sum()
+    assert len(res['timestamps']) == len(res['values'])
+    assert query(service, '/series', dataset='steps', agg='sum', 
+                 resolution='3600', start='2018-03-25')[1] == res
+    assert service.cache.hits == 1
+    status, res = query(service, '/stats')
+    assert res['latency']['/series']['requests'] == 2
+    assert res['latency']['/series']['cached'] == 1
+
+def test_histogram(service):
+    """Test that histograms have one row per time bin, and empty rows are
+    returned as zeros.
+    """
+    status, res = query(service, '/histogram', dataset='heartrate', 
+                        filter='heartrate', resolution='3600', min='0', 
+                        step='10')
+    assert status == 200
+    assert len(res['histogram']) == len(res['timestamps']) - 1
+    assert len(res['histogram'][0]) == len(res['bins']) - 1
+    assert res['bins'][0] == 0
+
+def test_invalid_queries(service):
+    """Test that invalid queries are answered with errors and not cached."""
+    assert query(service, '/unknown')[0] == 404
+    assert query(service, '/series', dataset='unknown')[0] == 400
+    assert query(service, '/series', dataset='steps', agg='unknown')[0] == 400
+    assert query(service, '/series', dataset='steps', start='yesterday')[0] \
+        == 400
+    assert query(service, '/series')[0] == 400
+    status, body = query(service, '/series', dataset='steps', filter='unknown')
+    assert status == 400 and 'unknown' in body['error']
+    assert len(service.cache) == 0
+
+def test_server_errors(service, monkeypatch):
+    """Test that failures of the database are answered with errors."""
+    import sqlite3
+    for error in (sqlite3.OperationalError('database is locked'), 
+                  TypeError('unexpected')):
+        def fail(*args, **kwargs):
+            raise error
+        monkeypatch.setattr(service._database, 'retrieve_dataset', fail)
+        status, body = query(service, '/series', dataset='steps')
+        assert status == 500 and str(error) in body['error']
+    assert len(service.cache) == 0
+
+def test_server(service):
+    """Test that the server answers HTTP requests on its worker threads."""
+    try:
+        from urllib2 import urlopen
+    except ImportError:
+        from urllib.request import urlopen
+    server = QueryServer(('127.0.0.1', 0), service, workers=2)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        response = urlopen('http://127.0.0.1:%d/series?dataset=steps&agg=max'
+                           % server.server_address[1])
+        assert response.getcode() == 200
+        assert max(json.loads(response.read().decode('utf-8'))['values']) == 12
+        #Requests are answered by the worker threads, which keep their 
+        #connections:
+        for i in range(8):
+            urlopen('http://127.0.0.1:%d/series?dataset=steps&resolution=%d'
+                    % (server.server_address[1], 60*(i + 1))).read()
+        assert len(service._database._pool) <= 2
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
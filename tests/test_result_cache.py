@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..result_cache import ResultCache, database_identity
+from numpy import arange, array
+import pytest
+
+@pytest.fixture
+def cache(tmpdir):
+    """Return an empty cache in a temporary file."""
+    return ResultCache(str(tmpdir.join('results.cache')))
+
+def test_put_get(cache):
+    """Test that stored results are returned unchanged."""
+    timestamps = arange('2018-01-01', '2018-01-05', dtype='datetime64[D]')
+    cache.put(('a', 1, None), {'timestamps': timestamps, 
+                               'values': array((1., 2., 3., 4.))})
+    res = cache.get(('a', 1, None))
+    assert (res['timestamps'] == timestamps).all()
+    assert res['timestamps'].dtype == timestamps.dtype
+    assert (res['values'] == array((1., 2., 3., 4.))).all()
+    assert cache.get(('a', 2, None)) is None
+    cache.bypass = True
+    assert cache.get(('a', 1, None)) is None
+    cache.put(('b',), {'values': array([None, 1])})
+    cache.bypass = False
+    assert cache.get(('b',)) is None
+    cache.clear()
+    assert cache.get(('a', 1, None)) is None and cache.size() == 0
+
+def test_eviction(cache):
+    """Test that the least recently used results are evicted."""
+    for key in range(3):
+        cache.put((key,), {'values': arange(1000.)})
+    entry_size = cache.size()//3
+    cache.max_bytes = 3*entry_size
+    cache.get((0,))
+    cache.put((3,), {'values': arange(1000.)})
+    assert cache.size() <= cache.max_bytes
+    assert cache.get((1,)) is None
+    assert not cache.get((0,)) is None and not cache.get((3,)) is None
+
+def test_persistence(tmpdir):
+    """Test that results are kept in the file and found by a new instance."""
+    filename = str(tmpdir.join('results.cache'))
+    ResultCache(filename).put(('a',), {'values': arange(10)})
+    assert (ResultCache(filename).get(('a',))['values'] == arange(10)).all()
+    identity = database_identity(filename)
+    assert identity[0].endswith('results.cache') and identity[1] > 0
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ..binning import TimeBinning
+from ..dataset_container import DatasetContainer
+from ..rollups import RollupPyramid
+from datetime import datetime, timedelta
+from numpy import arange, array, datetime64, isnan
+from numpy.random import RandomState
+import pytest
+
+@pytest.fixture
+def data():
+    """Return five days of per-minute heartrate-like data with gaps."""
+    rand = RandomState(0)
+    timestamps = datetime64('2018-01-01T07:23:00') \
+        + arange(5*1440).astype('timedelta64[m]')
+    values = rand.randint(40, 180, len(timestamps))
+    keep = rand.random_sample(len(timestamps)) > 0.2
+    keep[3000:4500] = False
+    return timestamps[keep].astype('datetime64[s]'), values[keep]
+
+def assert_equal(res, expected):
+    """Assert that two arrays are equal up to rounding, NaN included."""
+    assert res.shape == expected.shape
+    assert (isnan(res) == isnan(expected)).all()
+    assert (abs(res[~isnan(res)] - expected[~isnan(expected)]) < 1e-9).all()
+
+def test_reduce(data):
+    """Test that reductions from the rollups match the binning engine."""
+    timestamps, values = data
+    pyramid = RollupPyramid(timestamps, values, timestamps[0])
+    for minutes in (1, 7, 10, 60, 180, 1440, 2880):
+        resolution = timedelta(minutes=minutes)
+        binning = TimeBinning(timestamps, timestamps[0], resolution)
+        assert (pyramid.timestamps(resolution) == binning.timestamps()).all()
+        for how in ('sum', 'mean', 'min', 'max', 'count'):
+            res = pyramid.reduce(how, resolution)
+            expected = binning.reduce(values, how)
+            assert res.dtype == expected.dtype
+            assert_equal(res, expected)
+    assert pyramid.reduce('sum', timedelta(seconds=90)) is None
+    assert pyramid.level_for(timedelta(hours=2)) == 2
+    assert pyramid.value_range() == (values.min(), values.max())
+
+def test_histogram(data):
+    """Test that histograms from the rollups match the binning engine, and 
+    that requests the rollups cannot answer exactly are rejected.
+    """
+    timestamps, values = data
+    values = values/2.
+    pyramid = RollupPyramid(timestamps, values, timestamps[0])
+    for resolution in (timedelta(hours=1), timedelta(hours=6), 
+                       timedelta(days=1)):
+        binning = TimeBinning(timestamps, timestamps[0], resolution)
+        for edges in (arange(20, 90, 5), arange(0, 10, 2.5), 
+                      arange(60, 200, 10), array((30, 89.5))):
+            assert (pyramid.histogram(edges, resolution) == 
+                    binning.histogram(values, edges)).all()
+    assert pyramid.histogram(arange(20, 90, 5), timedelta(minutes=5)) is None
+    assert pyramid.histogram(arange(20, 90, 0.2), timedelta(hours=1)) is None
+    pyramid = RollupPyramid(timestamps, values + 0.1, timestamps[0])
+    assert pyramid.histogram(arange(20, 90, 5), timedelta(hours=1)) is None
+
+def test_container_rollups(data):
+    """Test that containers with rollups give the same results, and that the
+    rollups are rebuilt when the data changes.
+    """
+    timestamps, values = data
+    container = DatasetContainer('heartrate')
+    container.append_many(timestamps, values)
+    container.add_filter('heartrate')
+    rolled = DatasetContainer('heartrate')
+    rolled.append_many(timestamps, values)
+    rolled.add_filter('heartrate')
+    rolled.build_rollups()
+    for appended in (False, True):
+        for resolution in (timedelta(minutes=10), timedelta(hours=2), 
+                           timedelta(days=1)):
+            container.time_resolution(resolution)
+            rolled.time_resolution(resolution)
+            for func in ('sum', 'mean', 'min', 'max', 'count'):
+                assert_equal(rolled._downsample_data(func)._values, 
+                             container._downsample_data(func)._values)
+            res, expected = rolled.downsample_histogram(), \
+                container.downsample_histogram()
+            assert (res._timestamps == expected._timestamps).all()
+            assert (res._bins == expected._bins).all()
+            assert (res._histogram == expected._histogram).all()
+        pyramid = rolled._rollups
+        for dataset in (container, rolled):
+            dataset.append(datetime(2018, 1, 6, 12, 0, 0), 250)
+    #Appended data is folded into the rollups, earlier data rebuilds them:
+    rolled.downsample_sum()
+    assert rolled._rollups is pyramid
+    for dataset in (container, rolled):
+        dataset.append(datetime(2018, 1, 2, 12, 0, 0), 100)
+    assert_equal(rolled.downsample_sum()._values, 
+                 container.downsample_sum()._values)
+    assert not rolled._rollups is pyramid
+
+def test_extend(data):
+    """Test that extended rollups match rollups built from all data, also
+    when the appended values widen or leave the histogram grid.
+    """
+    timestamps, values = data
+    values = values/2.
+    values[-10:] = 300
+    for chunks in ((1000, 1001, 3000), (10, 2000, len(values) - 5)):
+        pyramid = RollupPyramid(timestamps[:chunks[0]], values[:chunks[0]], 
+                                timestamps[0])
+        for unchanged, end in zip(chunks, chunks[1:] + (len(values),)):
+            #The last unchanged point is changed and passed again:
+            pyramid.extend(timestamps[:end], values[:end], unchanged - 1)
+        expected = RollupPyramid(timestamps, values, timestamps[0])
+        for resolution in (timedelta(minutes=5), timedelta(hours=1), 
+                           timedelta(days=1)):
+            for how in ('sum', 'min', 'count'):
+                assert_equal(pyramid.reduce(how, resolution), 
+                             expected.reduce(how, resolution))
+        for resolution in (timedelta(hours=1), timedelta(days=1)):
+            edges = arange(20, 310, 5)
+            assert (pyramid.histogram(edges, resolution) == 
+                    expected.histogram(edges, resolution)).all()
+    pyramid.extend(timestamps, values + 0.1, len(values) - 1)
+    assert pyramid.histogram(arange(20, 90, 5), timedelta(hours=1)) is None
+
+def test_histogram_columns(data):
+    """Test that histograms are not stored for values spanning too many value
+    bins, and that containers then compute histograms from the data.
+    """
+    timestamps, values = data
+    values = values.copy()
+    values[100] = 10**7
+    pyramid = RollupPyramid(timestamps, values, timestamps[0])
+    assert pyramid.histogram(arange(20, 90, 5), timedelta(hours=1)) is None
+    expected = DatasetContainer('steps')
+    rolled = DatasetContainer('steps')
+    for container in (expected, rolled):
+        container.append_many(timestamps, values)
+        container.time_resolution(timedelta(hours=1))
+    rolled.build_rollups()
+    res = rolled.downsample_histogram(hist_min=0, hist_max=200, resolution=10)
+    assert not rolled._current_rollups() is None
+    assert (res._histogram == expected.downsample_histogram(
+        hist_min=0, hist_max=200, resolution=10)._histogram).all()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import tempfile
+from itertools import count
+from connection_pool import URI_SUPPORTED, open_connection
+
+#Numbers distinguishing the in-memory copies of a process:
+_copy_numbers = count()
+
+class WorkingCopy:
+    """A private snapshot of a database file, in memory or in a temporary
+    file, that indexes can be added to without modifying the original. The
+    snapshot is taken with the SQLite backup API where available, and
+    otherwise by copying every table and index into the snapshot with its 
+    original schema. In-memory snapshots are shared between connections 
+    through a shared cache URI, so they require URI support."""
+
+    def __init__(self, filename, in_memory=True):
+        """Take the snapshot.
+
+        Parameters
+        ----------
+            filename : string
+                The name of the SQLite database file to copy. It is only
+                read from.
+            in_memory : bool
+                If True, the snapshot is kept in memory, otherwise in a
+                temporary file. Without URI support, sqlite3.NotSupportedError
+                is raised if True.
+                (Default: True)
+
+        Returns
+        -------
+            None
+        """
+        if not os.path.isfile(filename):
+            raise sqlite3.OperationalError('unable to open database file')
+        if in_memory and not URI_SUPPORTED:
+            raise sqlite3.NotSupportedError('In-memory working copies require '
+                                            'URI support of sqlite3, use a '
+                                            'temporary file instead')
+        self._tempfile = None
+        if in_memory:
+            self.filename = 'file:gadgetbridge-working-copy-{0:d}-{1:d}?'\
+                'mode=memory&cache=shared'.format(os.getpid(),
+                                                  next(_copy_numbers))
+            self.uri = True
+        else:
+            handle, self._tempfile = tempfile.mkstemp(suffix='.db')
+            os.close(handle)
+            self.filename = self._tempfile
+            self.uri = False
+        #An in-memory database lives as long as a connection to it is open:
+        self._keeper = open_connection(self.filename, uri=self.uri)
+        source = open_connection(filename, read_only=True)
+        try:
+            if hasattr(source, 'backup'):
+                source.backup(self._keeper)
+            else:
+                self._copy_tables(filename)
+        finally:
+            source.close()
+
+    def _copy_tables(self, filename):
+        """Copy the tables and indexes of a database file into the snapshot,
+        for sqlite3 versions without the backup API. The indexes are created
+        once the tables are filled.
+
+        Parameters
+        ----------
+            filename : string
+                The name of the SQLite database file to copy
+
+        Returns
+        -------
+            None
+        """
+        self._keeper.execute('ATTACH DATABASE ? AS SOURCE;', (filename,))
+        try:
+            tables = self._keeper.execute(
+                "SELECT name, sql FROM SOURCE.sqlite_master WHERE type = "
+                "'table' AND name NOT LIKE 'sqlite_%';").fetchall()
+            for name, sql in tables:
+                self._keeper.execute(sql)
+                self._keeper.execute('INSERT INTO main."{name:s}" SELECT * '
+                                     'FROM SOURCE."{name:s}";'.format(
+                                         name=name))
+            #Indexes of primary keys and unique constraints have no SQL and
+            #were created with their tables:
+            indexes = self._keeper.execute(
+                "SELECT sql FROM SOURCE.sqlite_master WHERE type = 'index' "
+                "AND sql IS NOT NULL;").fetchall()
+            for sql, in indexes:
+                self._keeper.execute(sql)
+            self._keeper.commit()
+        finally:
+            self._keeper.execute('DETACH DATABASE SOURCE;')
+
+    def create_index(self, table, columns):
+        """Create an index on columns of a table of the snapshot, unless it
+        already exists.
+
+        Parameters
+        ----------
+            table : string
+                The name of the table
+            columns : list
+                The names of the indexed columns, in order
+
+        Returns
+        -------
+            string
+                The name of the index
+        """
+        name = '_'.join(['WORKING_COPY', table] + list(columns))
+        self._keeper.execute('CREATE INDEX IF NOT EXISTS "{name:s}" ON '
+                             '"{table:s}" ({columns:s});'.format(
+                                 name=name, table=table,
+                                 columns=', '.join(columns)))
+        self._keeper.commit()
+        return name
+
+    def close(self):
+        """Delete the snapshot.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+        self._keeper.close()
+        if not self._tempfile is None and os.path.isfile(self._tempfile):
+            os.remove(self._tempfile)
+        self._tempfile = None